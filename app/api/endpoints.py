@@ -1,16 +1,40 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Query
-from fastapi.responses import StreamingResponse, JSONResponse
-from ..core.model import predict, get_label_name
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from ..core import config, registry, runtime
+from ..core.model import get_label_name, label_id, model_id, DetectionOptions, INPUT_MIN_SIZE, INPUT_MAX_SIZE, PUBLAYNET_LABELS
+from ..core.metrics import stage, IMAGE_MEGAPIXELS, DETECTIONS_PER_PAGE
+from ..core.cache import get_detection_cache, get_render_cache, image_key, derive_key
+from ..core.executor import get_executor, QueueFullError, InferenceTimeoutError
+from ..core.memory import MemoryBudgetError, estimate_image_bytes, get_memory_budget, rss_bytes
+from ..core.near_duplicates import get_near_duplicate_index
+from ..utils.detections import ENCODINGS, Detections, encode_detections, packb
 from ..utils.drawing import draw_detections
-from ..utils.eval import evaluate_detections, parse_coco_annotations
-import numpy as np
-import cv2
+from ..utils.eval import DetectionAccumulator, ImageOutcome, evaluate_detections, parse_coco_annotations
+from ..utils.images import (
+    OUTPUT_FORMATS, BufferPool, ImageTooLargeError, UploadTooLargeError,
+    decode_image, decoded_size, encode_image, image_size, read_upload,
+)
+from ..utils.pages import archive_kind, iter_archive_images, is_pdf, open_pdf, iter_pdf_pages
 from pydantic import BaseModel
-from typing import List
-import io
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import binascii
+import json
+import logging
+import time
+import uuid
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Label vocabulary of Detections built from model output (ids follow PUBLAYNET_LABELS)
+LABEL_NAMES = tuple(PUBLAYNET_LABELS.values())
+
 class BoundingBox(BaseModel):
     x_1: float
     y_1: float
@@ -22,54 +46,724 @@ class BoundingBox(BaseModel):
 class DetectionResponse(BaseModel):
     detections: List[BoundingBox]
 
+class OutputImage(NamedTuple):
+    """Encoding of the annotated image returned by format=image|both."""
+    format: str
+    quality: Optional[int]
+    compression: Optional[int]
+    max_size: Optional[int]
+    multipart: bool
+
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_FORMATS[self.format][1]
+
+
+def _output_image(
+    image_format: str = Query(config.OUTPUT_IMAGE_FORMAT, enum=list(OUTPUT_FORMATS)),  # annotated image encoding
+    quality: int = Query(config.OUTPUT_IMAGE_QUALITY, ge=1, le=100),  # jpeg/webp quality
+    compression: Optional[int] = Query(None, ge=0, le=9),  # png compression level
+    max_size: Optional[int] = Query(None, ge=16),  # thumbnail: longest side in pixels
+    multipart: bool = Query(False),  # format=both: multipart/mixed with the raw image instead of base64 in JSON
+) -> OutputImage:
+    return OutputImage(image_format, quality, compression, max_size, multipart)
+
+
+class DetectControls(NamedTuple):
+    """Per-request detection controls of /detect/: model-side options and an optional crop."""
+    options: DetectionOptions
+    crop: Optional[Tuple[float, float, float, float]]  # x1, y1, x2, y2 in original image pixels
+
+
+def _detect_controls(
+    classes: Optional[List[str]] = Query(None, description=f"only these classes (repeated or comma-separated): {', '.join(PUBLAYNET_LABELS.values())}"),
+    score_threshold: Optional[float] = Query(None, ge=0.0, le=1.0),  # default: the model's 0.5
+    max_detections: Optional[int] = Query(None, ge=1),  # top-k by score
+    crop: Optional[str] = Query(None, description="x1,y1,x2,y2: detect only within this rectangle (image pixels)"),
+) -> DetectControls:
+    class_ids = None
+    if classes:
+        names = [name.strip() for value in classes for name in value.split(",") if name.strip()]
+        class_ids = frozenset(label_id(name) for name in names)
+        if None in class_ids:
+            unknown = [name for name in names if label_id(name) is None]
+            raise HTTPException(status_code=400, detail=f"Unknown classes: {', '.join(unknown)}.")
+    rect = None
+    if crop is not None:
+        try:
+            rect = tuple(float(v) for v in crop.split(","))
+        except ValueError:
+            rect = ()
+        if len(rect) != 4 or rect[2] <= rect[0] or rect[3] <= rect[1]:
+            raise HTTPException(status_code=400, detail="crop must be x1,y1,x2,y2 with x1 < x2 and y1 < y2.")
+    return DetectControls(DetectionOptions(score_threshold, class_ids, max_detections), rect)
+
+
+def _model_choice(
+    model: Optional[str] = Query(None, description=f"registry model: {', '.join(registry.ENABLED_MODELS)}, cascade or ensemble (default {config.DEFAULT_MODEL})"),
+) -> str:
+    try:
+        return registry.resolve_model(model)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _crop(img, crop: Optional[Tuple[float, float, float, float]], scale: Tuple[float, float]):
+    """
+    Cuts the crop rectangle (original image pixels) out of the decoded image before inference.
+    Returns (image, origin of the crop in decoded pixels), or (None, None) if the crop misses the image.
+    """
+    if crop is None:
+        return img, (0.0, 0.0)
+    sx, sy = scale
+    height, width = img.shape[:2]
+    x0, y0 = max(0, int(crop[0] / sx)), max(0, int(crop[1] / sy))
+    x1, y1 = min(width, int(-(-crop[2] // sx))), min(height, int(-(-crop[3] // sy)))
+    if x1 <= x0 or y1 <= y0:
+        return None, None
+    return np.ascontiguousarray(img[y0:y1, x0:x1]), (float(x0), float(y0))
+
+
+class BatchPageResult(BaseModel):
+    """One NDJSON line of /detect/batch."""
+    index: int
+    filename: str
+    page: Optional[int] = None
+    detections: List[BoundingBox] = []
+    error: Optional[str] = None
+
+
+_upload_buffers = BufferPool()
+
+
+@asynccontextmanager
+async def _upload_view(file: UploadFile):
+    """Reads an upload into a pooled buffer and yields a memoryview of its bytes (UploadTooLargeError over MAX_UPLOAD_BYTES)."""
+    buf, view = await run_in_threadpool(read_upload, file.file, _upload_buffers, config.MAX_UPLOAD_BYTES)
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+        except BufferError:
+            # Still referenced somewhere: leave the buffer to the garbage collector
+            return
+        _upload_buffers.release(buf)
+
+
+def _decode_sizes(reduce: bool) -> Tuple[int, int]:
+    """min_size/max_size for decode_image: the model input when reduced decoding applies."""
+    if reduce and config.DECODE_REDUCE and not config.TILE_SIZE:
+        return INPUT_MIN_SIZE, INPUT_MAX_SIZE
+    return 0, 0
+
+
+def _decode_image(contents, reduce: bool = False):
+    """
+    Returns (image, scale). With reduce, large JPEGs are decoded at a fraction of their
+    resolution (never below the model input size; not when tiling, which wants full
+    resolution) and scale maps detections back to original pixel coordinates.
+    Raises UploadTooLargeError/ImageTooLargeError over MAX_UPLOAD_BYTES/MAX_IMAGE_PIXELS.
+    """
+    if config.MAX_UPLOAD_BYTES and len(contents) > config.MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(len(contents), config.MAX_UPLOAD_BYTES)
+    return decode_image(contents, *_decode_sizes(reduce), max_pixels=config.MAX_IMAGE_PIXELS)
+
+
+def _memory_estimate(contents, reduce: bool = False, render: bool = False, inline: bool = False) -> int:
+    """
+    Bytes to reserve for an encoded page (core/memory.py), from its header. Pages over
+    MAX_IMAGE_PIXELS raise ImageTooLargeError here already; formats without a readable
+    header (TIFF) are assumed to decode to 10x their file size.
+    """
+    full = image_size(contents)
+    if full is not None and config.MAX_IMAGE_PIXELS and full[0] * full[1] > config.MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(full[0], full[1], config.MAX_IMAGE_PIXELS)
+    size = decoded_size(contents, *_decode_sizes(reduce))
+    pixels = size[0] * size[1] if size is not None else 10 * len(contents) // 3
+    return estimate_image_bytes(pixels, len(contents), render=render, inline=inline)
+
+
+def _budget_error(exc: MemoryBudgetError) -> HTTPException:
+    if exc.too_large:
+        return HTTPException(status_code=413, detail=str(exc))
+    return HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
+
+@asynccontextmanager
+async def _admitted_image(file: UploadFile, reduce: bool = False, render: bool = False, inline: bool = False):
+    """
+    Reads and decodes an uploaded image under the memory budget and yields (image, scale);
+    the reservation is held until the block ends. The size limits give 413; no room in the
+    budget within MEMORY_WAIT_S gives 503 (413 when the page alone exceeds the budget).
+    """
+    budget = get_memory_budget()
+    try:
+        async with _upload_view(file) as contents:
+            nbytes = _memory_estimate(contents, reduce, render, inline)
+            await budget.acquire(nbytes)
+            try:
+                img, scale = await _decode(contents, reduce=reduce)
+            except BaseException:
+                budget.release(nbytes)
+                raise
+    except (UploadTooLargeError, ImageTooLargeError) as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except MemoryBudgetError as exc:
+        raise _budget_error(exc)
+    try:
+        yield img, scale
+    finally:
+        budget.release(nbytes)
+
+
+@asynccontextmanager
+async def _admitted_page(payload):
+    """
+    Reserves memory for one page of a batch, job or session (waiting as long as it takes)
+    and decodes it. payload is encoded bytes, a rendered image (PDF page) or the error the
+    page iterator refused it with (over a limit, PDF page that failed to render). Yields (image, scale, error); image is None and error says
+    why when the page is over a limit, larger than the whole budget or cannot be decoded.
+    """
+    if isinstance(payload, Exception):
+        yield None, (1.0, 1.0), str(payload)
+        return
+    budget = get_memory_budget()
+    img, scale, error = None, (1.0, 1.0), None
+    try:
+        nbytes = payload.nbytes if isinstance(payload, np.ndarray) else _memory_estimate(payload, reduce=True)
+        await budget.acquire(nbytes, wait_forever=True)
+    except (ImageTooLargeError, MemoryBudgetError) as exc:
+        yield None, scale, str(exc)
+        return
+    try:
+        if isinstance(payload, np.ndarray):
+            img = payload
+        else:
+            try:
+                img, scale = await _decode(payload, reduce=True)
+            except (UploadTooLargeError, ImageTooLargeError) as exc:
+                error = str(exc)
+            else:
+                if img is None:
+                    error = "Could not decode image."
+        del payload
+        yield img, scale, error
+    finally:
+        budget.release(nbytes)
+
+
+def _cache_get(img, options: Optional[DetectionOptions] = None, model_name: str = config.DEFAULT_MODEL):
+    cache = get_detection_cache()
+    if options is None or options.is_default:
+        key = image_key(img, model_id(model_name))
+    else:
+        key = image_key(img, model_id(model_name), options.cache_part())
+    return key, cache.get(key)
+
+
+async def _cached_infer(
+    img, wait_for_slot: bool = False, options: Optional[DetectionOptions] = None, model: Optional[str] = None
+):
+    """
+    Returns (cache_key, layout) of a registry model, or of the cascade/ensemble of models
+    (model=cascade|ensemble, core/registry.py); None is DEFAULT_MODEL. Every model's
+    result is cached on its own, so a cascade escalating a page again or an ensemble
+    sharing a model with single-model requests reuses it.
+    """
+    if model == "cascade":
+        cheap, expensive = registry.CASCADE_MODELS
+        key, layout = await _cached_model_infer(img, wait_for_slot, options, cheap)
+        escalate = registry.page_confidence(layout) < config.CASCADE_MIN_CONFIDENCE
+        registry.usage.route(escalate)
+        if escalate:
+            key, layout = await _cached_model_infer(img, wait_for_slot, options, expensive)
+        return key, layout
+    if model == "ensemble":
+        results = await asyncio.gather(*(
+            _cached_model_infer(img, wait_for_slot, options, name) for name in registry.ENSEMBLE_MODELS
+        ))
+        keys = [key for key, _ in results]
+        layout = await run_in_threadpool(registry.fuse_layouts, [layout for _, layout in results])
+        return (derive_key(*keys, "ensemble") if None not in keys else None), layout
+    return await _cached_model_infer(img, wait_for_slot, options, model or config.DEFAULT_MODEL)
+
+
+async def _cached_model_infer(img, wait_for_slot: bool, options: Optional[DetectionOptions], model_name: str):
+    """
+    Returns (cache_key, layout). Looks the image up in the detection cache, then in the
+    near-duplicate index (rescans of known templates), and only runs inference on a miss.
+    cache_key is None when the cache is disabled. The model and non-default options are
+    part of the cache key; the near-duplicate index only holds full (default options)
+    layouts of DEFAULT_MODEL.
+    Cached layouts are shared between requests and must not be mutated.
+    """
+    key = layout = signature = None
+    if get_detection_cache().enabled:
+        key, layout = await run_in_threadpool(_cache_get, img, options, model_name)
+        if layout is not None:
+            return key, layout
+    near_duplicates = get_near_duplicate_index()
+    if near_duplicates.enabled and (options is None or options.is_default) and model_name == config.DEFAULT_MODEL:
+        signature, layout = await run_in_threadpool(near_duplicates.lookup, img)
+        if layout is not None:
+            if key is not None:
+                await run_in_threadpool(get_detection_cache().put, key, layout)
+            return key, layout
+    start = time.perf_counter()
+    slot_wait = config.INFERENCE_SLOT_WAIT_S if wait_for_slot else 0.0
+    layout = await get_executor().predict(img, options, model_name, slot_wait=slot_wait)
+    registry.usage.observe(model_name, time.perf_counter() - start)
+    if key is not None:
+        await run_in_threadpool(get_detection_cache().put, key, layout)
+    if signature is not None:
+        await run_in_threadpool(near_duplicates.add, signature, img.shape, layout)
+    return key, layout
+
+
+async def _decode(contents, reduce: bool = False):
+    """Decodes an upload in the threadpool, recording decode time and page size. Returns (image, scale)."""
+    with stage("decode"):
+        img, scale = await run_in_threadpool(_decode_image, contents, reduce)
+    if img is not None:
+        IMAGE_MEGAPIXELS.observe(img.shape[0] * img.shape[1] / 1e6)
+    return img, scale
+
+
+async def _predict(img, options: Optional[DetectionOptions] = None, model: Optional[str] = None):
+    """
+    Runs detection on the inference worker pool (or serves it from the cache),
+    keeping the event loop free. Returns (cache_key, layout).
+    """
+    try:
+        with stage("inference"):
+            key, layout = await _cached_infer(img, options=options, model=model)
+        DETECTIONS_PER_PAGE.observe(len(layout))
+        return key, layout
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full, retry later.", headers={"Retry-After": "1"})
+    except InferenceTimeoutError:
+        raise HTTPException(status_code=504, detail="Inference timed out.")
+
+
+def _detections(layout) -> Detections:
+    """A Layout as Detections, in the coordinates of the image it was detected on."""
+    return Detections.from_layout(layout, LABEL_NAMES, label_name=get_label_name)
+
+
+def _layout_to_detections(
+    layout, scale: Tuple[float, float] = (1.0, 1.0), origin: Tuple[float, float] = (0.0, 0.0)
+) -> List[dict]:
+    """
+    Serializes a Layout into BoundingBox-shaped dicts, in original image coordinates:
+    boxes are shifted by `origin` (crop offset, decoded pixels) and scaled by `scale`.
+    """
+    return _detections(layout).mapped(scale, origin).to_records()
+
+
+def _layout_to_preds(layout, scale: Tuple[float, float] = (1.0, 1.0)) -> Detections:
+    """Predictions for evaluate_detections/draw_comparison, in original image coordinates."""
+    return _detections(layout).mapped(scale)
+
+
+def _metrics(eval_result: dict) -> dict:
+    """The metrics part of an /evaluate/ response."""
+    return {k: eval_result[k] for k in ("precision", "recall", "f1", "mean_iou", "ap50", "tp", "fp", "fn")}
+
+
+async def _render_image(render_key: Optional[str], output: OutputImage, draw, *args) -> bytes:
+    """Draws and encodes an annotated image, reusing a cached rendering when available."""
+    cache = get_render_cache()
+    if render_key is not None:
+        render_key = derive_key(render_key, output.format, output.quality, output.compression, output.max_size)
+    if render_key is not None and cache.enabled:
+        data = cache.get(render_key)
+        if data is not None:
+            return data
+    with stage("draw"):
+        annotated = await run_in_threadpool(draw, *args)
+    with stage("encode"):
+        try:
+            data = await run_in_threadpool(
+                encode_image, annotated, output.format, output.quality, output.compression, output.max_size
+            )
+        except ValueError:
+            raise HTTPException(status_code=500, detail="Failed to encode annotated image.")
+    if render_key is not None and cache.enabled:
+        cache.put(render_key, data)
+    return data
+
+
+def _packb(payload: dict) -> bytes:
+    try:
+        return packb(payload)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=501, detail=str(exc))
+
+
+def _encoded_response(payload: dict, encoding: str = "json") -> Response:
+    if encoding == "msgpack":
+        return Response(_packb(payload), media_type="application/msgpack")
+    return JSONResponse(payload)
+
+
+def _image_response(payload: dict, data: bytes, output: OutputImage, encoding: str = "json") -> Response:
+    """
+    format=both: JSON with the image as base64 (msgpack: raw bytes under "image"), or
+    multipart/mixed with JSON (msgpack) and raw image parts.
+    The base64 text goes into the JSON body as bytes, without a str copy or JSON escaping.
+    """
+    if not output.multipart:
+        if encoding == "msgpack":
+            payload["image"] = data
+            return _encoded_response(payload, encoding)
+        # The object is written field by field, each value serialized on its own, with the image last
+        parts = [b"{"]
+        for name, value in payload.items():
+            parts += [json.dumps(name).encode("utf-8"), b": ", json.dumps(value).encode("utf-8"), b", "]
+        parts += [b'"image_base64": "', binascii.b2a_base64(data, newline=False), b'"}']
+        return Response(b"".join(parts), media_type="application/json")
+    boundary = uuid.uuid4().hex
+    if encoding == "msgpack":
+        media_type, part = "application/msgpack", _packb(payload)
+    else:
+        media_type, part = "application/json", json.dumps(payload).encode("utf-8")
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: {media_type}\r\n\r\n".encode("ascii"),
+        part,
+        f"\r\n--{boundary}\r\nContent-Type: {output.media_type}\r\n\r\n".encode("ascii"),
+        data,
+        f"\r\n--{boundary}--\r\n".encode("ascii"),
+    ])
+    return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+
+
+@router.get("/stats/cache")
+def cache_stats():
+    """Hit/miss counters of the detection and rendered-image caches and the near-duplicate index."""
+    return {
+        "detections": get_detection_cache().stats(),
+        "renders": get_render_cache().stats(),
+        "near_duplicates": get_near_duplicate_index().stats(),
+    }
+
+
+@router.get("/stats/inference")
+def inference_stats():
+    """Worker pool occupancy and micro-batching stats (batch sizes, queue wait)."""
+    return get_executor().stats()
+
+
+@router.get("/stats/models")
+def model_stats():
+    """Served models, models loaded per inference worker, per-model latency and the cascade's escalation rate."""
+    return {**registry.diagnostics(), "batching": get_executor().batching()}
+
+
+@router.get("/stats/memory")
+def memory_stats():
+    """Size limits, the memory budget's reservations and queue, and the process RSS."""
+    rss = rss_bytes()
+    return {
+        "max_upload_bytes": config.MAX_UPLOAD_BYTES,
+        "max_image_pixels": config.MAX_IMAGE_PIXELS,
+        "budget": get_memory_budget().stats(),
+        "rss_mb": rss / 2**20 if rss is not None else None,
+    }
+
+
+@router.get("/stats/runtime")
+def runtime_stats():
+    """CPU budget of the node, torch thread settings of this process and the inference concurrency limit."""
+    return {**runtime.diagnostics(), "concurrency": get_executor().concurrency()}
+
 
 @router.post("/detect/")
 async def detect_layout(
     file: UploadFile = File(...),
-    format: str = Query("json", enum=["json", "image", "both"])  # response format
+    format: str = Query("json", enum=["json", "image", "both"]),  # response format
+    dpi: int = Query(config.PDF_DPI, ge=36, le=600),  # PDF rasterization resolution
+    output: OutputImage = Depends(_output_image),
+    controls: DetectControls = Depends(_detect_controls),
+    encoding: str = Query("json", enum=list(ENCODINGS)),  # detections: json records, columnar JSON or msgpack
+    model: str = Depends(_model_choice),
 ):
     """
     Accepts an image file and returns detected elements.
-    format=json|image|both
+    format=json|image|both; the image is encoded as set by image_format/quality/compression/max_size
+    classes/score_threshold/max_detections are applied inside the model's ROI head; with crop
+    only that rectangle is run through the model (and returned as the annotated image),
+    detections stay in full-image coordinates.
+    encoding=columnar returns the detections as {names, labels, scores, boxes} arrays,
+    encoding=msgpack the same columns as binary arrays in a msgpack body.
+    A PDF is rasterized page by page and its detections are streamed as NDJSON
+    (one BatchPageResult line per page); only format=json and encoding=json are supported for PDFs.
+    model picks a registry model, or cascade/ensemble of models (core/registry.py).
     """
+    if is_pdf(file.filename, file.content_type):
+        if format != "json" or encoding != "json":
+            raise HTTPException(status_code=400, detail="PDF input supports format=json and encoding=json only.")
+        pdf = await _open_pdf_upload(file)
+        return StreamingResponse(
+            _stream_batch(_iter_pdf(file.filename or "", pdf, dpi), config.BATCH_CONCURRENCY, controls, model),
+            media_type="application/x-ndjson",
+        )
+
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File provided is not an image.")
 
-    contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # JSON-only responses never touch the pixels again, so large JPEGs can be decoded reduced
+    inline = format == "both" and not output.multipart
+    async with _admitted_image(file, reduce=format == "json", render=format != "json", inline=inline) as (img, scale):
+        if img is None:
+            raise HTTPException(status_code=400, detail="Could not decode image.")
+        img, origin = _crop(img, controls.crop, scale)
+        if img is None:
+            raise HTTPException(status_code=400, detail="crop lies outside the image.")
+
+        key, layout = await _predict(img, controls.options, model)
+
+        with stage("postprocess"):
+            detections = _detections(layout)
+            results = encode_detections(detections.mapped(scale, origin), encoding)
+
+        if format == "json":
+            return _encoded_response({"detections": results}, encoding)
+
+        render_key = derive_key(key, "detect") if key is not None else None
+        # The decoded image is private to this request: annotate it in place
+        data = await _render_image(render_key, output, partial(draw_detections, inplace=True), img, detections)
+        del img
+
+        if format == "image":
+            return Response(data, media_type=output.media_type)
+
+        return _image_response({"detections": results}, data, output, encoding)
+
+
+async def _iter_pdf(filename: str, pdf, dpi: int):
+    """
+    Yields (filename, page_number, image) per PDF page; each page is rendered in the threadpool
+    on demand (pages over MAX_IMAGE_PIXELS at this dpi as an ImageTooLargeError instead, pages
+    that fail to render as a ValueError).
+    """
+    async for page, image in iterate_in_threadpool(iter_pdf_pages(pdf, dpi, config.MAX_IMAGE_PIXELS)):
+        yield filename, page, image
+
+
+def _upload_size(upload: UploadFile) -> int:
+    """Size of an upload in bytes, without reading it."""
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, 2)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    return size
+
+
+def _oversized(upload: UploadFile) -> Optional[UploadTooLargeError]:
+    """UploadTooLargeError when an upload is over MAX_UPLOAD_BYTES (checked without reading it), else None."""
+    size = _upload_size(upload)
+    if config.MAX_UPLOAD_BYTES and size > config.MAX_UPLOAD_BYTES:
+        return UploadTooLargeError(size, config.MAX_UPLOAD_BYTES)
+    return None
 
-    if img is None:
-        raise HTTPException(status_code=400, detail="Could not decode image.")
 
-    layout = predict(img)
+async def _read_page(upload: UploadFile):
+    """An uploaded page's bytes, or an UploadTooLargeError (unread) over MAX_UPLOAD_BYTES."""
+    error = _oversized(upload)
+    if error is not None:
+        return error
+    return await upload.read()
 
-    results = [
-        {
-            "x_1": block.block.x_1,
-            "y_1": block.block.y_1,
-            "x_2": block.block.x_2,
-            "y_2": block.block.y_2,
-            "type": get_label_name(block.type),
-            "score": block.score,
-        } for block in layout
-    ]
 
-    if format == "json":
-        return JSONResponse({"detections": results})
+def _check_upload_size(upload: UploadFile):
+    """413 when an upload is over MAX_UPLOAD_BYTES (checked without reading it)."""
+    error = _oversized(upload)
+    if error is not None:
+        raise HTTPException(status_code=413, detail=f"File {upload.filename}: {error}")
 
-    annotated = draw_detections(img, layout)
-    ok, buf = cv2.imencode(".png", annotated)
-    if not ok:
-        raise HTTPException(status_code=500, detail="Failed to encode annotated image.")
 
-    if format == "image":
-        return StreamingResponse(io.BytesIO(buf.tobytes()), media_type="image/png")
+async def _read_upload(upload: UploadFile) -> bytes:
+    """A whole upload's bytes (annotations, job files); 413 over MAX_UPLOAD_BYTES, before reading any."""
+    _check_upload_size(upload)
+    return await upload.read()
 
-    # both: return multipart? simplest: return json with base64 image
-    import base64
-    b64 = base64.b64encode(buf.tobytes()).decode("ascii")
-    return JSONResponse({"detections": results, "image_base64": b64})
+
+async def _iter_batch_uploads(files: List[UploadFile], pdfs: dict, dpi: int):
+    """
+    Yields (filename, page_number, payload) for each uploaded page, expanding zip/tar archives
+    and PDFs lazily. payload is encoded image bytes or, for PDF pages, a rendered BGR image;
+    files and archive members over MAX_UPLOAD_BYTES are not read (payload is the UploadTooLargeError).
+    """
+    for upload in files:
+        filename = upload.filename or ""
+        if id(upload) in pdfs:
+            async for item in _iter_pdf(filename, pdfs[id(upload)], dpi):
+                yield item
+            continue
+        kind = archive_kind(upload.filename, upload.content_type)
+        if kind is not None:
+            async for name, contents in iterate_in_threadpool(iter_archive_images(upload.file, kind, config.MAX_UPLOAD_BYTES)):
+                yield name, None, contents
+        else:
+            yield filename, None, await _read_page(upload)
+
+
+async def _detect_page(
+    index: int, filename: str, page: Optional[int], payload,
+    controls: Optional[DetectControls] = None, model: Optional[str] = None,
+) -> dict:
+    """One BatchPageResult dict; a page that fails (decode, inference, postprocessing) gets an error, never raises."""
+    result = {"index": index, "filename": filename}
+    if page is not None:
+        result["page"] = page
+    result["detections"] = []
+    try:
+        async with _admitted_page(payload) as (img, scale, error):
+            del payload
+            if img is None:
+                result["error"] = error
+                return result
+            options, origin = None, (0.0, 0.0)
+            if controls is not None:
+                options = controls.options
+                img, origin = _crop(img, controls.crop, scale)
+                if img is None:
+                    # Nothing of the page inside the crop
+                    return result
+            # Pages of an accepted batch wait for a slot instead of failing
+            with stage("inference"):
+                _, layout = await _cached_infer(img, wait_for_slot=True, options=options, model=model)
+        DETECTIONS_PER_PAGE.observe(len(layout))
+        with stage("postprocess"):
+            result["detections"] = _layout_to_detections(layout, scale, origin)
+    except InferenceTimeoutError:
+        result["error"] = "Inference timed out."
+    except QueueFullError as exc:
+        result["error"] = str(exc)
+    except Exception as exc:
+        # Fails this page only: the other pages of the batch are still detected and streamed
+        logger.warning("Detection failed on %s (page %s)", filename, page, exc_info=True)
+        result["detections"] = []
+        result["error"] = f"Detection failed: {str(exc) or type(exc).__name__}"
+    return result
+
+
+async def _detect_pages(pages, concurrency: int, controls: Optional[DetectControls] = None, model: Optional[str] = None):
+    """
+    Runs detection on pages with at most `concurrency` in flight and yields one
+    BatchPageResult dict per page in completion order. Pulling the next page (decode, PDF
+    rasterization) overlaps with inference of the pages already in flight.
+    """
+    pending = set()
+    index = 0
+    try:
+        async for filename, page, payload in pages:
+            pending.add(asyncio.ensure_future(_detect_page(index, filename, page, payload, controls, model)))
+            index += 1
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Client disconnected or archive failed mid-stream
+        for task in pending:
+            task.cancel()
+
+
+async def _stream_batch(pages, concurrency: int, controls: Optional[DetectControls] = None, model: Optional[str] = None):
+    """NDJSON lines of _detect_pages."""
+    async for result in _detect_pages(pages, concurrency, controls, model):
+        yield json.dumps(result) + "\n"
+
+
+def _coco_ground_truth(index: dict, ann_bytes: bytes, name: str) -> list:
+    """Ground truth of one image of a job or session: the COCO entry with its file name, else as /evaluate/ parses it."""
+    return index[name] if name in index else parse_coco_annotations(ann_bytes, name)
+
+
+async def _evaluate_page(
+    name: str, payload, ground_truth: Callable[[str], list], matcher: DetectionAccumulator,
+    describe: Callable[[Detections, list, ImageOutcome], dict], model: Optional[str] = None,
+) -> Tuple[dict, Optional[ImageOutcome]]:
+    """
+    Detects one image of an evaluation job or session and matches it with matcher.match
+    against ground_truth(name); describe(preds, gts, outcome) gives the per-image result
+    fields. Both run in the threadpool. Returns (result, outcome); an image that fails
+    (decode, inference, ground truth, matching) gets an error and no outcome, never raises.
+    """
+    result = {"filename": name}
+    try:
+        async with _admitted_page(payload) as (img, scale, error):
+            del payload
+            if img is None:
+                result["error"] = error
+                return result, None
+            _, layout = await _cached_infer(img, wait_for_slot=True, model=model)
+        preds = _layout_to_preds(layout, scale)
+
+        def evaluate():
+            gts = ground_truth(name)
+            outcome = matcher.match(preds, gts)
+            return outcome, describe(preds, gts, outcome)
+
+        with stage("evaluate"):
+            outcome, fields = await run_in_threadpool(evaluate)
+    except InferenceTimeoutError:
+        result["error"] = "Inference timed out."
+        return result, None
+    except QueueFullError as exc:
+        result["error"] = str(exc)
+        return result, None
+    except Exception as exc:
+        # Fails this image only: the others are still evaluated and counted
+        logger.warning("Evaluation failed on %s", name, exc_info=True)
+        result["error"] = f"Evaluation failed: {str(exc) or type(exc).__name__}"
+        return result, None
+    result.update(fields)
+    return result, outcome
+
+
+async def _open_pdf_upload(upload: UploadFile):
+    try:
+        return await run_in_threadpool(open_pdf, upload.file)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Could not open PDF {upload.filename}.")
+
+
+@router.post("/detect/batch")
+async def detect_layout_batch(
+    files: List[UploadFile] = File(...),
+    dpi: int = Query(config.PDF_DPI, ge=36, le=600),  # PDF rasterization resolution
+    model: str = Depends(_model_choice),
+):
+    """
+    Accepts many images, PDFs and zip/tar archives of images (repeated `files` fields)
+    and streams detections back as NDJSON, one BatchPageResult line per page,
+    as soon as each page finishes. Lines carry `index` (upload order) since
+    they are emitted in completion order.
+    """
+    pdfs = {}
+    try:
+        for upload in files:
+            if is_pdf(upload.filename, upload.content_type):
+                pdfs[id(upload)] = await _open_pdf_upload(upload)
+            elif archive_kind(upload.filename, upload.content_type) is None and not (upload.content_type or "").startswith("image/"):
+                raise HTTPException(status_code=400, detail=f"File {upload.filename} is neither an image, a PDF nor a zip/tar archive.")
+    except HTTPException:
+        for pdf in pdfs.values():
+            pdf.close()
+        raise
+
+    return StreamingResponse(
+        _stream_batch(_iter_batch_uploads(files, pdfs, dpi), config.BATCH_CONCURRENCY, model=model),
+        media_type="application/x-ndjson",
+    )
 
 
 @router.post("/evaluate/")
@@ -78,6 +772,8 @@ async def evaluate_layout(
     annotations: UploadFile = File(...),
     iou_threshold: float = Query(0.5, ge=0.0, le=1.0),
     format: str = Query("json", enum=["json", "image", "both"]),
+    output: OutputImage = Depends(_output_image),
+    model: str = Depends(_model_choice),
 ):
     """
     Accepts an image file and a COCO (or simple) annotations JSON file.
@@ -86,70 +782,43 @@ async def evaluate_layout(
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File provided is not an image.")
 
-    image_bytes = await file.read()
-    ann_bytes = await annotations.read()
+    ann_bytes = await _read_upload(annotations)
 
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None:
-        raise HTTPException(status_code=400, detail="Could not decode image.")
+    # Ground truth is in original pixels: preds are scaled back when the image was decoded reduced
+    inline = format == "both" and not output.multipart
+    async with _admitted_image(file, reduce=format == "json", render=format != "json", inline=inline) as (img, (sx, sy)):
+        if img is None:
+            raise HTTPException(status_code=400, detail="Could not decode image.")
 
-    # Run detection
-    layout = predict(img)
+        # Run detection (cached by image content, so re-evaluating with another threshold skips inference)
+        key, layout = await _predict(img, model=model)
 
-    # Convert predictions to eval format
-    preds = [
-        {
-            "bbox": [block.block.x_1, block.block.y_1, block.block.x_2, block.block.y_2],
-            "label": get_label_name(block.type),
-            "score": float(block.score),
-        }
-        for block in layout
-    ]
+        # Convert predictions to eval format
+        with stage("postprocess"):
+            preds = _layout_to_preds(layout, (sx, sy))
 
-    # Parse annotations (COCO or simple). Do not rely on content-type; validate by parsing
-    try:
-        gts = parse_coco_annotations(ann_bytes, image_filename=file.filename)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid annotations JSON.")
-
-    # Evaluate
-    eval_result = evaluate_detections(preds, gts, iou_threshold=iou_threshold, require_label_match=True)
-
-    if format == "json":
-        return JSONResponse({"metrics": {
-            "precision": eval_result["precision"],
-            "recall": eval_result["recall"],
-            "f1": eval_result["f1"],
-            "mean_iou": eval_result["mean_iou"],
-            "ap50": eval_result["ap50"],
-            "tp": eval_result["tp"],
-            "fp": eval_result["fp"],
-            "fn": eval_result["fn"],
-        }})
-
-    # Build comparison image
-    from ..utils.drawing import draw_comparison
-    annotated = draw_comparison(img, preds, gts, eval_result)
-    ok, buf = cv2.imencode(".png", annotated)
-    if not ok:
-        raise HTTPException(status_code=500, detail="Failed to encode annotated image.")
-
-    if format == "image":
-        return StreamingResponse(io.BytesIO(buf.tobytes()), media_type="image/png")
-
-    import base64
-    b64 = base64.b64encode(buf.tobytes()).decode("ascii")
-    return JSONResponse({
-        "metrics": {
-            "precision": eval_result["precision"],
-            "recall": eval_result["recall"],
-            "f1": eval_result["f1"],
-            "mean_iou": eval_result["mean_iou"],
-            "ap50": eval_result["ap50"],
-            "tp": eval_result["tp"],
-            "fp": eval_result["fp"],
-            "fn": eval_result["fn"],
-        },
-        "image_base64": b64
-    })
+        # Parse annotations (COCO or simple). Do not rely on content-type; validate by parsing
+        try:
+            gts = parse_coco_annotations(ann_bytes, image_filename=file.filename)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid annotations JSON.")
+
+        # Evaluate
+        with stage("evaluate"):
+            eval_result = await run_in_threadpool(
+                evaluate_detections, preds, gts, iou_threshold=iou_threshold, require_label_match=True
+            )
+
+        if format == "json":
+            return JSONResponse({"metrics": _metrics(eval_result)})
+
+        # Build comparison image
+        from ..utils.drawing import draw_comparison
+        render_key = derive_key(key, "evaluate", ann_bytes, file.filename, iou_threshold) if key is not None else None
+        data = await _render_image(render_key, output, partial(draw_comparison, inplace=True), img, preds, gts, eval_result)
+        del img
+
+        if format == "image":
+            return Response(data, media_type=output.media_type)
+
+        return _image_response({"metrics": _metrics(eval_result)}, data, output)
@@ -0,0 +1,179 @@
+"""
+Evaluation sessions: dataset metrics accumulated over many /evaluate/sessions calls
+instead of averaging per-image /evaluate/ numbers client-side. The session keeps only
+the per-detection score/label/match state (core/eval_sessions.py), never images.
+
+- POST   /evaluate/sessions                    new session (iou_threshold)
+- POST   /evaluate/sessions/{id}/images        images + annotations JSON, run through the model
+- POST   /evaluate/sessions/{id}/predictions   precomputed predictions with their ground truth
+- GET    /evaluate/sessions/{id}               running summary: TP/FP/FN, P/R/F1, per-class AP, mAP, PR curves
+- DELETE /evaluate/sessions/{id}
+"""
+import asyncio
+from functools import partial
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from ..core import config, metrics
+from ..core.eval_sessions import get_eval_session_store
+from ..utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, index_coco_annotations, precision_recall_f1
+from .endpoints import _coco_ground_truth, _evaluate_page, _model_choice, _read_page, _read_upload
+
+router = APIRouter(prefix="/evaluate/sessions")
+
+
+class Box(BaseModel):
+    bbox: List[float] = Field(..., min_length=4, max_length=4)  # x1, y1, x2, y2
+    label: str
+    score: Optional[float] = None
+
+
+class PredictedImage(BaseModel):
+    predictions: List[Box]
+    ground_truth: List[Box]
+
+
+class PredictionsRequest(BaseModel):
+    images: List[PredictedImage]
+
+
+def _session_status(record: dict) -> dict:
+    return {
+        "session_id": record["id"],
+        "iou_threshold": record["iou_threshold"],
+        "iou_thresholds": record["iou_thresholds"],
+        "images": record["images"],
+        "created": record["created"],
+        "updated": record["updated"],
+        # Dropped at this time unless more images are added
+        "expires": record["expires"],
+    }
+
+
+async def _get_session(session_id: str) -> dict:
+    record = await run_in_threadpool(get_eval_session_store().get, session_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired evaluation session.")
+    return record
+
+
+def _matcher(record: dict) -> DetectionAccumulator:
+    """Accumulator with the session's thresholds, used only for match()."""
+    return DetectionAccumulator(record["iou_thresholds"], iou_threshold=record["iou_threshold"])
+
+
+def _outcome_result(outcome) -> dict:
+    """Per-image counts at the session's iou_threshold."""
+    prf = precision_recall_f1(outcome.tp, outcome.fp, outcome.fn)
+    return {"detections": len(outcome.labels), "tp": outcome.tp, "fp": outcome.fp, "fn": outcome.fn, **prf}
+
+
+async def _store(session_id: str, outcomes: list) -> int:
+    images = await run_in_threadpool(get_eval_session_store().add, session_id, outcomes)
+    if images is None:
+        # Expired or deleted while the images were evaluated
+        raise HTTPException(status_code=404, detail="Unknown or expired evaluation session.")
+    return images
+
+
+@router.post("", status_code=201)
+async def create_session(iou_threshold: float = Query(0.5, ge=0.0, le=1.0)):
+    """
+    Starts an evaluation session. TP/FP/FN, P/R/F1 and the PR curves are computed at
+    iou_threshold, AP per class and mAP at COCO IoU thresholds [.5:.95].
+    """
+    store = get_eval_session_store()
+    await run_in_threadpool(store.purge)
+    record = await run_in_threadpool(store.create, iou_threshold, COCO_IOU_THRESHOLDS)
+    return JSONResponse(_session_status(record), status_code=201)
+
+
+@router.get("/{session_id}")
+async def session_summary(session_id: str, pr_curves: bool = Query(False)):
+    """The session's dataset summary over every image added so far (per-class PR curves with pr_curves=true)."""
+    record = await _get_session(session_id)
+    # Incremental: only images added since the last poll are loaded, an unchanged session reuses its summary
+    summary = await run_in_threadpool(get_eval_session_store().summary, session_id, pr_curves)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired evaluation session.")
+    return {**_session_status(record), "summary": summary}
+
+
+@router.post("/{session_id}/images")
+async def add_images(
+    session_id: str,
+    files: List[UploadFile] = File(...),
+    annotations: UploadFile = File(...),
+    model: str = Depends(_model_choice),
+):
+    """
+    Runs the model on the images and adds them to the session. Ground truth comes from one
+    COCO (or simple) annotations JSON, matched to the images by file name as in /jobs/evaluate.
+    Returns per-image TP/FP/FN and the session's image count.
+    """
+    for upload in files:
+        if not (upload.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"File {upload.filename} is not an image.")
+    record = await _get_session(session_id)
+    ann_bytes = await _read_upload(annotations)
+    try:
+        index = await run_in_threadpool(index_coco_annotations, ann_bytes)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid annotations JSON.")
+
+    matcher = _matcher(record)
+    ground_truth = partial(_coco_ground_truth, index, ann_bytes)
+    semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+
+    async def evaluate_one(upload: UploadFile):
+        async with semaphore:
+            payload = await _read_page(upload)
+            return await _evaluate_page(
+                upload.filename or "", payload, ground_truth, matcher, lambda preds, gts, outcome: _outcome_result(outcome), model
+            )
+
+    evaluated = await asyncio.gather(*(evaluate_one(upload) for upload in files))
+    results = [result for result, _ in evaluated]
+    outcomes = [outcome for _, outcome in evaluated]
+    images = await _store(session_id, [o for o in outcomes if o is not None])
+    return {"session_id": session_id, "images": images, "results": results}
+
+
+@router.post("/{session_id}/predictions")
+async def add_predictions(session_id: str, request: PredictionsRequest):
+    """
+    Adds images evaluated elsewhere: per image its predictions ({bbox: [x1, y1, x2, y2], label, score})
+    and ground truth ({bbox, label}). Returns per-image TP/FP/FN and the session's image count.
+    """
+    record = await _get_session(session_id)
+    matcher = _matcher(record)
+
+    def match_all():
+        return [
+            matcher.match(
+                [{"bbox": b.bbox, "label": b.label, "score": b.score or 0.0} for b in image.predictions],
+                [{"bbox": b.bbox, "label": b.label} for b in image.ground_truth],
+            )
+            for image in request.images
+        ]
+
+    outcomes = await run_in_threadpool(match_all)
+    images = await _store(session_id, outcomes)
+    return {"session_id": session_id, "images": images, "results": [_outcome_result(o) for o in outcomes]}
+
+
+@router.delete("/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    if not await run_in_threadpool(get_eval_session_store().delete, session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired evaluation session.")
+    return Response(status_code=204)
+
+
+metrics.Gauge(
+    "layout_eval_sessions", "Open evaluation sessions.",
+    callback=lambda: get_eval_session_store().count(),
+)
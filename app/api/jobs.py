@@ -0,0 +1,291 @@
+"""
+Asynchronous job API for work that outlives a request timeout (long PDFs, bulk
+detection, bulk evaluation). Submitting stores the uploads in the job queue
+(core/jobs.py) and returns a job id right away; JobRunner tasks in this process
+claim jobs and run them through the same code paths as /detect/batch and /evaluate/.
+
+- POST /jobs/detect            images, PDFs and zip/tar archives -> per-page detections
+- POST /jobs/evaluate          images + one annotations JSON -> per-image metrics and dataset mAP
+- GET  /jobs/{id}              status and progress
+- GET  /jobs/{id}/events       NDJSON progress stream until the job finishes
+- GET  /jobs/{id}/result       the result once done
+"""
+import asyncio
+import io
+import json
+import time
+from functools import partial
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from ..core import config, metrics
+from ..core.jobs import DONE, FINISHED, QUEUED, get_job_queue
+from ..utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, ImageOutcome, evaluate_detections, index_coco_annotations
+from ..utils.pages import archive_kind, is_pdf, open_pdf
+from .endpoints import (
+    _check_upload_size, _coco_ground_truth, _detect_pages, _evaluate_page, _iter_batch_uploads, _metrics, _model_choice,
+    _read_upload,
+)
+
+router = APIRouter(prefix="/jobs")
+
+EVENTS_POLL_S = 0.5
+
+
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": {"done": job["done"], "total": job["total"]},
+        "error": job["error"],
+        "created": job["created"],
+        "updated": job["updated"],
+        # Finished jobs (and their results) are dropped after this time
+        "expires": job["expires"] if job["status"] in FINISHED else None,
+    }
+
+
+async def _get_job(job_id: str) -> dict:
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return job
+
+
+async def _submit(kind: str, params: dict, uploads: List[UploadFile]) -> JSONResponse:
+    # Uploads (PDFs and archives too) are stored in the queue whole: refuse any oversized file before reading one
+    for u in uploads:
+        _check_upload_size(u)
+    files = [(u.filename or "", u.content_type or "", await u.read()) for u in uploads]
+    job_id = await run_in_threadpool(get_job_queue().submit, kind, params, files)
+    get_job_runner().wake()
+    return JSONResponse({"job_id": job_id, "status": QUEUED}, status_code=202)
+
+
+@router.post("/detect", status_code=202)
+async def submit_detect(
+    files: List[UploadFile] = File(...),
+    dpi: int = Query(config.PDF_DPI, ge=36, le=600),  # PDF rasterization resolution
+    model: str = Depends(_model_choice),
+):
+    """
+    Queues detection over images, PDFs and zip/tar archives (like /detect/batch).
+    The result is {"pages": [BatchPageResult, ...]} in upload order.
+    """
+    for upload in files:
+        if not (is_pdf(upload.filename, upload.content_type)
+                or archive_kind(upload.filename, upload.content_type) is not None
+                or (upload.content_type or "").startswith("image/")):
+            raise HTTPException(status_code=400, detail=f"File {upload.filename} is neither an image, a PDF nor a zip/tar archive.")
+    return await _submit("detect", {"dpi": dpi, "model": model}, files)
+
+
+@router.post("/evaluate", status_code=202)
+async def submit_evaluate(
+    files: List[UploadFile] = File(...),
+    annotations: UploadFile = File(...),
+    iou_threshold: float = Query(0.5, ge=0.0, le=1.0),
+    model: str = Depends(_model_choice),
+):
+    """
+    Queues evaluation of many images against one COCO (or simple) annotations JSON;
+    images are matched to COCO entries by file name. The result holds /evaluate/ metrics
+    per image and a dataset summary (mAP@[.5:.95], per-class AP, P/R/F1 at iou_threshold).
+    """
+    for upload in files:
+        if not (upload.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"File {upload.filename} is not an image.")
+    ann_bytes = await _read_upload(annotations)
+    try:
+        json.loads(ann_bytes.decode("utf-8"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid annotations JSON.")
+    await annotations.seek(0)
+    return await _submit("evaluate", {"iou_threshold": iou_threshold, "model": model}, [annotations] + list(files))
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    return _job_status(await _get_job(job_id))
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """Streams the job status as NDJSON whenever it changes; the last line is the finished status."""
+    job = await _get_job(job_id)
+
+    async def events():
+        last = None
+        current = job
+        while current is not None:
+            status = _job_status(current)
+            key = (status["status"], status["progress"]["done"], status["progress"]["total"])
+            if key != last:
+                last = key
+                yield json.dumps(status) + "\n"
+            if current["status"] in FINISHED:
+                return
+            await asyncio.sleep(EVENTS_POLL_S)
+            current = await run_in_threadpool(get_job_queue().get, job_id)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@router.get("/{job_id}/result")
+async def job_result(job_id: str):
+    job = await _get_job(job_id)
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}." + (f" {job['error']}" if job["error"] else ""))
+    return JSONResponse(await run_in_threadpool(get_job_queue().result, job_id))
+
+
+# --- Workers ---
+
+def _as_upload(name: str, content_type: str, data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=name, headers=Headers({"content-type": content_type}))
+
+
+async def _run_detect(job: dict, files, progress) -> dict:
+    uploads = [_as_upload(*f) for f in files]
+    pdfs = {}
+    for upload in uploads:
+        if is_pdf(upload.filename, upload.content_type):
+            pdfs[id(upload)] = await run_in_threadpool(open_pdf, upload.file)
+    # Page count is known up front unless archives have to be expanded
+    total = None
+    if not any(archive_kind(u.filename, u.content_type) for u in uploads):
+        total = len(uploads) - len(pdfs) + sum(len(pdf) for pdf in pdfs.values())
+    pages = []
+    # Jobs queued before the model parameter existed run on the default model
+    model = job["params"].get("model")
+    pages_iter = _iter_batch_uploads(uploads, pdfs, job["params"]["dpi"])
+    async for result in _detect_pages(pages_iter, config.BATCH_CONCURRENCY, model=model):
+        pages.append(result)
+        await progress(len(pages), total)
+    pages.sort(key=lambda r: r["index"])
+    return {"pages": pages}
+
+
+async def _run_evaluate(job: dict, files, progress) -> dict:
+    iou_threshold = job["params"]["iou_threshold"]
+    model = job["params"].get("model")
+    (_, _, ann_bytes), images = files[0], files[1:]
+    index = await run_in_threadpool(index_coco_annotations, ann_bytes)
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=iou_threshold)
+    # Same lookup as /evaluate/ for images not listed by file name in a COCO file
+    ground_truth = partial(_coco_ground_truth, index, ann_bytes)
+    results: List[Optional[dict]] = [None] * len(images)
+    outcomes: List[Optional[ImageOutcome]] = [None] * len(images)
+    semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+    done = 0
+
+    def describe(preds, gts, outcome) -> dict:
+        eval_result = evaluate_detections(preds, gts, iou_threshold=iou_threshold, require_label_match=True)
+        return {"metrics": _metrics(eval_result)}
+
+    async def evaluate_one(i: int, name: str, data: bytes):
+        nonlocal done
+        async with semaphore:
+            results[i], outcomes[i] = await _evaluate_page(name, data, ground_truth, accumulator, describe, model)
+        done += 1
+        await progress(done, len(images))
+
+    await asyncio.gather(*(evaluate_one(i, name, data) for i, (name, _, data) in enumerate(images)))
+    # Recorded in upload order, so equal scores rank the same way on every run
+    for outcome in outcomes:
+        if outcome is not None:
+            accumulator.add_outcome(outcome)
+    return {"images": results, "summary": await run_in_threadpool(accumulator.summary)}
+
+
+_HANDLERS = {"detect": _run_detect, "evaluate": _run_evaluate}
+
+
+class JobRunner:
+    """
+    Background tasks that claim queued jobs and run them on the event loop; the
+    heavy parts go through the inference executor and the threadpool as in the
+    request handlers. Finished jobs past their TTL are purged periodically.
+    """
+
+    def __init__(self, workers: int = config.JOB_WORKERS, poll_interval: float = 1.0, purge_interval: float = 60.0):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._tasks = []
+        self._wake: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def wake(self):
+        """Signals that a job was submitted, so an idle worker picks it up without waiting for the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _work(self):
+        queue = get_job_queue()
+        while True:
+            if time.monotonic() - self._last_purge >= self.purge_interval:
+                self._last_purge = time.monotonic()
+                await run_in_threadpool(queue.purge)
+            # Cleared before claiming, so a submit racing with an empty claim still wakes us
+            self._wake.clear()
+            claimed = await run_in_threadpool(queue.claim)
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(queue, *claimed)
+
+    async def _run(self, queue, job: dict, files):
+        async def progress(done: int, total: Optional[int]):
+            await run_in_threadpool(queue.progress, job["id"], done, total)
+
+        try:
+            handler = _HANDLERS[job["kind"]]
+            result = await handler(job, files, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            await run_in_threadpool(queue.finish, job["id"], None, str(exc) or type(exc).__name__)
+            return
+        await run_in_threadpool(queue.finish, job["id"], result)
+
+
+job_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    global job_runner
+    if job_runner is None:
+        job_runner = JobRunner()
+    return job_runner
+
+
+metrics.Gauge(
+    "layout_jobs_queued", "Jobs waiting in the job queue.",
+    callback=lambda: get_job_queue().counts()["queued"],
+)
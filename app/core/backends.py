@@ -0,0 +1,157 @@
+"""
+CPU inference backends for the Detectron2 layout model.
+
+- eager:       the stock layoutparser/Detectron2 model (fp32)
+- int8:        eager model with nn.Linear layers (box head) dynamically quantized to INT8
+- torchscript: GeneralizedRCNN traced with detectron2's TracingAdapter
+- onnx:        the traced graph exported to ONNX and run with ONNX Runtime
+
+Traced and ONNX artifacts are written to MODEL_EXPORT_DIR on first use and reused afterwards.
+All backends expose detect(image) -> Layout, like Detectron2LayoutModel.
+"""
+import os
+from abc import ABC, abstractmethod
+
+import cv2
+import layoutparser as lp
+import numpy as np
+import torch
+
+from . import config
+from .model import SAMPLE_IMAGE
+
+BACKENDS = ("eager", "int8", "torchscript", "onnx")
+
+
+def quantize_int8(lp_model):
+    """Dynamically quantizes the Linear layers of the model in place (weights INT8, activations fp32)."""
+    predictor = lp_model.model
+    predictor.model = torch.ao.quantization.quantize_dynamic(
+        predictor.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return lp_model
+
+
+class _ExportedBackend(ABC):
+    """
+    Shared pre/post-processing for exported graphs: same resize as DefaultPredictor,
+    graph returns (boxes, classes, scores, image_size) in resized coordinates,
+    boxes are rescaled to the original image like detector_postprocess.
+    """
+
+    def __init__(self, lp_model, export_dir: str):
+        self.lp_model = lp_model
+        self.predictor = lp_model.model
+        self.label_map = lp_model.label_map
+        self.export_dir = export_dir
+        os.makedirs(export_dir, exist_ok=True)
+
+    def _sample_tensor(self):
+        image = cv2.imread(SAMPLE_IMAGE, cv2.IMREAD_COLOR)
+        if image is None:
+            image = np.full((1100, 850, 3), 255, dtype=np.uint8)
+        return self._preprocess(image)[0]
+
+    def _tracing_adapter(self, sample):
+        from detectron2.export import TracingAdapter
+
+        def inference(model, inputs):
+            # do_postprocess=False: boxes stay in the resized input's coordinates
+            return model.inference(inputs, do_postprocess=False)[0]
+
+        return TracingAdapter(self.predictor.model, [{"image": sample}], inference)
+
+    def _preprocess(self, image):
+        image = self.lp_model.image_loader(image)
+        if self.predictor.input_format == "RGB":
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        resized = self.predictor.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(np.ascontiguousarray(resized.astype("float32").transpose(2, 0, 1)))
+        return tensor, height, width
+
+    def _to_layout(self, boxes, classes, scores, input_hw, height, width):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scale_x = width / float(input_hw[1])
+        scale_y = height / float(input_hw[0])
+        boxes[:, 0::2] = np.clip(boxes[:, 0::2] * scale_x, 0, width)
+        boxes[:, 1::2] = np.clip(boxes[:, 1::2] * scale_y, 0, height)
+        layout = lp.Layout()
+        for (x_1, y_1, x_2, y_2), label, score in zip(boxes.tolist(), np.asarray(classes).tolist(), np.asarray(scores).tolist()):
+            if self.label_map is not None:
+                label = self.label_map.get(label, label)
+            layout.append(lp.TextBlock(lp.Rectangle(x_1, y_1, x_2, y_2), type=label, score=score))
+        return layout
+
+    @abstractmethod
+    def _run(self, tensor):
+        """Runs the exported graph on a preprocessed CHW tensor; returns (boxes, classes, scores) as arrays."""
+
+    def detect(self, image):
+        tensor, height, width = self._preprocess(image)
+        boxes, classes, scores = self._run(tensor)
+        return self._to_layout(boxes, classes, scores, tensor.shape[1:], height, width)
+
+
+class TorchScriptBackend(_ExportedBackend):
+    def __init__(self, lp_model, export_dir: str):
+        super().__init__(lp_model, export_dir)
+        path = os.path.join(export_dir, "model.ts")
+        if not os.path.exists(path):
+            sample = self._sample_tensor()
+            adapter = self._tracing_adapter(sample)
+            with torch.no_grad():
+                traced = torch.jit.trace(adapter, adapter.flattened_inputs, check_trace=False)
+            traced.save(path)
+        self.module = torch.jit.load(path, map_location="cpu")
+        self.module.eval()
+
+    def _run(self, tensor):
+        with torch.no_grad():
+            boxes, classes, scores, _ = self.module(tensor)
+        return boxes.numpy(), classes.numpy(), scores.numpy()
+
+
+class OnnxBackend(_ExportedBackend):
+    def __init__(self, lp_model, export_dir: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise RuntimeError("The onnx backend requires onnxruntime (pip install onnxruntime).") from exc
+        super().__init__(lp_model, export_dir)
+        path = os.path.join(export_dir, "model.onnx")
+        if not os.path.exists(path):
+            from detectron2.export import STABLE_ONNX_OPSET_VERSION
+
+            sample = self._sample_tensor()
+            adapter = self._tracing_adapter(sample)
+            tmp = path + ".part"
+            with torch.no_grad():
+                torch.onnx.export(
+                    adapter, adapter.flattened_inputs, tmp,
+                    opset_version=STABLE_ONNX_OPSET_VERSION,
+                    input_names=["image"],
+                    dynamic_axes={"image": {1: "height", 2: "width"}},
+                )
+            os.replace(tmp, path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _run(self, tensor):
+        boxes, classes, scores, _ = self.session.run(None, {self.input_name: tensor.numpy()})
+        return boxes, classes, scores
+
+
+def wrap_backend(lp_model, backend: str = config.INFERENCE_BACKEND, export_dir: str = config.MODEL_EXPORT_DIR):
+    """Turns a freshly loaded eager Detectron2LayoutModel into the requested backend."""
+    if backend == "eager":
+        return lp_model
+    if backend == "int8":
+        return quantize_int8(lp_model)
+    if backend == "torchscript":
+        return TorchScriptBackend(lp_model, export_dir)
+    if backend == "onnx":
+        return OnnxBackend(lp_model, export_dir)
+    raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
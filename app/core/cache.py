@@ -0,0 +1,175 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from . import config
+
+
+def image_key(image, *parts) -> str:
+    """
+    Content address of a decoded image: hash of its pixels and shape plus any
+    extra identity parts (model id, request options).
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((image.shape, str(image.dtype))).encode("utf-8"))
+    h.update(memoryview(image if image.flags.c_contiguous else image.copy()).cast("B"))
+    for part in parts:
+        h.update(b"\x00")
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def derive_key(key: str, *parts) -> str:
+    """Derives a key for a value computed from the item behind `key` (e.g. a rendered image)."""
+    h = hashlib.blake2b(key.encode("utf-8"), digest_size=20)
+    for part in parts:
+        h.update(b"\x00")
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with an optional on-disk tier.
+    The memory tier holds at most `max_entries` values; with `disk_dir` set, values are
+    also pickled to disk (write-through) so they survive restarts, and disk hits are
+    promoted back to memory. The disk tier keeps at most `disk_max_entries` files.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        disk_dir: Optional[str] = None,
+        disk_max_entries: int = 10000,
+    ):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or bool(self.disk_dir)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._remember(key, value)
+        self._disk_put(key, value)
+
+    def _remember(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt or incompatible entry: drop it and recompute
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+
+    def _disk_put(self, key: str, value: Any):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 64 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            entries = [e for e in os.scandir(self.disk_dir) if e.name.endswith(".pkl")]
+        except OSError:
+            return
+        excess = len(entries) - self.disk_max_entries
+        if excess <= 0:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:excess]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk_dir": self.disk_dir,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+detection_cache: Optional[ResultCache] = None
+render_cache: Optional[ResultCache] = None
+
+
+def get_detection_cache() -> ResultCache:
+    """Cache of Layouts keyed by image content + model identity."""
+    global detection_cache
+    if detection_cache is None:
+        detection_cache = ResultCache(
+            max_entries=config.DETECTION_CACHE_SIZE,
+            disk_dir=config.DETECTION_CACHE_DIR or None,
+            disk_max_entries=config.DETECTION_CACHE_DISK_MAX_ENTRIES,
+        )
+    return detection_cache
+
+
+def get_render_cache() -> ResultCache:
+    """Memory-only cache of encoded annotated images."""
+    global render_cache
+    if render_cache is None:
+        render_cache = ResultCache(max_entries=config.RENDER_CACHE_SIZE)
+    return render_cache
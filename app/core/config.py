@@ -0,0 +1,126 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+# Strict offline mode: load the model from local files only and fail instead of downloading
+MODEL_OFFLINE = _env_str("MODEL_OFFLINE", "0").lower() in ("1", "true", "yes")
+# Run one inference per worker at startup so the first request does not pay for lazy init
+WARMUP_INFERENCE = _env_str("WARMUP_INFERENCE", "1").lower() in ("1", "true", "yes")
+
+# Inference worker pool
+INFERENCE_WORKERS = max(1, _env_int("INFERENCE_WORKERS", 1))
+INFERENCE_WORKER_TYPE = _env_str("INFERENCE_WORKER_TYPE", "thread")  # thread | process
+INFERENCE_QUEUE_SIZE = max(0, _env_int("INFERENCE_QUEUE_SIZE", 8))
+INFERENCE_TIMEOUT_S = _env_float("INFERENCE_TIMEOUT_S", 60.0)
+# Pages of batches, jobs and sessions wait this long for a free queue slot before failing
+INFERENCE_SLOT_WAIT_S = max(0.0, _env_float("INFERENCE_SLOT_WAIT_S", 60.0))
+
+# Dynamic micro-batching (INFERENCE_BATCH_SIZE=1 disables it)
+INFERENCE_BATCH_SIZE = max(1, _env_int("INFERENCE_BATCH_SIZE", 1))
+INFERENCE_BATCH_WAIT_MS = max(0.0, _env_float("INFERENCE_BATCH_WAIT_MS", 10.0))
+
+# Torch thread pools per process: 0 splits the cores available to the node (CPU affinity,
+# cgroup quota) between SERVE_WORKERS * INFERENCE_WORKERS concurrent inferences (core/runtime.py).
+# SERVE_WORKERS is set by app.serve; set it by hand for other multi-process servers
+SERVE_WORKERS = max(1, _env_int("SERVE_WORKERS", 1))
+TORCH_THREADS = max(0, _env_int("TORCH_THREADS", 0))
+TORCH_INTEROP_THREADS = max(0, _env_int("TORCH_INTEROP_THREADS", 1))  # 0 keeps torch's default
+# Adaptive inference concurrency (1..INFERENCE_WORKERS calls at once) from the measured latency;
+# the target defaults to ADAPTIVE_LATENCY_TOLERANCE x the lowest recent latency
+ADAPTIVE_CONCURRENCY = _env_str("ADAPTIVE_CONCURRENCY", "0").lower() in ("1", "true", "yes")
+ADAPTIVE_TARGET_LATENCY_MS = max(0.0, _env_float("ADAPTIVE_TARGET_LATENCY_MS", 0.0))
+ADAPTIVE_LATENCY_TOLERANCE = max(1.0, _env_float("ADAPTIVE_LATENCY_TOLERANCE", 2.0))
+
+# Bulk endpoints: pages processed concurrently within one /detect/batch request
+BATCH_CONCURRENCY = max(1, _env_int("BATCH_CONCURRENCY", INFERENCE_WORKERS * INFERENCE_BATCH_SIZE))
+
+# Memory limits: bytes of one uploaded file (image, archive member, annotations, job file), decoded pixels of one page
+# (0 disables either) and the estimated memory of pages being processed at once
+# (core/memory.py; 0 disables the budget); requests over it wait MEMORY_WAIT_S, then get 503
+MAX_UPLOAD_BYTES = max(0, _env_int("MAX_UPLOAD_BYTES", 50 << 20))
+MAX_IMAGE_PIXELS = max(0, _env_int("MAX_IMAGE_PIXELS", 150_000_000))
+MEMORY_BUDGET_MB = max(0, _env_int("MEMORY_BUDGET_MB", 0))
+MEMORY_WAIT_S = max(0.0, _env_float("MEMORY_WAIT_S", 10.0))
+# Per-request peak RSS sampling interval (0 disables the X-Peak-RSS-MB header and histogram)
+REQUEST_MEMORY_SAMPLE_MS = max(0.0, _env_float("REQUEST_MEMORY_SAMPLE_MS", 10.0))
+
+# PDF ingestion
+PDF_DPI = _env_int("PDF_DPI", 150)
+
+# Decode large JPEGs at reduced scale (IMREAD_REDUCED_*) when no full-resolution output is needed
+DECODE_REDUCE = _env_str("DECODE_REDUCE", "1").lower() in ("1", "true", "yes")
+
+# Detection result cache (content-addressed); DETECTION_CACHE_DIR enables the disk tier
+DETECTION_CACHE_SIZE = max(0, _env_int("DETECTION_CACHE_SIZE", 256))
+DETECTION_CACHE_DIR = _env_str("DETECTION_CACHE_DIR", "")
+DETECTION_CACHE_DISK_MAX_ENTRIES = max(1, _env_int("DETECTION_CACHE_DISK_MAX_ENTRIES", 10000))
+# Near-duplicate page index (rescans of the same form/template reuse the stored layout):
+# pages kept (0 disables it), match thresholds and an optional file to persist it in
+NEAR_DUPLICATE_INDEX_SIZE = max(0, _env_int("NEAR_DUPLICATE_INDEX_SIZE", 0))
+NEAR_DUPLICATE_MAX_DISTANCE = min(64, max(0, _env_int("NEAR_DUPLICATE_MAX_DISTANCE", 14)))
+NEAR_DUPLICATE_MIN_SIMILARITY = _env_float("NEAR_DUPLICATE_MIN_SIMILARITY", 0.9)
+NEAR_DUPLICATE_INDEX_PATH = _env_str("NEAR_DUPLICATE_INDEX_PATH", "")
+# Encoded annotated images (format=image/both), memory only
+RENDER_CACHE_SIZE = max(0, _env_int("RENDER_CACHE_SIZE", 32))
+
+# Defaults of the annotated-image output (format=image|both), overridable per request
+OUTPUT_IMAGE_FORMAT = _env_str("OUTPUT_IMAGE_FORMAT", "png")  # png | jpeg | webp
+OUTPUT_IMAGE_QUALITY = min(100, max(1, _env_int("OUTPUT_IMAGE_QUALITY", 90)))  # jpeg/webp
+
+# Asynchronous job API (/jobs/...): queue backend (memory | sqlite), workers, result retention
+JOB_QUEUE = _env_str("JOB_QUEUE", "memory")
+JOB_DB_PATH = _env_str("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = max(1, _env_int("JOB_WORKERS", 1))
+JOB_TTL_S = max(1.0, _env_float("JOB_TTL_S", 3600.0))
+# A running job not updated for this long is assumed lost with its process and requeued (sqlite)
+JOB_STALE_S = max(1.0, _env_float("JOB_STALE_S", 600.0))
+
+# Evaluation sessions (/evaluate/sessions): store (memory | sqlite, like JOB_QUEUE by default),
+# SQLite file and how long an idle session is kept
+EVAL_SESSIONS = _env_str("EVAL_SESSIONS", JOB_QUEUE)
+EVAL_SESSION_DB_PATH = _env_str("EVAL_SESSION_DB_PATH", JOB_DB_PATH)
+EVAL_SESSION_TTL_S = max(1.0, _env_float("EVAL_SESSION_TTL_S", 86400.0))
+
+# Inference backend: eager | int8 | torchscript | onnx
+INFERENCE_BACKEND = _env_str("INFERENCE_BACKEND", "eager")
+MODEL_EXPORT_DIR = _env_str("MODEL_EXPORT_DIR", "/app/model_weights/exports")
+
+# Model registry (core/registry.py): models requests may pick (names of model.MODEL_SPECS), the one
+# used without a `model` parameter and the memory (estimated MB) each inference worker may hold
+# in models before the least recently used ones are unloaded (0: no cap)
+MODELS = [name.strip() for name in _env_str("MODELS", "frcnn_r50").split(",") if name.strip()]
+DEFAULT_MODEL = _env_str("DEFAULT_MODEL", MODELS[0] if MODELS else "frcnn_r50")
+MODEL_MEMORY_MB = max(0, _env_int("MODEL_MEMORY_MB", 0))
+# model=cascade: the cheap model first, the expensive one for pages whose mean detection score
+# is below CASCADE_MIN_CONFIDENCE; model=ensemble: ENSEMBLE_MODELS' detections fused
+CASCADE_MODELS = [name.strip() for name in _env_str("CASCADE_MODELS", "").split(",") if name.strip()]
+CASCADE_MIN_CONFIDENCE = min(1.0, max(0.0, _env_float("CASCADE_MIN_CONFIDENCE", 0.8)))
+ENSEMBLE_MODELS = [
+    name.strip() for name in _env_str("ENSEMBLE_MODELS", ",".join(CASCADE_MODELS)).split(",") if name.strip()
+]
+
+# Tiled inference for large pages: pages with a side above TILE_SIZE px are cut into
+# overlapping tiles (TILE_SIZE=0 disables it); TILE_BATCH_SIZE tiles per forward pass
+TILE_SIZE = max(0, _env_int("TILE_SIZE", 0))
+TILE_OVERLAP = max(0, _env_int("TILE_OVERLAP", 256))
+TILE_BATCH_SIZE = max(1, _env_int("TILE_BATCH_SIZE", 4))
+
+# Attach per-stage Server-Timing to every response (otherwise only when the request sends X-Trace: 1)
+TRACE_REQUESTS = _env_str("TRACE_REQUESTS", "0").lower() in ("1", "true", "yes")
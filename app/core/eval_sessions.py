@@ -0,0 +1,364 @@
+"""
+Evaluation sessions behind /evaluate/sessions: dataset-level evaluation built up over
+many requests (and, with sqlite, many server processes).
+
+A session holds its IoU thresholds and, per evaluated image, only the compact
+ImageOutcome of DetectionAccumulator.match (score, label and TP flags per detection
+plus the image's TP/FP/FN counts); images and boxes are never stored. Each process keeps
+a running accumulator per session that only takes in outcomes added since it last looked,
+and the last summary until the next add, so polling a large session is not a full replay.
+Sessions are dropped `ttl` seconds after their last update.
+
+- MemoryEvalSessionStore: in-process, lost on restart
+- SqliteEvalSessionStore: tables in a SQLite file (by default the job queue's), shareable
+  by several server processes (app.serve)
+
+Both are thread-safe and blocking; call them from the threadpool in async code.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from ..utils.eval import DetectionAccumulator, ImageOutcome
+
+
+class _RunningSession:
+    """This process' accumulator of one session and its summaries at `images` images."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accumulator: Optional[DetectionAccumulator] = None
+        self.summaries: Dict[bool, Tuple[int, Dict]] = {}  # pr_curves -> (images, summary)
+        self.used = time.monotonic()
+
+
+class EvalSessionStore(ABC):
+    """Interface of an evaluation session store; see MemoryEvalSessionStore/SqliteEvalSessionStore."""
+
+    def __init__(self, ttl: float = 86400.0):
+        self.ttl = ttl
+        self._running: Dict[str, _RunningSession] = {}
+        self._running_lock = threading.Lock()
+
+    @abstractmethod
+    def create(self, iou_threshold: float, iou_thresholds: List[float]) -> Dict:
+        """Stores a new empty session and returns its record."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Session record: id, iou_threshold, iou_thresholds, images, created, updated, expires."""
+
+    @abstractmethod
+    def add(self, session_id: str, outcomes: List[ImageOutcome]) -> Optional[int]:
+        """Appends image outcomes to a session; returns its image count, None for an unknown session."""
+
+    @abstractmethod
+    def outcomes(self, session_id: str, start: int = 0) -> Optional[Tuple[Dict, List[ImageOutcome]]]:
+        """(record, outcomes of the images from position `start` on) of a session, or None."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Drops a session; False if it did not exist."""
+
+    @abstractmethod
+    def purge(self) -> int:
+        """Drops sessions not updated for `ttl` seconds; returns how many were removed."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored sessions."""
+
+    def summary(self, session_id: str, pr_curves: bool = False) -> Optional[Dict]:
+        """
+        DetectionAccumulator.summary over every image of the session, or None for an unknown
+        session. Only outcomes added since the last call are loaded, and the summary is reused
+        until images are added. The returned dict is shared and must not be mutated.
+        """
+        with self._running_lock:
+            running = self._running.get(session_id)
+            if running is None:
+                running = self._running[session_id] = _RunningSession()
+            running.used = time.monotonic()
+        with running.lock:
+            loaded = running.accumulator.images if running.accumulator is not None else 0
+            fetched = self.outcomes(session_id, loaded)
+            if fetched is None:
+                self._forget([session_id])
+                return None
+            record, outcomes = fetched
+            if running.accumulator is None:
+                running.accumulator = DetectionAccumulator(record["iou_thresholds"], iou_threshold=record["iou_threshold"])
+            for outcome in outcomes:
+                running.accumulator.add_outcome(outcome)
+            images = running.accumulator.images
+            cached = running.summaries.get(pr_curves)
+            if cached is None or cached[0] != images:
+                cached = running.summaries[pr_curves] = (images, running.accumulator.summary(pr_curves))
+            return cached[1]
+
+    def _forget(self, session_ids: List[str]):
+        """Drops this process' running accumulators of deleted sessions and of sessions idle for `ttl`."""
+        idle = time.monotonic() - self.ttl
+        with self._running_lock:
+            for session_id in session_ids:
+                self._running.pop(session_id, None)
+            for session_id in [s for s, running in self._running.items() if running.used < idle]:
+                del self._running[session_id]
+
+
+def _record(session_id: str, iou_threshold: float, iou_thresholds: List[float], now: float, ttl: float) -> Dict:
+    return {
+        "id": session_id,
+        "iou_threshold": iou_threshold,
+        "iou_thresholds": list(iou_thresholds),
+        "images": 0,
+        "created": now,
+        "updated": now,
+        "expires": now + ttl,
+    }
+
+
+class MemoryEvalSessionStore(EvalSessionStore):
+    def __init__(self, ttl: float = 86400.0):
+        super().__init__(ttl)
+        self._sessions: Dict[str, Dict] = {}
+        self._outcomes: Dict[str, List[ImageOutcome]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, iou_threshold, iou_thresholds):
+        session_id = uuid.uuid4().hex
+        record = _record(session_id, iou_threshold, iou_thresholds, time.time(), self.ttl)
+        with self._lock:
+            self._sessions[session_id] = record
+            self._outcomes[session_id] = []
+        return dict(record)
+
+    def _live(self, session_id: str) -> Optional[Dict]:
+        record = self._sessions.get(session_id)
+        return record if record is not None and record["expires"] > time.time() else None
+
+    def get(self, session_id):
+        with self._lock:
+            record = self._live(session_id)
+            return dict(record) if record is not None else None
+
+    def add(self, session_id, outcomes):
+        now = time.time()
+        with self._lock:
+            record = self._live(session_id)
+            if record is None:
+                return None
+            self._outcomes[session_id].extend(outcomes)
+            record["images"] = len(self._outcomes[session_id])
+            record["updated"] = now
+            record["expires"] = now + self.ttl
+            return record["images"]
+
+    def outcomes(self, session_id, start=0):
+        with self._lock:
+            record = self._live(session_id)
+            if record is None:
+                return None
+            return dict(record), self._outcomes[session_id][start:]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._outcomes.pop(session_id, None)
+            deleted = self._sessions.pop(session_id, None) is not None
+        self._forget([session_id])
+        return deleted
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [session_id for session_id, record in self._sessions.items() if record["expires"] <= now]
+            for session_id in expired:
+                del self._sessions[session_id]
+                del self._outcomes[session_id]
+        self._forget(expired)
+        return len(expired)
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SqliteEvalSessionStore(EvalSessionStore):
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS eval_sessions (
+        id TEXT PRIMARY KEY,
+        iou_threshold REAL NOT NULL,
+        iou_thresholds TEXT NOT NULL,
+        images INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS eval_session_images (
+        session_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        scores BLOB NOT NULL,
+        labels TEXT NOT NULL,
+        flags BLOB NOT NULL,
+        gt_counts TEXT NOT NULL,
+        tp INTEGER NOT NULL,
+        fp INTEGER NOT NULL,
+        fn INTEGER NOT NULL,
+        iou_sum REAL NOT NULL,
+        PRIMARY KEY (session_id, position)
+    );
+    """
+    _COLUMNS = ("id", "iou_threshold", "iou_thresholds", "images", "created", "updated", "expires")
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock:
+            self._conn.executescript(self._SCHEMA)
+
+    def _row_to_record(self, row) -> Dict:
+        record = dict(zip(self._COLUMNS, row))
+        record["iou_thresholds"] = json.loads(record["iou_thresholds"])
+        return record
+
+    def _get(self, session_id: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM eval_sessions WHERE id = ? AND expires > ?",
+            (session_id, time.time()),
+        ).fetchone()
+        return self._row_to_record(row) if row is not None else None
+
+    def create(self, iou_threshold, iou_thresholds):
+        session_id = uuid.uuid4().hex
+        record = _record(session_id, iou_threshold, iou_thresholds, time.time(), self.ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO eval_sessions (id, iou_threshold, iou_thresholds, created, updated, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, iou_threshold, json.dumps(record["iou_thresholds"]),
+                 record["created"], record["updated"], record["expires"]),
+            )
+        return record
+
+    def get(self, session_id):
+        with self._lock:
+            return self._get(session_id)
+
+    def add(self, session_id, outcomes):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                record = self._get(session_id)
+                if record is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                start = record["images"]
+                self._conn.executemany(
+                    "INSERT INTO eval_session_images "
+                    "(session_id, position, scores, labels, flags, gt_counts, tp, fp, fn, iou_sum) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            session_id, start + i,
+                            o.scores.astype("<f8").tobytes(), json.dumps(o.labels),
+                            np.packbits(o.flags, axis=None).tobytes(), json.dumps(o.gt_counts),
+                            o.tp, o.fp, o.fn, o.iou_sum,
+                        )
+                        for i, o in enumerate(outcomes)
+                    ],
+                )
+                images = start + len(outcomes)
+                self._conn.execute(
+                    "UPDATE eval_sessions SET images = ?, updated = ?, expires = ? WHERE id = ?",
+                    (images, now, now + self.ttl, session_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return images
+
+    def outcomes(self, session_id, start=0):
+        with self._lock:
+            record = self._get(session_id)
+            if record is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT scores, labels, flags, gt_counts, tp, fp, fn, iou_sum FROM eval_session_images "
+                "WHERE session_id = ? AND position >= ? ORDER BY position",
+                (session_id, start),
+            ).fetchall()
+        iou_thresholds = record["iou_thresholds"]
+        columns = len(iou_thresholds) + (0 if record["iou_threshold"] in iou_thresholds else 1)
+        outcomes = []
+        for scores, labels, flags, gt_counts, tp, fp, fn, iou_sum in rows:
+            scores = np.frombuffer(scores, dtype="<f8")
+            flags = np.unpackbits(np.frombuffer(flags, dtype=np.uint8), count=scores.size * columns)
+            outcomes.append(ImageOutcome(
+                scores=scores,
+                labels=json.loads(labels),
+                flags=flags.astype(bool).reshape(scores.size, columns),
+                gt_counts=json.loads(gt_counts),
+                tp=tp, fp=fp, fn=fn, iou_sum=iou_sum,
+            ))
+        return record, outcomes
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM eval_session_images WHERE session_id = ?", (session_id,))
+                deleted = self._conn.execute("DELETE FROM eval_sessions WHERE id = ?", (session_id,)).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._forget([session_id])
+        return deleted > 0
+
+    def purge(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = [
+                    r[0] for r in self._conn.execute("SELECT id FROM eval_sessions WHERE expires <= ?", (time.time(),))
+                ]
+                self._conn.executemany("DELETE FROM eval_session_images WHERE session_id = ?", [(s,) for s in expired])
+                self._conn.executemany("DELETE FROM eval_sessions WHERE id = ?", [(s,) for s in expired])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._forget(expired)
+        return len(expired)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM eval_sessions").fetchone()[0]
+
+
+eval_session_store: Optional[EvalSessionStore] = None
+
+
+def get_eval_session_store() -> EvalSessionStore:
+    """Process-wide session store selected by EVAL_SESSIONS (memory | sqlite)."""
+    global eval_session_store
+    if eval_session_store is None:
+        if config.EVAL_SESSIONS == "sqlite":
+            eval_session_store = SqliteEvalSessionStore(config.EVAL_SESSION_DB_PATH, ttl=config.EVAL_SESSION_TTL_S)
+        elif config.EVAL_SESSIONS == "memory":
+            eval_session_store = MemoryEvalSessionStore(ttl=config.EVAL_SESSION_TTL_S)
+        else:
+            raise ValueError(f"Unknown evaluation session store: {config.EVAL_SESSIONS} (expected memory or sqlite)")
+    return eval_session_store
@@ -0,0 +1,394 @@
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from . import config, metrics, runtime
+from .model import SAMPLE_IMAGE, load_model, predict, predict_batch, BatchScheduler
+from .registry import ModelRegistry, get_registry
+
+# Per-thread model registries (thread workers); process workers use the process-wide one
+_local = threading.local()
+# The first thread worker adopts the process-wide model (possibly loaded before fork by app.serve)
+_shared_lock = threading.Lock()
+_shared_claimed = False
+
+
+class QueueFullError(Exception):
+    """Raised when the inference admission queue has no free slot (within the caller's slot wait)."""
+
+
+class InferenceTimeoutError(Exception):
+    """Raised when an inference call does not finish within the configured timeout."""
+
+
+def _init_thread_worker():
+    global _shared_claimed
+    with _shared_lock:
+        adopt = not _shared_claimed
+        _shared_claimed = True
+    runtime.configure_threads()
+    if adopt:
+        _local.registry = get_registry()
+    else:
+        _local.registry = ModelRegistry()
+        _local.registry.adopt(config.DEFAULT_MODEL, load_model())
+
+
+def _init_process_worker():
+    runtime.configure_threads()
+    get_registry()
+
+
+def _worker_model(model_name: Optional[str] = None):
+    """The calling worker's handle of a registry model (default: DEFAULT_MODEL), loaded on first use."""
+    registry = getattr(_local, "registry", None)
+    if registry is None:
+        registry = get_registry()
+    return registry.get(model_name or config.DEFAULT_MODEL)
+
+
+def _warmup():
+    """
+    Runs once per worker at startup so the initializer (model load) happens before traffic,
+    then (WARMUP_INFERENCE) one inference on the sample page to get lazy init
+    (allocator, kernels, thread pools) out of the way. Returns the warm-up inference seconds.
+    """
+    model = _worker_model()
+    if not config.WARMUP_INFERENCE:
+        return 0.0
+    image = cv2.imread(SAMPLE_IMAGE, cv2.IMREAD_COLOR)
+    if image is None:
+        image = np.full((1100, 850, 3), 255, dtype=np.uint8)
+    start = time.perf_counter()
+    predict(image, model=model)
+    return time.perf_counter() - start
+
+
+def run_predict(image, options=None, model_name=None):
+    """Worker entry point: runs detection with the calling worker's own model handle."""
+    return predict(image, model=_worker_model(model_name), options=options)
+
+
+def run_predict_batch(images, model_name=None):
+    """Worker entry point for a micro-batch: one forward pass for all images."""
+    return predict_batch(images, model=_worker_model(model_name))
+
+
+def _run_with_threads(threads: Optional[int], fn, *args):
+    """Worker side of an adaptive call: fn(*args) with the intra-op threads of the current limit."""
+    runtime.use_threads(threads)
+    return fn(*args)
+
+
+class InferenceExecutor:
+    """
+    Bounded pool of inference workers (threads or processes), each with its own model handle.
+    At most `workers * batch_size + queue_size` calls are admitted at once; further calls
+    fail fast with QueueFullError instead of piling up behind the model, or, with a
+    slot_wait, wait up to that long for a released slot (first come, first served).
+    With batch_size > 1, concurrent predict() calls are grouped by a BatchScheduler
+    (one per registry model) and each group runs as one forward pass on a worker.
+    With adaptive concurrency a ConcurrencyLimiter (core/runtime.py) lets between 1 and
+    `workers` forward passes run at once, from their measured latency, each with the
+    intra-op threads planned for that many; admitted calls over the limit wait for a slot.
+    """
+
+    def __init__(
+        self,
+        workers: int = config.INFERENCE_WORKERS,
+        kind: str = config.INFERENCE_WORKER_TYPE,
+        queue_size: int = config.INFERENCE_QUEUE_SIZE,
+        timeout: Optional[float] = config.INFERENCE_TIMEOUT_S,
+        batch_size: int = config.INFERENCE_BATCH_SIZE,
+        batch_wait_ms: float = config.INFERENCE_BATCH_WAIT_MS,
+        adaptive: bool = config.ADAPTIVE_CONCURRENCY,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference worker type: {kind}")
+        self.workers = workers
+        self.kind = kind
+        self.queue_size = queue_size
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self._capacity = workers * max(1, batch_size) + queue_size
+        self._admitted = 0
+        self._lock = threading.Lock()
+        # Callers waiting for an admission slot (futures on self._loop), woken in order by _release
+        self._slot_waiters = collections.deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool = None
+        self._starting: Optional[asyncio.Future] = None
+        self.state = "stopped"  # stopped | starting | ready | failed
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.limiter = runtime.ConcurrencyLimiter(workers) if adaptive else None
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        # Micro-batchers by model name; `batcher` is the default model's
+        self._batchers: Dict[str, BatchScheduler] = {}
+        self.batcher: Optional[BatchScheduler] = None
+        if batch_size > 1:
+            self.batcher = self._batcher(config.DEFAULT_MODEL)
+
+    @property
+    def admitted(self) -> int:
+        return self._admitted
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self):
+        """Starts and warms up the workers; concurrent callers wait for the same startup."""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._starting)
+
+    async def _start(self):
+        self.state = "starting"
+        try:
+            await self._start_pool()
+        except Exception as exc:
+            self.state = "failed"
+            self.error = str(exc) or type(exc).__name__
+            raise
+        self.state = "ready"
+
+    async def _start_pool(self):
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process_worker)
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+                initializer=_init_thread_worker,
+            )
+        # Submitting one task per worker spawns every worker and loads its model up front
+        start = time.perf_counter()
+        futures = [self._pool.submit(_warmup) for _ in range(self.workers)]
+        warmups = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        self.warmup_seconds = max(warmups)
+        self.load_seconds = time.perf_counter() - start - self.warmup_seconds
+        metrics.MODEL_LOAD_SECONDS.set(self.load_seconds)
+        if self.batcher is not None:
+            self.batcher.start()
+
+    async def shutdown(self):
+        if self._starting is not None and not self._starting.done():
+            self._starting.cancel()
+        self._starting = None
+        self.state = "stopped"
+        for batcher in self._batchers.values():
+            await batcher.stop()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self._capacity:
+                raise QueueFullError("Inference queue is full.")
+            self._admitted += 1
+
+    async def _acquire_slot(self, slot_wait: float = 0.0):
+        """
+        Admits a call; when the queue is full, waits up to slot_wait seconds for a slot
+        to be released (no wait by default) before raising QueueFullError.
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        # Waiting callers are served in order: a new one queues behind them instead of taking a freed slot
+        if slot_wait <= 0 or not self._slot_waiters:
+            try:
+                return self._admit()
+            except QueueFullError:
+                if slot_wait <= 0:
+                    raise
+        deadline = loop.time() + slot_wait
+        while True:
+            waiter = loop.create_future()
+            self._slot_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(0.0, deadline - loop.time()))
+            except BaseException as exc:
+                self._slot_waiters.remove(waiter)
+                if waiter.done() and not waiter.cancelled():
+                    # Woken just as it gave up: hand the freed slot to the next waiter
+                    self._wake_slot_waiter()
+                if isinstance(exc, asyncio.TimeoutError):
+                    raise QueueFullError(f"No inference slot within {slot_wait:g} s.")
+                raise
+            self._slot_waiters.remove(waiter)
+            try:
+                return self._admit()
+            except QueueFullError:
+                # Taken by a fail-fast call in the meantime: keep waiting
+                if loop.time() >= deadline:
+                    raise QueueFullError(f"No inference slot within {slot_wait:g} s.")
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._admitted -= 1
+        if self._loop is not None:
+            # Done callbacks of pool futures run on worker threads. Always scheduled: a caller
+            # that just failed to admit enqueues itself before the loop runs the wake-up
+            try:
+                self._loop.call_soon_threadsafe(self._wake_slot_waiter)
+            except RuntimeError:
+                pass  # loop closed at shutdown
+
+    def _wake_slot_waiter(self):
+        for waiter in self._slot_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def run(self, fn, *args, slot_wait: float = 0.0):
+        """
+        Runs fn(*args) on a worker. Raises QueueFullError when no slot is free (within
+        slot_wait seconds) and InferenceTimeoutError when the call exceeds the timeout.
+        The admission slot is held until the worker actually finishes, so timed-out
+        calls still count against the bound while they run.
+        """
+        if not self.ready:
+            await self.start()
+        await self._acquire_slot(slot_wait)
+        try:
+            future = await asyncio.wait_for(self._submit(fn, *args), self.timeout)
+        except asyncio.TimeoutError:
+            self._release()
+            raise InferenceTimeoutError()
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return await self._await(future)
+
+    async def _submit(self, fn, *args):
+        """Submits fn(*args) to the pool, after waiting for a concurrency slot when adaptive."""
+        if self.limiter is None:
+            return self._pool.submit(fn, *args)
+        await self.limiter.acquire()
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            # Fewer concurrent calls get more threads each, so a lowered limit speeds them up
+            future = self._pool.submit(_run_with_threads, self.limiter.threads_for(), fn, *args)
+        except BaseException:
+            self.limiter.release()
+            raise
+
+        def done(f):
+            failed = f.cancelled() or f.exception() is not None
+            try:
+                loop.call_soon_threadsafe(self.limiter.release, None if failed else time.perf_counter() - start)
+            except RuntimeError:
+                pass  # loop closed at shutdown
+
+        future.add_done_callback(done)
+        return future
+
+    async def predict(self, image, options=None, model_name: Optional[str] = None, slot_wait: float = 0.0):
+        """
+        Runs detection for one image with a registry model (default: DEFAULT_MODEL),
+        through the model's micro-batcher when enabled. With slot_wait, a full queue is
+        waited on for up to that many seconds before QueueFullError.
+        Calls with non-default DetectionOptions bypass the batcher: the options are set
+        on the worker's model for the whole forward pass.
+        """
+        model_name = model_name or config.DEFAULT_MODEL
+        if self.batcher is None or (options is not None and not options.is_default):
+            return await self.run(run_predict, image, options, model_name, slot_wait=slot_wait)
+        if not self.ready:
+            await self.start()
+        await self._acquire_slot(slot_wait)
+        try:
+            # As in run(), the slot is held until the batch has left the worker, not until this call gives up
+            future = self._batcher(model_name).enqueue(image, on_finished=self._release)
+        except BaseException:
+            self._release()
+            raise
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise InferenceTimeoutError()
+
+    def _batcher(self, model_name: str) -> BatchScheduler:
+        batcher = self._batchers.get(model_name)
+        if batcher is None:
+            batcher = self._batchers[model_name] = BatchScheduler(
+                partial(self._dispatch_batch, model_name), max_batch_size=self.batch_size, max_wait_ms=self.batch_wait_ms
+            )
+        return batcher
+
+    async def _dispatch_batch(self, model_name: str, images):
+        # Requests in the batch were already admitted individually in predict(). No timeout here:
+        # callers time out on their own, and the batch returns (freeing their slots) only when the worker is done
+        return await asyncio.wrap_future(await self._submit(run_predict_batch, images, model_name))
+
+    async def _await(self, future):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise InferenceTimeoutError()
+
+    def readiness(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "workers": self.workers,
+            "model_load_seconds": self.load_seconds,
+            "warmup_inference_seconds": self.warmup_seconds,
+        }
+
+    def concurrency(self) -> dict:
+        """The adaptive concurrency limit and its latency inputs (fixed at `workers` when not adaptive)."""
+        if self.limiter is None:
+            return {"adaptive": False, "limit": self.workers}
+        return self.limiter.stats()
+
+    def batching(self) -> Dict[str, dict]:
+        """Micro-batching stats per model that has been used."""
+        return {name: batcher.stats() for name, batcher in self._batchers.items()}
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "workers": self.workers,
+            "worker_type": self.kind,
+            "capacity": self._capacity,
+            "admitted": self._admitted,
+            "waiting_for_slot": len(self._slot_waiters),
+            "concurrency": self.concurrency(),
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+
+executor: Optional[InferenceExecutor] = None
+
+
+def get_executor() -> InferenceExecutor:
+    global executor
+    if executor is None:
+        executor = InferenceExecutor()
+    return executor
+
+
+metrics.Gauge(
+    "layout_inference_admitted", "Inference calls admitted (running or queued).",
+    callback=lambda: executor.admitted if executor is not None else 0,
+)
+metrics.Gauge(
+    "layout_inference_batch_queued", "Requests waiting in the micro-batching queue.",
+    callback=lambda: executor.batcher.stats()["queued"] if executor is not None and executor.batcher is not None else 0,
+)
+metrics.Gauge(
+    "layout_inference_concurrency_limit", "Inference calls allowed to run at once (adaptive concurrency).",
+    callback=lambda: executor.concurrency()["limit"] if executor is not None else 0,
+)
@@ -0,0 +1,342 @@
+"""
+Job queue behind the asynchronous job API (/jobs/...).
+
+A job is a kind ("detect" | "evaluate"), JSON params, the uploaded input files and,
+once finished, a JSON result. Jobs move queued -> running -> done | failed and are
+dropped, result included, `ttl` seconds after finishing.
+
+- MemoryJobQueue: in-process, lost on restart
+- SqliteJobQueue: single SQLite file, shareable by several server processes (app.serve);
+  queued jobs survive a restart and jobs whose process died mid-run are requeued
+  once they have not been updated for `stale_after` seconds
+
+Both are thread-safe and blocking; call them from the threadpool in async code.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import config
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+# (filename, content_type, data)
+JobFile = Tuple[str, str, bytes]
+
+
+class JobQueue(ABC):
+    """Interface of a job queue; see MemoryJobQueue/SqliteJobQueue."""
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+
+    @abstractmethod
+    def submit(self, kind: str, params: Dict, files: List[JobFile]) -> str:
+        """Stores a new queued job and returns its id."""
+
+    @abstractmethod
+    def claim(self) -> Optional[Tuple[Dict, List[JobFile]]]:
+        """Marks the oldest queued job as running and returns (job, files), or None."""
+
+    @abstractmethod
+    def progress(self, job_id: str, done: int, total: Optional[int] = None):
+        """Records how many pages/images of a running job are done (total if known)."""
+
+    @abstractmethod
+    def finish(self, job_id: str, result: Any = None, error: Optional[str] = None):
+        """Stores the result (or error) of a running job and releases its input files."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Status record of a job: id, kind, status, progress, timestamps, error."""
+
+    @abstractmethod
+    def result(self, job_id: str) -> Any:
+        """Result of a done job, None if there is none."""
+
+    @abstractmethod
+    def purge(self) -> int:
+        """Drops finished jobs past their TTL; returns how many were removed."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+
+    def _expires(self, now: float) -> float:
+        return now + self.ttl
+
+
+def _record(job_id: str, kind: str, params: Dict, now: float, expires: float) -> Dict:
+    return {
+        "id": job_id,
+        "kind": kind,
+        "status": QUEUED,
+        "params": params,
+        "done": 0,
+        "total": None,
+        "error": None,
+        "created": now,
+        "updated": now,
+        "expires": expires,
+    }
+
+
+class MemoryJobQueue(JobQueue):
+    def __init__(self, ttl: float = 3600.0):
+        super().__init__(ttl)
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._files: Dict[str, List[JobFile]] = {}
+        self._results: Dict[str, Any] = {}
+        self._queued: deque = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params, files):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = _record(job_id, kind, params, now, self._expires(now))
+            self._files[job_id] = list(files)
+            self._queued.append(job_id)
+        return job_id
+
+    def claim(self):
+        with self._lock:
+            while self._queued:
+                job_id = self._queued.popleft()
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != QUEUED:
+                    continue
+                job["status"] = RUNNING
+                job["updated"] = time.time()
+                return dict(job), self._files.get(job_id, [])
+        return None
+
+    def progress(self, job_id, done, total=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["done"] = done
+                job["total"] = total
+                job["updated"] = time.time()
+
+    def finish(self, job_id, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = FAILED if error is not None else DONE
+            job["error"] = error
+            job["updated"] = now
+            job["expires"] = self._expires(now)
+            self._files.pop(job_id, None)
+            if error is None:
+                self._results[job_id] = result
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def result(self, job_id):
+        with self._lock:
+            return self._results.get(job_id)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items() if job["status"] in FINISHED and job["expires"] <= now
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._files.pop(job_id, None)
+                self._results.pop(job_id, None)
+        return len(expired)
+
+    def counts(self):
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+
+class SqliteJobQueue(JobQueue):
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        params TEXT NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        total INTEGER,
+        error TEXT,
+        result TEXT,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+    CREATE TABLE IF NOT EXISTS job_files (
+        job_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (job_id, position)
+    );
+    """
+    _COLUMNS = ("id", "kind", "status", "params", "done", "total", "error", "created", "updated", "expires")
+
+    def __init__(self, path: str, ttl: float = 3600.0, stale_after: float = 600.0):
+        super().__init__(ttl)
+        self.path = path
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock:
+            self._conn.executescript(self._SCHEMA)
+
+    def _row_to_job(self, row) -> Dict:
+        job = dict(zip(self._COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def submit(self, kind, params, files):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, status, params, created, updated, expires) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, QUEUED, json.dumps(params), now, now, self._expires(now)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_files (job_id, position, filename, content_type, data) VALUES (?, ?, ?, ?, ?)",
+                    [(job_id, i, name, content_type, data) for i, (name, content_type, data) in enumerate(files)],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self):
+        columns = ", ".join(self._COLUMNS)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                # Other processes may share the file, so a running job cannot be requeued just
+                # because this process restarted; only jobs nobody has touched for a while are
+                self._conn.execute(
+                    "UPDATE jobs SET status = ? WHERE status = ? AND updated < ?", (QUEUED, RUNNING, now - self.stale_after)
+                )
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (RUNNING, now, row[0]))
+                files = self._conn.execute(
+                    "SELECT filename, content_type, data FROM job_files WHERE job_id = ? ORDER BY position", (row[0],)
+                ).fetchall()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        job["status"] = RUNNING
+        job["updated"] = now
+        return job, [(name, content_type, bytes(data)) for name, content_type, data in files]
+
+    def progress(self, job_id, done, total=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET done = ?, total = ?, updated = ? WHERE id = ?", (done, total, time.time(), job_id)
+            )
+
+    def finish(self, job_id, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, result = ?, updated = ?, expires = ? WHERE id = ?",
+                    (
+                        FAILED if error is not None else DONE, error,
+                        json.dumps(result) if error is None else None,
+                        now, self._expires(now), job_id,
+                    ),
+                )
+                self._conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def result(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = [
+                    r[0] for r in self._conn.execute(
+                        "SELECT id FROM jobs WHERE status IN (?, ?) AND expires <= ?", (DONE, FAILED, now)
+                    )
+                ]
+                self._conn.executemany("DELETE FROM job_files WHERE job_id = ?", [(j,) for j in expired])
+                self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(j,) for j in expired])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(expired)
+
+    def counts(self):
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        with self._lock:
+            for status, count in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                counts[status] = count
+        return counts
+
+
+job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide job queue selected by JOB_QUEUE (memory | sqlite)."""
+    global job_queue
+    if job_queue is None:
+        if config.JOB_QUEUE == "sqlite":
+            job_queue = SqliteJobQueue(config.JOB_DB_PATH, ttl=config.JOB_TTL_S, stale_after=config.JOB_STALE_S)
+        elif config.JOB_QUEUE == "memory":
+            job_queue = MemoryJobQueue(ttl=config.JOB_TTL_S)
+        else:
+            raise ValueError(f"Unknown job queue: {config.JOB_QUEUE} (expected memory or sqlite)")
+    return job_queue
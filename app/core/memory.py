@@ -0,0 +1,271 @@
+"""
+Memory budget of the image-processing path and per-request peak RSS.
+
+MemoryBudget is a process-wide admission controller: before a page is decoded, the
+request reserves an estimate of the memory it will hold (upload, decoded pixels,
+encoded output and its base64 copy; estimate_image_bytes) and is queued while the
+budget (MEMORY_BUDGET_MB) is exhausted. A request waits at most MEMORY_WAIT_S and then
+gets 503; one whose estimate exceeds the whole budget is refused at once. Model
+activations are not part of the estimate: they are bounded by the inference workers.
+
+Peak RSS: start_request()/finish_request() follow the process RSS while a request is
+handled, sampled every REQUEST_MEMORY_SAMPLE_MS by one background thread (so inference
+running in the worker pool is covered too). The RSS is the whole process's: concurrent requests
+contribute to each other's peak.
+"""
+import asyncio
+import collections
+import contextvars
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from . import config, metrics
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Bytes of an encoded annotated image per decoded byte (PNG of a document scan, generous)
+_ENCODED_RATIO = 0.5
+
+
+class MemoryBudgetError(Exception):
+    """Raised when a request cannot get its memory reservation."""
+
+    def __init__(self, nbytes: int, too_large: bool):
+        self.nbytes = nbytes
+        # The estimate exceeds the whole budget (never admitted) rather than a wait timeout
+        self.too_large = too_large
+        super().__init__(
+            f"Request needs ~{nbytes / 2**20:.0f} MiB, more than the memory budget."
+            if too_large else "Memory budget exhausted, retry later."
+        )
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of this process (Linux /proc), None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def estimate_image_bytes(pixels: int, encoded_bytes: int = 0, render: bool = False, inline: bool = False) -> int:
+    """
+    Memory a request holds for one page: the encoded upload, the decoded BGR pixels and,
+    when it returns an annotated image (render), the encoded image plus its base64 copy (inline).
+    """
+    decoded = 3 * pixels
+    total = encoded_bytes + decoded
+    if render:
+        encoded = int(_ENCODED_RATIO * decoded)
+        total += encoded + (encoded * 4 // 3 if inline else 0)
+    return total
+
+
+class MemoryBudget:
+    """
+    Reservations of estimated bytes against a fixed capacity, granted in FIFO order.
+    Use from the event loop thread.
+    """
+
+    def __init__(self, capacity_bytes: int, wait_s: float = config.MEMORY_WAIT_S):
+        self.capacity = capacity_bytes
+        self.wait_s = wait_s
+        self.reserved = 0
+        self._waiters = collections.deque()  # (future, nbytes)
+        self.granted = 0
+        self.waited = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, wait_forever: bool = False):
+        """Holds `nbytes` of the budget for the block (see acquire)."""
+        await self.acquire(nbytes, wait_forever)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    async def acquire(self, nbytes: int, wait_forever: bool = False):
+        """
+        Reserves `nbytes`, waiting for room at most wait_s (as long as it takes with
+        wait_forever, e.g. pages of an accepted batch); raises MemoryBudgetError.
+        Every successful acquire() must be paired with release(nbytes).
+        """
+        if not self.enabled:
+            return
+        await self._acquire(nbytes, None if wait_forever else self.wait_s)
+        record = current_request_memory.get()
+        if record is not None:
+            record.reserved += nbytes
+
+    def release(self, nbytes: int):
+        if self.enabled:
+            self._release(nbytes)
+
+    async def _acquire(self, nbytes: int, timeout: Optional[float]):
+        if nbytes > self.capacity:
+            self.rejected += 1
+            MEMORY_REJECTIONS.inc(reason="too_large")
+            raise MemoryBudgetError(nbytes, too_large=True)
+        if not self._waiters and self.reserved + nbytes <= self.capacity:
+            self.reserved += nbytes
+            self.granted += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, nbytes)
+        self._waiters.append(entry)
+        self.waited += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # Granted in the same iteration: hand the bytes back
+                self._release(nbytes)
+            else:
+                waiter.cancel()
+                self._waiters.remove(entry)
+                self._grant()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.rejected += 1
+                MEMORY_REJECTIONS.inc(reason="timeout")
+                raise MemoryBudgetError(nbytes, too_large=False)
+            raise
+        self.granted += 1
+
+    def _release(self, nbytes: int):
+        self.reserved -= nbytes
+        self._grant()
+
+    def _grant(self):
+        # FIFO: a large request at the head is not overtaken by smaller ones behind it
+        while self._waiters and self.reserved + self._waiters[0][1] <= self.capacity:
+            waiter, nbytes = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.reserved += nbytes
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "capacity_bytes": self.capacity,
+            "reserved_bytes": self.reserved,
+            "waiting": len(self._waiters),
+            "granted": self.granted,
+            "waited": self.waited,
+            "rejected": self.rejected,
+        }
+
+
+memory_budget: Optional[MemoryBudget] = None
+
+
+def get_memory_budget() -> MemoryBudget:
+    """Process-wide budget of MEMORY_BUDGET_MB (0: disabled, reservations always granted)."""
+    global memory_budget
+    if memory_budget is None:
+        memory_budget = MemoryBudget(config.MEMORY_BUDGET_MB << 20)
+    return memory_budget
+
+
+# --- Per-request peak RSS ---
+
+class RequestMemory:
+    """RSS at the start of a request, the highest RSS seen while it ran and its reserved bytes."""
+
+    __slots__ = ("start_rss", "peak_rss", "reserved")
+
+    def __init__(self, rss: int):
+        self.start_rss = rss
+        self.peak_rss = rss
+        self.reserved = 0
+
+    def sample(self, rss: int):
+        if rss > self.peak_rss:
+            self.peak_rss = rss
+
+
+current_request_memory: contextvars.ContextVar = contextvars.ContextVar("current_request_memory", default=None)
+
+
+class RssSampler:
+    """One daemon thread sampling the RSS for every tracked request; idle while none is."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self._active = set()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, record: RequestMemory):
+        with self._cond:
+            self._active.add(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def remove(self, record: RequestMemory):
+        with self._cond:
+            self._active.discard(record)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                active = list(self._active)
+            rss = rss_bytes()
+            if rss is not None:
+                for record in active:
+                    record.sample(rss)
+            time.sleep(self.interval_s)
+
+
+_sampler: Optional[RssSampler] = None
+
+
+def start_request() -> Optional[RequestMemory]:
+    """
+    Starts following the RSS for a request (set the record as current_request_memory
+    while it is handled); None when REQUEST_MEMORY_SAMPLE_MS is 0 or the RSS cannot be read.
+    """
+    global _sampler
+    rss = rss_bytes() if config.REQUEST_MEMORY_SAMPLE_MS > 0 else None
+    if rss is None:
+        return None
+    if _sampler is None:
+        _sampler = RssSampler(config.REQUEST_MEMORY_SAMPLE_MS / 1000.0)
+    record = RequestMemory(rss)
+    _sampler.add(record)
+    return record
+
+
+def finish_request(record: RequestMemory):
+    _sampler.remove(record)
+    record.sample(rss_bytes() or 0)
+
+
+REQUEST_PEAK_RSS = metrics.Histogram(
+    "layout_request_peak_rss_megabytes", "Process RSS peak while a request was handled.", ["endpoint"],
+    buckets=(128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 16384),
+)
+MEMORY_REJECTIONS = metrics.Counter(
+    "layout_memory_rejections_total", "Requests refused by the memory budget.", ["reason"]
+)
+metrics.Gauge(
+    "layout_memory_reserved_bytes", "Estimated bytes reserved by requests in progress.",
+    callback=lambda: memory_budget.reserved if memory_budget is not None else 0,
+)
+metrics.Gauge(
+    "layout_memory_waiting", "Requests waiting for memory budget.",
+    callback=lambda: memory_budget.stats()["waiting"] if memory_budget is not None else 0,
+)
@@ -1,43 +1,479 @@
-import layoutparser as lp
-import torch
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Awaitable, Callable, FrozenSet, List, NamedTuple, Optional
+
+import numpy as np
+
+from . import config, runtime
+from .tiling import cut_edges, merge_tile_detections, tile_grid
+
+# torch, layoutparser/Detectron2 and the backends are imported where a model is loaded
+# or run, not here: importing this module (labels, options, MODEL_ID) stays cheap for
+# the API process until the model is needed and for tools that only evaluate
+
+logger = logging.getLogger(__name__)
 
 model = None
 
 # PubLayNet document layout labels
 PUBLAYNET_LABELS = {0: "Text", 1: "Title", 2: "List", 3: "Table", 4: "Figure"}
 
+CONFIG_PATH = 'lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config'
+# Prefer a local, pre-downloaded weight and config to avoid runtime download failures in Docker
+LOCAL_WEIGHTS = '/app/model_weights/publaynet_frcnn_r50_fpn_3x.pth'
+LOCAL_CONFIG = '/app/model_weights/publaynet_frcnn_r50_fpn_3x.yaml'
+# Page used for warm-up inference and for tracing exported backends
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), "..", "data", "example_data.png")
+SCORE_THRESH = 0.5
+# Test-time input size of the config (INPUT.MIN_SIZE_TEST / MAX_SIZE_TEST)
+INPUT_MIN_SIZE = 800
+INPUT_MAX_SIZE = 1333
+
+
+class ModelSpec(NamedTuple):
+    """A servable PubLayNet layout model (all of them share PUBLAYNET_LABELS names)."""
+    name: str  # what requests pass as `model`
+    key: str  # identity in cache keys
+    family: str  # detectron2 | efficientdet
+    config_path: str  # layoutparser catalog path
+    local_config: Optional[str]  # pre-downloaded config (Detectron2), preferred when present
+    local_weights: Optional[str]  # pre-downloaded weights, preferred when present
+    memory_mb: int  # estimated resident size once loaded (registry memory cap)
+
+
+MODEL_SPECS = {spec.name: spec for spec in (
+    # Lightweight: EfficientDet-D0 (512 px input), several times faster than Faster R-CNN on CPU
+    ModelSpec("effdet_d0", "publaynet_effdet_d0", "efficientdet", "lp://efficientdet/PubLayNet/tf_efficientdet_d0",
+              None, "/app/model_weights/publaynet_effdet_d0.pth.tar", 200),
+    ModelSpec("frcnn_r50", "publaynet_frcnn_r50_fpn_3x", "detectron2", CONFIG_PATH, LOCAL_CONFIG, LOCAL_WEIGHTS, 600),
+    # Heavy: Mask R-CNN X101-32x8d, the most accurate PubLayNet model of the layoutparser zoo
+    ModelSpec("mrcnn_x101", "publaynet_mrcnn_x101_fpn_3x", "detectron2", "lp://PubLayNet/mask_rcnn_X_101_32x8d_FPN_3x/config",
+              "/app/model_weights/publaynet_mrcnn_x101_fpn_3x.yaml", "/app/model_weights/publaynet_mrcnn_x101_fpn_3x.pth", 1200),
+)}
+
+
+if config.DEFAULT_MODEL not in MODEL_SPECS:
+    raise ValueError(f"Unknown DEFAULT_MODEL {config.DEFAULT_MODEL} (expected one of {', '.join(MODEL_SPECS)})")
+
+
+def model_backend(name: str, backend: str = config.INFERENCE_BACKEND) -> str:
+    """Backend a model runs on: INFERENCE_BACKEND for Detectron2 models, eager for the others."""
+    return backend if MODEL_SPECS[name].family == "detectron2" else "eager"
+
+
+def model_id(name: str) -> str:
+    """Identity of a model + config producing detections; part of every cache key."""
+    spec = MODEL_SPECS[name]
+    identity = f"{spec.key}|score_thresh={SCORE_THRESH}|backend={model_backend(name)}"
+    if config.TILE_SIZE:
+        identity += f"|tile={config.TILE_SIZE}/{config.TILE_OVERLAP}"
+    return identity
+
+
+# Identity of the default model (get_model)
+MODEL_ID = model_id(config.DEFAULT_MODEL)
+
+class DetectionOptions(NamedTuple):
+    """
+    Per-request detection controls, applied inside the ROI head of the eager/int8 models
+    (see roi_options) and as a final filter for the others and for tiled pages.
+    None keeps the model default (SCORE_THRESH, all classes, up to 100 detections).
+    """
+    score_threshold: Optional[float] = None
+    classes: Optional[FrozenSet[int]] = None  # PUBLAYNET_LABELS ids
+    max_detections: Optional[int] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.score_threshold is None and self.classes is None and self.max_detections is None
+
+    def cache_part(self) -> str:
+        """Identity of the options in cache keys."""
+        classes = ",".join(map(str, sorted(self.classes))) if self.classes is not None else None
+        return f"score={self.score_threshold}|classes={classes}|max={self.max_detections}"
+
+
+def label_id(name: str) -> Optional[int]:
+    """PUBLAYNET_LABELS id of a label name (case-insensitive), None if unknown."""
+    for label, label_name in PUBLAYNET_LABELS.items():
+        if label_name.lower() == name.lower():
+            return label
+    return None
+
 def get_label_name(label_id):
     try:
         return PUBLAYNET_LABELS.get(int(label_id), str(label_id))
     except Exception:
         return str(label_id)
 
+def load_model(backend: str = config.INFERENCE_BACKEND, name: str = config.DEFAULT_MODEL):
+    """
+    Builds a new PubLayNet layout detection model (document layout), MODEL_SPECS[name],
+    for the given inference backend (see core/backends.py; Detectron2 models only).
+    Uses MPS when available for the eager backend, otherwise CPU. Sizes torch's thread
+    pools for the node first, unless this process already did (runtime.configure_threads).
+    """
+    import torch
+    from .backends import wrap_backend
+
+    runtime.configure_threads()
+
+    spec = MODEL_SPECS[name]
+    backend = model_backend(name, backend)
+    device = 'mps' if backend == "eager" and torch.backends.mps.is_available() else 'cpu'
+    if spec.family == "efficientdet":
+        return _load_efficientdet(spec, device)
+    # Exports of other models than the original one get a directory of their own
+    export_dir = config.MODEL_EXPORT_DIR if spec.local_weights == LOCAL_WEIGHTS else os.path.join(config.MODEL_EXPORT_DIR, name)
+    return wrap_backend(_load_detectron2(spec, device), backend, export_dir)
+
+def _check_offline(paths):
+    # Strict offline: local files only, fail fast instead of reaching out to the network
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise RuntimeError(f"MODEL_OFFLINE is set but model files are missing: {', '.join(missing)} (run download.py)")
+
+def _load_detectron2(spec: ModelSpec, device: str):
+    import layoutparser as lp
+
+    extra_config = ["MODEL.ROI_HEADS.SCORE_THRESH_TEST", SCORE_THRESH, "MODEL.DEVICE", device]
+    config_path = spec.local_config if os.path.exists(spec.local_config) else spec.config_path
+    if config.MODEL_OFFLINE:
+        _check_offline((spec.local_config, spec.local_weights))
+        return lp.Detectron2LayoutModel(
+            config_path=spec.local_config,
+            model_path=spec.local_weights,
+            label_map=PUBLAYNET_LABELS,
+            extra_config=extra_config,
+        )
+    try:
+        return lp.Detectron2LayoutModel(
+            config_path=config_path,
+            model_path=spec.local_weights,
+            label_map=PUBLAYNET_LABELS,
+            extra_config=extra_config,
+        )
+    except Exception:
+        # Fallback to remote if local file missing; layoutparser will attempt to fetch
+        logger.warning("Loading local weights %s failed; downloading the model instead", spec.local_weights, exc_info=True)
+        return lp.Detectron2LayoutModel(
+            config_path=spec.config_path,
+            label_map=PUBLAYNET_LABELS,
+            extra_config=extra_config,
+        )
+
+def _load_efficientdet(spec: ModelSpec, device: str):
+    import layoutparser as lp
+
+    if config.MODEL_OFFLINE:
+        _check_offline((spec.local_weights,))
+    return lp.EfficientDetLayoutModel(
+        config_path=spec.config_path,
+        # None: layoutparser downloads the weights of config_path
+        model_path=spec.local_weights if os.path.exists(spec.local_weights) else None,
+        # EfficientDet ids start at 1 (0 is the background)
+        label_map={label + 1: name for label, name in PUBLAYNET_LABELS.items()},
+        extra_config={"output_confidence_threshold": SCORE_THRESH},
+        device=device,
+    )
+
 def get_model():
     """
-    Loads and returns the PubLayNet layout detection model (document layout).
-    Uses MPS when available, otherwise CPU.
+    Returns the process-wide instance of the default model (DEFAULT_MODEL), loading it on first use.
     """
     global model
     if model is None:
-        device = 'mps' if torch.backends.mps.is_available() else 'cpu'
-        # Prefer a local, pre-downloaded weight to avoid runtime download failures in Docker
-        local_weights = '/app/model_weights/publaynet_frcnn_r50_fpn_3x.pth'
-        try:
-            model = lp.Detectron2LayoutModel(
-                config_path='lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config',
-                model_path=local_weights,
-                label_map=PUBLAYNET_LABELS,
-                extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.5, "MODEL.DEVICE", device]
-            )
-        except Exception:
-            # Fallback to remote if local file missing; layoutparser will attempt to fetch
-            model = lp.Detectron2LayoutModel(
-                config_path='lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config',
-                label_map=PUBLAYNET_LABELS,
-                extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.5, "MODEL.DEVICE", device]
-            )
+        model = load_model()
     return model
 
-def predict(image):
-    model = get_model()
-    return model.detect(image)
+def needs_tiling(image, tile_size: int = config.TILE_SIZE) -> bool:
+    return tile_size > 0 and max(image.shape[:2]) > tile_size
+
+def predict(image, model=None, options: Optional[DetectionOptions] = None):
+    if model is None:
+        model = get_model()
+    if options is None or options.is_default:
+        if needs_tiling(image):
+            return predict_tiled(image, model=model)
+        return model.detect(image)
+    with roi_options(model, options):
+        if needs_tiling(image):
+            layout = predict_tiled(image, model=model)
+        else:
+            layout = model.detect(image)
+    return filter_layout(layout, options)
+
+@contextmanager
+def roi_options(model, options: DetectionOptions):
+    """
+    Applies the options inside Detectron2's box predictor for the duration of the block:
+    score threshold and top-k go to fast_rcnn_inference (so a lower threshold than
+    SCORE_THRESH yields more boxes), and unwanted classes get zero probability before
+    thresholding and NMS, so they never take a top-k slot. The model must not be used by
+    another thread meanwhile (each inference worker owns its handle).
+    Exported backends (torchscript/onnx) have this baked into the graph: no-op for them.
+    """
+    if not _is_detectron2(model):
+        yield
+        return
+    import torch
+
+    head = model.model.model.roi_heads.box_predictor
+    saved = head.test_score_thresh, head.test_topk_per_image
+    if options.score_threshold is not None:
+        head.test_score_thresh = options.score_threshold
+    if options.max_detections is not None:
+        head.test_topk_per_image = min(head.test_topk_per_image, options.max_detections)
+    if options.classes is not None:
+        predict_probs = head.predict_probs
+        # Probabilities are (R, K + 1) with the background last
+        keep = torch.zeros(head.num_classes + 1)
+        keep[sorted(options.classes)] = 1.0
+        keep[-1] = 1.0
+
+        def filtered_probs(predictions, proposals):
+            return [probs * keep.to(probs.device) for probs in predict_probs(predictions, proposals)]
+
+        head.predict_probs = filtered_probs
+    try:
+        yield
+    finally:
+        head.test_score_thresh, head.test_topk_per_image = saved
+        head.__dict__.pop("predict_probs", None)
+
+def filter_layout(layout, options: Optional[DetectionOptions]):
+    """
+    The options as a filter over a finished Layout (a new Layout; the input may be cached):
+    enforces them for exported backends and after tiles are merged. Cheap when roi_options
+    already applied them.
+    """
+    if options is None or options.is_default:
+        return layout
+    import layoutparser as lp
+
+    blocks = [
+        block for block in layout
+        if (options.score_threshold is None or block.score >= options.score_threshold)
+        and (options.classes is None or _label_id(block.type) in options.classes)
+    ]
+    if options.max_detections is not None and len(blocks) > options.max_detections:
+        blocks = sorted(blocks, key=lambda block: block.score, reverse=True)[:options.max_detections]
+    return lp.Layout(blocks)
+
+def _is_detectron2(model) -> bool:
+    import layoutparser as lp
+
+    return isinstance(model, lp.Detectron2LayoutModel)
+
+def _label_id(label):
+    # Layout types are label names (label_map applied) or raw ids
+    if isinstance(label, str):
+        found = label_id(label)
+        return found if found is not None else label
+    return int(label)
+
+def predict_tiled(
+    image,
+    model=None,
+    tile_size: int = config.TILE_SIZE,
+    overlap: int = config.TILE_OVERLAP,
+    batch_size: int = config.TILE_BATCH_SIZE,
+):
+    """
+    Detects on overlapping tile_size x tile_size windows of the page (numpy views, no copies),
+    batch_size tiles per forward pass, and merges the boxes across tile seams into one Layout.
+    The network input, and so peak inference memory, is bounded by the tile rather than the page.
+    """
+    import layoutparser as lp
+
+    if model is None:
+        model = get_model()
+    height, width = image.shape[:2]
+    tiles = tile_grid(height, width, tile_size, overlap)
+    boxes, labels, scores, cut = [], [], [], []
+    for start in range(0, len(tiles), batch_size):
+        chunk = tiles[start:start + batch_size]
+        layouts = _forward_batch([image[y0:y1, x0:x1] for x0, y0, x1, y1 in chunk], model)
+        for (x0, y0, x1, y1), layout in zip(chunk, layouts):
+            if not len(layout):
+                continue
+            tile_boxes = np.array(
+                [[b.block.x_1 + x0, b.block.y_1 + y0, b.block.x_2 + x0, b.block.y_2 + y0] for b in layout],
+                dtype=np.float64,
+            )
+            boxes.append(tile_boxes)
+            labels.extend(b.type for b in layout)
+            scores.extend(float(b.score) for b in layout)
+            cut.append(cut_edges(tile_boxes, (x0, y0, x1, y1), height, width))
+    if not boxes:
+        return lp.Layout()
+    merged_boxes, merged_labels, merged_scores = merge_tile_detections(
+        np.concatenate(boxes), labels, np.asarray(scores), np.concatenate(cut)
+    )
+    return lp.Layout([
+        lp.TextBlock(lp.Rectangle(*box), type=label, score=score)
+        for box, label, score in zip(merged_boxes.tolist(), merged_labels, merged_scores.tolist())
+    ])
+
+def predict_batch(images, model=None):
+    """
+    Runs several images through the underlying Detectron2 network in a single forward pass.
+    Returns one Layout per input image, in input order.
+    """
+    if model is None:
+        model = get_model()
+    if any(needs_tiling(image) for image in images):
+        # Large pages are tiled on their own; the rest still share one forward pass
+        small = [i for i, image in enumerate(images) if not needs_tiling(image)]
+        results = [predict_tiled(image, model=model) if needs_tiling(image) else None for image in images]
+        if small:
+            for i, layout in zip(small, _forward_batch([images[i] for i in small], model)):
+                results[i] = layout
+        return results
+    return _forward_batch(images, model)
+
+def _forward_batch(images, model):
+    if len(images) == 1 or not _is_detectron2(model):
+        # Exported backends take one image per call
+        return [model.detect(image) for image in images]
+    import torch
+
+    # Same preprocessing as detectron2's DefaultPredictor.__call__, but for a list of images
+    predictor = model.model
+    inputs = []
+    with torch.no_grad():
+        for image in images:
+            image = model.image_loader(image)
+            if predictor.input_format == "RGB":
+                image = image[:, :, ::-1]
+            height, width = image.shape[:2]
+            resized = predictor.aug.get_transform(image).apply_image(image)
+            tensor = torch.as_tensor(resized.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+        outputs = predictor.model(inputs)
+    return [model.gather_output(out) for out in outputs]
+
+
+class BatchScheduler:
+    """
+    Gathers predict requests arriving within `max_wait_ms` (up to `max_batch_size`)
+    and hands them to `dispatch` as one list; each caller gets back its own Layout.
+    dispatch: async callable taking a list of images and returning a list of Layouts.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[List], Awaitable[List]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+    ):
+        self._dispatch = dispatch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = None
+        self._task = None
+        self._running = set()
+        # Stats
+        self._batches = 0
+        self._requests = 0
+        self._sizes = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def enqueue(self, image, on_finished: Optional[Callable[[], None]] = None) -> asyncio.Future:
+        """
+        Queues the image for a batch and returns the future of its Layout. on_finished is
+        called once the image is out of the scheduler: its batch's dispatch returned (even
+        if the future was cancelled meanwhile) or it was dropped before dispatch.
+        """
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image, future, time.perf_counter(), on_finished))
+        return future
+
+    async def submit(self, image):
+        return await self.enqueue(image)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Run the batch in the background so the next one can gather meanwhile
+            task = loop.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        now = time.perf_counter()
+        # Callers that gave up (timeout, disconnect) are dropped before inference
+        dropped = [item for item in batch if item[1].done()]
+        batch = [item for item in batch if not item[1].done()]
+        self._finished(dropped)
+        if not batch:
+            return
+        self._batches += 1
+        self._requests += len(batch)
+        self._sizes[len(batch)] += 1
+        for _, _, enqueued, _ in batch:
+            waited = now - enqueued
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            layouts = await self._dispatch([image for image, _, _, _ in batch])
+        except Exception as exc:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            self._finished(batch)
+        for (_, future, _, _), layout in zip(batch, layouts):
+            if not future.done():
+                future.set_result(layout)
+
+    @staticmethod
+    def _finished(items):
+        for _, _, _, on_finished in items:
+            if on_finished is not None:
+                on_finished()
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self._batches,
+            "requests": self._requests,
+            "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._sizes.items())},
+            "mean_queue_wait_ms": 1000.0 * self._wait_total / self._requests if self._requests else 0.0,
+            "max_queue_wait_ms": 1000.0 * self._wait_max,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
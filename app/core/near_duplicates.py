@@ -0,0 +1,270 @@
+"""
+Near-duplicate page index: reuses the layout of an already seen page for new scans of
+the same form, template or letterhead, which the exact (pixel hash) detection cache misses.
+
+A page signature (page_signature) holds
+- a 64-bit DCT perceptual hash of the grayscale page shrunk to 32x32, to find
+  candidates by Hamming distance
+- the page shrunk to THUMB_SIZE x THUMB_SIZE, to re-verify a candidate: the scan offset
+  is estimated by phase correlation and the aligned thumbnails must correlate well
+- the aspect ratio
+
+A lookup hits when a stored page is within `max_distance` bits, has about the same
+aspect ratio and correlates at least `min_similarity` once aligned; its layout is then
+scaled and shifted onto the new page. Everything else falls back to full inference
+(and is added to the index).
+"""
+import os
+import pickle
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from . import config, metrics
+from .model import MODEL_ID
+
+HASH_SIZE = 32
+THUMB_SIZE = 64
+# Candidates (nearest by Hamming distance) re-verified per lookup
+MAX_CANDIDATES = 8
+# Max relative difference of the aspect ratios of matching pages
+ASPECT_TOLERANCE = 0.03
+
+_BIT_WEIGHTS = (1 << np.arange(64, dtype=np.uint64)).astype(np.uint64)
+_WINDOW = cv2.createHanningWindow((THUMB_SIZE, THUMB_SIZE), cv2.CV_32F)
+
+
+class PageSignature(NamedTuple):
+    phash: int
+    thumb: np.ndarray  # (THUMB_SIZE, THUMB_SIZE) float32, zero-mean, unit-norm
+    aspect: float  # width / height
+
+
+class Match(NamedTuple):
+    slot: int
+    similarity: float
+    shift: Tuple[float, float]  # offset of the new page against the stored one, in fractions of width/height
+
+
+def _normalized(thumb: np.ndarray) -> np.ndarray:
+    thumb = thumb - thumb.mean()
+    norm = float(np.linalg.norm(thumb))
+    return thumb / norm if norm > 0 else thumb
+
+
+def page_signature(image) -> PageSignature:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    thumb = cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    small = cv2.resize(thumb, (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:8, :8].ravel()
+    # The DC term only encodes overall brightness; leave it out of the median
+    bits = low > np.median(low[1:])
+    phash = int((bits.astype(np.uint64) * _BIT_WEIGHTS).sum())
+    height, width = image.shape[:2]
+    return PageSignature(phash, _normalized(thumb), width / height if height else 1.0)
+
+
+def align(stored: np.ndarray, thumb: np.ndarray) -> Tuple[float, Tuple[float, float]]:
+    """
+    Estimates the offset of `thumb` against `stored` by phase correlation and returns
+    (correlation of the aligned thumbnails, offset in thumbnail pixels).
+    """
+    # phaseCorrelate applies the window to its inputs in place
+    (dx, dy), _ = cv2.phaseCorrelate(stored.copy(), thumb.copy(), _WINDOW)
+    shifted = cv2.warpAffine(
+        thumb, np.float32([[1, 0, -dx], [0, 1, -dy]]), (THUMB_SIZE, THUMB_SIZE), borderMode=cv2.BORDER_REPLICATE
+    )
+    return float((stored * _normalized(shifted)).sum()), (dx, dy)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _layout_arrays(layout) -> Tuple[np.ndarray, List, np.ndarray]:
+    boxes = np.array([[b.block.x_1, b.block.y_1, b.block.x_2, b.block.y_2] for b in layout], dtype=np.float64)
+    return boxes.reshape(-1, 4), [b.type for b in layout], np.array([float(b.score) for b in layout])
+
+
+class NearDuplicateIndex:
+    """
+    Thread-safe in-memory index of page signatures and their layouts (stored as arrays in
+    the page's pixel coordinates, ~16 KiB per page with the thumbnail). Holds at most
+    `max_entries` pages, replacing the oldest.
+    With `path` set, the index is loaded from and periodically saved to that file; a file
+    written for another model (`model_id`) is ignored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        max_distance: int = 14,
+        min_similarity: float = 0.9,
+        path: Optional[str] = None,
+        model_id: str = "",
+        save_every: int = 64,
+    ):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        self.path = path
+        self.model_id = model_id
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(max(0, max_entries), dtype=np.uint64)
+        self._thumbs = np.zeros((max(0, max_entries), THUMB_SIZE, THUMB_SIZE), dtype=np.float32)
+        self._aspects = np.zeros(max(0, max_entries), dtype=np.float64)
+        self._entries: List[Optional[tuple]] = [None] * max(0, max_entries)  # ((height, width), boxes, labels, scores)
+        self._size = 0
+        self._next = 0
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def search(self, signature: PageSignature) -> Optional[Match]:
+        """Best match among the nearest stored pages after re-verification, or None."""
+        with self._lock:
+            n = self._size
+            if not n:
+                return None
+            distance = _popcount(self._hashes[:n] ^ np.uint64(signature.phash))
+            aspect_diff = np.abs(self._aspects[:n] - signature.aspect) / signature.aspect
+            candidates = np.flatnonzero((distance <= self.max_distance) & (aspect_diff <= ASPECT_TOLERANCE))
+            candidates = candidates[np.argsort(distance[candidates], kind="stable")[:MAX_CANDIDATES]]
+            thumbs = self._thumbs[candidates]
+        best = None
+        for slot, stored in zip(candidates.tolist(), thumbs):
+            similarity, (dx, dy) = align(stored, signature.thumb)
+            if similarity >= self.min_similarity and (best is None or similarity > best.similarity):
+                best = Match(slot, similarity, (dx / THUMB_SIZE, dy / THUMB_SIZE))
+        return best
+
+    def layout(self, match: Match, height: int, width: int):
+        """The layout stored for a match, scaled and shifted onto a height x width page (a new Layout)."""
+        import layoutparser as lp
+
+        with self._lock:
+            (src_height, src_width), boxes, labels, scores = self._entries[match.slot]
+        dx, dy = match.shift[0] * width, match.shift[1] * height
+        boxes = boxes * np.array([width / src_width, height / src_height] * 2) + np.array([dx, dy, dx, dy])
+        boxes[:, 0::2] = boxes[:, 0::2].clip(0, width)
+        boxes[:, 1::2] = boxes[:, 1::2].clip(0, height)
+        return lp.Layout([
+            lp.TextBlock(lp.Rectangle(*box), type=label, score=score)
+            for box, label, score in zip(boxes.tolist(), labels, scores.tolist())
+        ])
+
+    def lookup(self, image) -> Tuple[PageSignature, Optional[object]]:
+        """Returns (signature, layout for the image or None on a miss); pass the signature to add()."""
+        signature = page_signature(image)
+        match = self.search(signature)
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        NEAR_DUPLICATE_LOOKUPS.inc(result="miss" if match is None else "hit")
+        if match is None:
+            return signature, None
+        return signature, self.layout(match, *image.shape[:2])
+
+    def add(self, signature: PageSignature, shape, layout) -> int:
+        """Stores the layout of a page (of `shape`) under its signature; returns its slot."""
+        entry = (tuple(shape[:2]),) + _layout_arrays(layout)
+        with self._lock:
+            slot = self._next
+            self._hashes[slot] = np.uint64(signature.phash)
+            self._thumbs[slot] = signature.thumb
+            self._aspects[slot] = signature.aspect
+            self._entries[slot] = entry
+            self._next = (slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+            self._unsaved += 1
+            save = bool(self.path) and self._unsaved >= self.save_every
+        if save:
+            self.save()
+        return slot
+
+    def save(self):
+        if not self.path or not self.enabled:
+            return
+        with self._lock:
+            n = self._size
+            state = {
+                "model_id": self.model_id,
+                "hashes": self._hashes[:n].copy(),
+                "thumbs": self._thumbs[:n].copy(),
+                "aspects": self._aspects[:n].copy(),
+                "entries": self._entries[:n],
+                "next": self._next,
+            }
+            self._unsaved = 0
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            # Corrupt or incompatible file: start empty, it is rewritten on the next save
+            return
+        if state.get("model_id") != self.model_id:
+            return
+        n = min(len(state["hashes"]), self.max_entries)
+        self._hashes[:n] = state["hashes"][:n]
+        self._thumbs[:n] = state["thumbs"][:n]
+        self._aspects[:n] = state["aspects"][:n]
+        self._entries[:n] = state["entries"][:n]
+        self._size = n
+        self._next = state["next"] % self.max_entries if n == self.max_entries else n
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "max_distance": self.max_distance,
+            "min_similarity": self.min_similarity,
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+NEAR_DUPLICATE_LOOKUPS = metrics.Counter(
+    "layout_near_duplicate_lookups_total", "Near-duplicate page index lookups by result.", ["result"]
+)
+
+near_duplicate_index: Optional[NearDuplicateIndex] = None
+
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """Process-wide near-duplicate index (NEAR_DUPLICATE_INDEX_SIZE=0 disables it)."""
+    global near_duplicate_index
+    if near_duplicate_index is None:
+        near_duplicate_index = NearDuplicateIndex(
+            max_entries=config.NEAR_DUPLICATE_INDEX_SIZE,
+            max_distance=config.NEAR_DUPLICATE_MAX_DISTANCE,
+            min_similarity=config.NEAR_DUPLICATE_MIN_SIMILARITY,
+            path=config.NEAR_DUPLICATE_INDEX_PATH or None,
+            model_id=MODEL_ID,
+        )
+    return near_duplicate_index
@@ -0,0 +1,274 @@
+"""
+Model registry: the named layout models a process serves (model.MODEL_SPECS, enabled by MODELS).
+
+Every inference worker has its own ModelRegistry (a Detectron2 model is never shared between
+threads, see model.roi_options). Models are loaded on first use, the default one
+(DEFAULT_MODEL) by the executor's warm-up. A loaded model is charged its estimated size
+(ModelSpec.memory_mb); when loading one would take the worker over MODEL_MEMORY_MB, the
+least recently used others are unloaded first. The default model is never unloaded.
+
+Besides a model name, requests may ask for
+- cascade:  the cheap model of CASCADE_MODELS first; a page whose confidence (mean detection
+  score, 0 without detections) is below CASCADE_MIN_CONFIDENCE is run on the expensive one
+- ensemble: every model of ENSEMBLE_MODELS, detections fused class-wise (duplicates of one
+  block are merged into a score-weighted box, see tiling.merge_tile_detections)
+
+ModelUsage records the inference latency per model and the cascade's escalation rate.
+"""
+import collections
+import gc
+import logging
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import config, metrics
+from .model import MODEL_SPECS, get_model, load_model, model_backend
+from .tiling import merge_tile_detections
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cascade", "ensemble")
+
+_unknown = [name for name in config.MODELS if name not in MODEL_SPECS]
+if _unknown:
+    logger.warning("MODELS names unknown models, ignored: %s (known: %s)", ", ".join(_unknown), ", ".join(MODEL_SPECS))
+# The default model is always served
+ENABLED_MODELS = tuple(dict.fromkeys([config.DEFAULT_MODEL] + [name for name in config.MODELS if name in MODEL_SPECS]))
+
+
+def _model_set(names: List[str], setting: str) -> Optional[tuple]:
+    """Models of CASCADE_MODELS/ENSEMBLE_MODELS if there are two or more and all are enabled, else None."""
+    if not names:
+        return None
+    disabled = [name for name in names if name not in ENABLED_MODELS]
+    if len(names) < 2 or disabled:
+        logger.warning("%s needs two or more models of MODELS (%s), got %s: disabled", setting, ", ".join(ENABLED_MODELS), ", ".join(names))
+        return None
+    return tuple(names)
+
+
+# (cheap, expensive)
+CASCADE_MODELS = _model_set(config.CASCADE_MODELS[:2], "CASCADE_MODELS")
+ENSEMBLE_MODELS = _model_set(config.ENSEMBLE_MODELS, "ENSEMBLE_MODELS")
+
+
+def resolve_model(name: Optional[str]) -> str:
+    """The model (or mode) a request asked for, DEFAULT_MODEL for None; ValueError when it is not served."""
+    if name is None:
+        return config.DEFAULT_MODEL
+    if name in ENABLED_MODELS:
+        return name
+    if name == "cascade" and CASCADE_MODELS is not None:
+        return name
+    if name == "ensemble" and ENSEMBLE_MODELS is not None:
+        return name
+    served = list(ENABLED_MODELS) + [mode for mode, models in zip(MODES, (CASCADE_MODELS, ENSEMBLE_MODELS)) if models]
+    raise ValueError(f"Unknown model {name} (available: {', '.join(served)}).")
+
+
+def page_confidence(layout) -> float:
+    """Mean score of a page's detections; 0 for a page without any (the cheap model may have missed them)."""
+    scores = [float(block.score) for block in layout]
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def fuse_layouts(layouts):
+    """One Layout of the detections of several models on the same page, overlapping same-class boxes fused."""
+    import layoutparser as lp
+
+    blocks = [block for layout in layouts for block in layout]
+    if not blocks:
+        return lp.Layout()
+    boxes = np.array([[b.block.x_1, b.block.y_1, b.block.x_2, b.block.y_2] for b in blocks], dtype=np.float64)
+    boxes, labels, scores = merge_tile_detections(
+        boxes, [b.type for b in blocks], np.array([float(b.score) for b in blocks]), np.zeros(len(blocks), dtype=bool)
+    )
+    return lp.Layout([
+        lp.TextBlock(lp.Rectangle(*box), type=label, score=score)
+        for box, label, score in zip(boxes.tolist(), labels, scores.tolist())
+    ])
+
+
+# Every registry of this process, for stats
+_registries = weakref.WeakSet()
+
+
+class ModelRegistry:
+    """
+    One inference worker's loaded models by name, least recently used first.
+    get() is called by the worker that owns the registry only.
+    """
+
+    def __init__(self, memory_mb: int = config.MODEL_MEMORY_MB, pinned: str = config.DEFAULT_MODEL, loader=load_model):
+        self.memory_mb = memory_mb
+        self.pinned = pinned
+        self._loader = loader
+        self._models = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = collections.Counter()
+        self.unloads = collections.Counter()
+        self.load_seconds: Dict[str, float] = {}
+        _registries.add(self)
+
+    def adopt(self, name: str, model):
+        """Registers an already loaded model (the process-wide default model) without loading it."""
+        with self._lock:
+            self._models[name] = model
+
+    def get(self, name: str):
+        """The model `name`, loaded on first use (after unloading least recently used ones over the memory cap)."""
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+            self._make_room(name)
+            start = time.perf_counter()
+            model = self._loader(name=name)
+            self.load_seconds[name] = time.perf_counter() - start
+            self._models[name] = model
+            self.loads[name] += 1
+            MODEL_LOADS.inc(model=name)
+            logger.info("Loaded model %s in %.1f s", name, self.load_seconds[name])
+            return model
+
+    def _make_room(self, name: str):
+        if not self.memory_mb:
+            return
+        need = MODEL_SPECS[name].memory_mb
+        unloaded = False
+        for loaded in list(self._models):
+            if self.loaded_mb() + need <= self.memory_mb:
+                break
+            if loaded == self.pinned:
+                continue
+            del self._models[loaded]
+            self.unloads[loaded] += 1
+            MODEL_UNLOADS.inc(model=loaded)
+            logger.info("Unloaded model %s to make room for %s", loaded, name)
+            unloaded = True
+        if unloaded:
+            # Detectron2 modules hold reference cycles: free their weights before loading the next model
+            gc.collect()
+
+    def loaded(self) -> List[str]:
+        """Loaded model names, least recently used first."""
+        return list(self._models)
+
+    def loaded_mb(self) -> int:
+        return sum(MODEL_SPECS[name].memory_mb for name in list(self._models))
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded(),
+            "loaded_mb": self.loaded_mb(),
+            "loads": dict(self.loads),
+            "unloads": dict(self.unloads),
+            "load_seconds": dict(self.load_seconds),
+        }
+
+
+registry: Optional[ModelRegistry] = None
+
+
+def get_registry() -> ModelRegistry:
+    """Process-wide registry (process workers, callers outside the pool), holding the process-wide default model."""
+    global registry
+    if registry is None:
+        registry = ModelRegistry()
+        registry.adopt(config.DEFAULT_MODEL, get_model())
+    return registry
+
+
+class ModelUsage:
+    """Inference calls and recent latencies per model, and the cascade's routing decisions."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._latencies: Dict[str, collections.deque] = {}
+        self._calls = collections.Counter()
+        self._seconds = collections.Counter()
+        self._lock = threading.Lock()
+        self.cascade_pages = 0
+        self.escalated = 0
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            recent = self._latencies.get(name)
+            if recent is None:
+                recent = self._latencies[name] = collections.deque(maxlen=self.window)
+            recent.append(seconds)
+            self._calls[name] += 1
+            self._seconds[name] += seconds
+        MODEL_SECONDS.observe(seconds, model=name)
+
+    def route(self, escalated: bool):
+        """Records one page routed by the cascade."""
+        with self._lock:
+            self.cascade_pages += 1
+            self.escalated += int(escalated)
+        CASCADE_PAGES.inc(outcome="escalated" if escalated else "accepted")
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {}
+            for name, recent in self._latencies.items():
+                ordered = sorted(recent)
+                models[name] = {
+                    "calls": self._calls[name],
+                    "mean_ms": 1000.0 * self._seconds[name] / self._calls[name],
+                    # Over the last `window` calls
+                    "p50_ms": 1000.0 * ordered[len(ordered) // 2],
+                    "p95_ms": 1000.0 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                }
+            return {
+                "models": models,
+                "cascade": {
+                    "pages": self.cascade_pages,
+                    "escalated": self.escalated,
+                    "escalation_rate": self.escalated / self.cascade_pages if self.cascade_pages else 0.0,
+                },
+            }
+
+
+usage = ModelUsage()
+
+
+def diagnostics() -> dict:
+    """Served models with their latency, the cascade's escalation rate and the models loaded per worker (for /stats/models)."""
+    used = usage.stats()
+    models = {}
+    for name in ENABLED_MODELS:
+        spec = MODEL_SPECS[name]
+        models[name] = {
+            "family": spec.family,
+            "backend": model_backend(name),
+            "memory_mb": spec.memory_mb,
+            **used["models"].get(name, {"calls": 0}),
+        }
+    cascade = None
+    if CASCADE_MODELS:
+        cascade = {"models": list(CASCADE_MODELS), "min_confidence": config.CASCADE_MIN_CONFIDENCE, **used["cascade"]}
+    return {
+        "default": config.DEFAULT_MODEL,
+        "models": models,
+        "cascade": cascade,
+        "ensemble": {"models": list(ENSEMBLE_MODELS)} if ENSEMBLE_MODELS else None,
+        "memory_mb": config.MODEL_MEMORY_MB,
+        # Registries of thread workers (process workers keep theirs in the worker processes)
+        "workers": [r.stats() for r in list(_registries)],
+    }
+
+
+MODEL_SECONDS = metrics.Histogram("layout_model_inference_seconds", "Inference latency per model (queue wait included).", ["model"])
+CASCADE_PAGES = metrics.Counter("layout_cascade_pages_total", "Pages routed by the model cascade.", ["outcome"])
+MODEL_LOADS = metrics.Counter("layout_model_loads_total", "Models loaded by inference workers.", ["model"])
+MODEL_UNLOADS = metrics.Counter("layout_model_unloads_total", "Models unloaded to stay under MODEL_MEMORY_MB.", ["model"])
+metrics.Gauge(
+    "layout_models_loaded", "Models loaded by the inference workers of this process.",
+    callback=lambda: sum(len(r.loaded()) for r in list(_registries)),
+)
@@ -0,0 +1,291 @@
+"""
+Per-node runtime tuning: torch thread pools and adaptive inference concurrency.
+
+Thread pools: by default torch sizes its intra-op pool to every core of the machine, in
+every process and for every concurrent forward pass. With several server processes
+(app.serve) and inference workers per node that oversubscribes the cores many times
+over and p99 latency suffers. plan_threads() splits the cores the process may actually
+use (CPU affinity and the cgroup CPU quota of the container) between the concurrent
+inferences of the node: SERVE_WORKERS * INFERENCE_WORKERS. configure_threads() applies
+a plan once per process (again after fork); load_model() calls it, so every model user
+gets a sized pool unless the process configured one explicitly before.
+
+Adaptive concurrency (ADAPTIVE_CONCURRENCY): ConcurrencyLimiter caps the forward passes
+the executor runs at once between 1 and INFERENCE_WORKERS. The limit is lowered
+multiplicatively while the smoothed inference latency is above the target and raised
+by one while it is below (AIMD, at most once per `limit` completed calls). The target
+is ADAPTIVE_TARGET_LATENCY_MS, or ADAPTIVE_LATENCY_TOLERANCE times the lowest recent
+latency (the node's uncontended latency) when unset. With an automatic thread plan, each
+forward pass gets the intra-op threads planned for `limit` concurrent passes rather than
+INFERENCE_WORKERS (use_threads), so a lower limit gives the remaining calls the idle
+cores instead of only shedding load.
+"""
+import asyncio
+import collections
+import math
+import os
+import sys
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from . import config
+
+_CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+class ThreadPlan(NamedTuple):
+    intra_op: int
+    inter_op: Optional[int]  # None: left as it is
+    source: str  # auto | TORCH_THREADS | OMP_NUM_THREADS | explicit
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_v2_dirs():
+    # The process's own cgroup first (hosts), then the root (containers see their cgroup there)
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        if line.startswith("0::"):
+            yield os.path.join(_CGROUP_ROOT, line[3:].lstrip("/"))
+    yield _CGROUP_ROOT
+
+
+def cpu_quota() -> Optional[float]:
+    """CPUs granted by the cgroup CPU quota (v2 cpu.max, v1 cfs_quota_us/cfs_period_us); None without a quota."""
+    for directory in _cgroup_v2_dirs():
+        value = _read(os.path.join(directory, "cpu.max"))
+        if value is not None:
+            quota, _, period = value.partition(" ")
+            if quota == "max":
+                return None
+            return int(quota) / int(period or 100000)
+    for directory in ("cpu", "cpu,cpuacct", "cpuacct,cpu"):
+        quota = _read(os.path.join(_CGROUP_ROOT, directory, "cpu.cfs_quota_us"))
+        period = _read(os.path.join(_CGROUP_ROOT, directory, "cpu.cfs_period_us"))
+        if quota is not None and period is not None:
+            return int(quota) / int(period) if int(quota) > 0 else None
+    return None
+
+
+def _affinity_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def available_cpus() -> int:
+    """Cores this process can use: the CPU affinity mask, capped by the cgroup quota (rounded up)."""
+    cpus = _affinity_cpus()
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def plan_threads(
+    processes: int = config.SERVE_WORKERS,
+    inference_workers: int = config.INFERENCE_WORKERS,
+) -> ThreadPlan:
+    """
+    Thread counts for one process out of `processes`, each running `inference_workers`
+    forward passes at once. TORCH_THREADS (or OMP_NUM_THREADS) overrides the intra-op count.
+    """
+    inter_op = config.TORCH_INTEROP_THREADS or None
+    if config.TORCH_THREADS:
+        return ThreadPlan(config.TORCH_THREADS, inter_op, "TORCH_THREADS")
+    omp = os.environ.get("OMP_NUM_THREADS", "")
+    if omp.isdigit() and int(omp) > 0:
+        return ThreadPlan(int(omp), inter_op, "OMP_NUM_THREADS")
+    concurrent = max(1, processes) * max(1, inference_workers)
+    return ThreadPlan(max(1, available_cpus() // concurrent), inter_op, "auto")
+
+
+# The plan applied in this process; the pid tells a forked child it has not configured its own
+_applied: Optional[Dict] = None
+_applied_pid: Optional[int] = None
+_configure_lock = threading.Lock()
+
+
+def configure_threads(plan: Optional[ThreadPlan] = None, force: bool = False) -> Dict:
+    """
+    Applies `plan` (default: plan_threads()) to torch, once per process unless `force`.
+    The inter-op pool can only be sized before its first use; if it is already running
+    it is left as it is. Returns the applied settings.
+    """
+    global _applied, _applied_pid
+    with _configure_lock:
+        if _applied_pid == os.getpid() and not force:
+            return _applied
+        import torch
+
+        plan = plan or plan_threads()
+        torch.set_num_threads(plan.intra_op)
+        if plan.inter_op is not None:
+            try:
+                torch.set_num_interop_threads(plan.inter_op)
+            except RuntimeError:
+                pass
+        _applied = {
+            "intra_op": torch.get_num_threads(),
+            "inter_op": torch.get_num_interop_threads(),
+            "source": plan.source,
+        }
+        _applied_pid = os.getpid()
+        return _applied
+
+
+# Intra-op threads last set by use_threads() in the calling worker thread
+_call_threads = threading.local()
+
+
+def use_threads(threads: Optional[int]):
+    """
+    Sizes torch's intra-op threads for the forward passes of the calling inference worker
+    (thread or process), e.g. to the current adaptive concurrency limit; None leaves them.
+    torch keeps the OpenMP count per thread, so each worker thread sets its own.
+    """
+    if threads is None or getattr(_call_threads, "value", None) == threads:
+        return
+    import torch
+
+    torch.set_num_threads(threads)
+    _call_threads.value = threads
+
+
+def diagnostics() -> Dict:
+    """CPU budget of the node and the thread settings of this process (for /stats/runtime)."""
+    plan = plan_threads()
+    applied = _applied if _applied_pid == os.getpid() else None
+    torch = sys.modules.get("torch")  # reported only once something has loaded it
+    return {
+        "pid": os.getpid(),
+        "cpus": {
+            "os": os.cpu_count(),
+            "affinity": _affinity_cpus(),
+            "cgroup_quota": cpu_quota(),
+            "available": available_cpus(),
+        },
+        "serve_workers": config.SERVE_WORKERS,
+        "inference_workers": config.INFERENCE_WORKERS,
+        "planned_threads": plan._asdict(),
+        "applied_threads": applied,
+        "torch_threads": {
+            "intra_op": torch.get_num_threads(),
+            "inter_op": torch.get_num_interop_threads(),
+        } if torch is not None and hasattr(torch, "get_num_threads") else None,
+    }
+
+
+class ConcurrencyLimiter:
+    """
+    AIMD limit on concurrent inference calls (see the module docstring). acquire() and
+    release() must be called on the event loop thread. The executor sizes the intra-op
+    threads of each call from `limit` (threads_for).
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        target_ms: float = config.ADAPTIVE_TARGET_LATENCY_MS,
+        tolerance: float = config.ADAPTIVE_LATENCY_TOLERANCE,
+        window: int = 100,
+        smoothing: float = 0.2,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.target_ms = target_ms if target_ms > 0 else None
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self._recent = collections.deque(maxlen=window)
+        self._ewma: Optional[float] = None
+        self._inflight = 0
+        self._since_adjust = 0
+        self._waiters = collections.deque()
+        self._threads: Dict[int, Optional[int]] = {}  # limit -> intra-op threads per call
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def threads_for(self) -> Optional[int]:
+        """Intra-op threads for a call admitted now: the automatic plan at `limit` concurrent calls (None: set explicitly)."""
+        threads = self._threads.get(self.limit)
+        if self.limit not in self._threads:
+            plan = plan_threads(inference_workers=self.limit)
+            threads = self._threads[self.limit] = plan.intra_op if plan.source == "auto" else None
+        return threads
+
+    def target(self) -> Optional[float]:
+        """Latency target in seconds (None until the first sample when derived)."""
+        if self.target_ms is not None:
+            return self.target_ms / 1000.0
+        return self.tolerance * min(self._recent) if self._recent else None
+
+    async def acquire(self):
+        if self._inflight < self.limit and not self._waiters:
+            self._inflight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot in the same iteration it was cancelled: pass it on
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, seconds: Optional[float] = None):
+        """Frees a slot; `seconds` is the call's inference latency (None: failed, not observed)."""
+        self._inflight -= 1
+        if seconds is not None:
+            self._observe(seconds)
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._inflight += 1
+                waiter.set_result(None)
+
+    def _observe(self, seconds: float):
+        self._recent.append(seconds)
+        self._ewma = seconds if self._ewma is None else self.smoothing * seconds + (1 - self.smoothing) * self._ewma
+        self._since_adjust += 1
+        if self._since_adjust < self.limit:
+            return
+        self._since_adjust = 0
+        target = self.target()
+        if self._ewma > target and self.limit > self.min_limit:
+            self.limit = max(self.min_limit, self.limit - max(1, self.limit // 4))
+            self.decreases += 1
+        elif self._ewma <= target and self.limit < self.max_limit:
+            self.limit += 1
+            self.increases += 1
+
+    def stats(self) -> Dict:
+        target = self.target()
+        return {
+            "adaptive": True,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "inflight": self._inflight,
+            "waiting": len(self._waiters),
+            "latency_ewma_ms": 1000.0 * self._ewma if self._ewma is not None else None,
+            "latency_min_ms": 1000.0 * min(self._recent) if self._recent else None,
+            "target_ms": 1000.0 * target if target is not None else None,
+            "threads_per_call": self.threads_for(),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
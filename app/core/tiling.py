@@ -0,0 +1,134 @@
+"""
+Tiled inference helpers for pages larger than the model's input size.
+
+A page is cut into overlapping square tiles (tile_grid); the detections of all
+tiles are brought back to page coordinates and merged class-aware
+(merge_tile_detections):
+- duplicates from the overlap band (IoU >= nms_iou) are fused into one box,
+  score-weighted like weighted box fusion
+- a box cut by an interior tile edge is absorbed by a same-class box containing it
+- two cut pieces of one block straddling a seam (aligned along the seam) are joined
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Distance (px) from an interior tile edge at which a box counts as cut by it
+EDGE_MARGIN = 2.0
+
+
+def tile_grid(height: int, width: int, tile_size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """
+    (x0, y0, x1, y1) windows covering the page with at least `overlap` px shared
+    between neighbours; the first and last row/column are aligned to the page edges.
+    Overlap is capped at half a tile.
+    """
+    overlap = min(overlap, tile_size // 2)
+
+    def spans(length: int) -> List[Tuple[int, int]]:
+        if length <= tile_size:
+            return [(0, length)]
+        # Fewest tiles keeping the overlap, spread evenly so no tile is nearly redundant
+        count = -(-(length - overlap) // (tile_size - overlap))
+        step = (length - tile_size) / (count - 1)
+        return [(int(round(i * step)), int(round(i * step)) + tile_size) for i in range(count)]
+
+    return [(x0, y0, x1, y1) for y0, y1 in spans(height) for x0, x1 in spans(width)]
+
+
+def cut_edges(boxes: np.ndarray, tile: Tuple[int, int, int, int], height: int, width: int) -> np.ndarray:
+    """Marks (page-coordinate) boxes touching an edge of `tile` that is not a page edge."""
+    x0, y0, x1, y1 = tile
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x0 > 0:
+        cut |= boxes[:, 0] <= x0 + EDGE_MARGIN
+    if y0 > 0:
+        cut |= boxes[:, 1] <= y0 + EDGE_MARGIN
+    if x1 < width:
+        cut |= boxes[:, 2] >= x1 - EDGE_MARGIN
+    if y1 < height:
+        cut |= boxes[:, 3] >= y1 - EDGE_MARGIN
+    return cut
+
+
+def _interval_iou(a1, a2, b1, b2):
+    inter = np.maximum(0.0, np.minimum(a2, b2) - np.maximum(a1, b1))
+    union = np.maximum(a2, b2) - np.minimum(a1, b1)
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def merge_tile_detections(
+    boxes: np.ndarray,
+    labels: Sequence,
+    scores: np.ndarray,
+    cut: np.ndarray,
+    nms_iou: float = 0.5,
+    contain_thresh: float = 0.8,
+    seam_iou: float = 0.5,
+) -> Tuple[np.ndarray, List, np.ndarray]:
+    """
+    Merges detections gathered from all tiles (page coordinates, `cut` from cut_edges).
+    Boxes are visited by descending score and either join the first matching
+    same-class cluster or start a new one. Returns (boxes, labels, scores) of the clusters.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind="stable")
+
+    fused = np.empty((len(boxes), 4), dtype=np.float64)  # cluster boxes, first n rows used
+    cluster_labels: List = []
+    cluster_cut: List[bool] = []
+    weights: List[float] = []
+    members: List[List[int]] = []
+    n = 0
+    for i in order:
+        box = boxes[i]
+        target = -1
+        if n:
+            c = fused[:n]
+            iw = np.maximum(0.0, np.minimum(c[:, 2], box[2]) - np.maximum(c[:, 0], box[0]))
+            ih = np.maximum(0.0, np.minimum(c[:, 3], box[3]) - np.maximum(c[:, 1], box[1]))
+            inter = iw * ih
+            area_c = (c[:, 2] - c[:, 0]) * (c[:, 3] - c[:, 1])
+            area_b = (box[2] - box[0]) * (box[3] - box[1])
+            union = area_c + area_b - inter
+            iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+            smaller = np.minimum(area_c, area_b)
+            contained = np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+            any_cut = np.asarray(cluster_cut[:n]) | cut[i]
+            both_cut = np.asarray(cluster_cut[:n]) & cut[i]
+            along_seam = np.maximum(
+                _interval_iou(c[:, 0], c[:, 2], box[0], box[2]),
+                _interval_iou(c[:, 1], c[:, 3], box[1], box[3]),
+            )
+            match = (
+                (iou >= nms_iou)
+                | (any_cut & (contained >= contain_thresh))
+                | (both_cut & (inter > 0) & (along_seam >= seam_iou))
+            )
+            match &= np.fromiter((lbl == labels[i] for lbl in cluster_labels), dtype=bool, count=n)
+            hits = np.flatnonzero(match)
+            if hits.size:
+                target = int(hits[0])
+        if target < 0:
+            fused[n] = box
+            cluster_labels.append(labels[i])
+            cluster_cut.append(bool(cut[i]))
+            weights.append(float(scores[i]))
+            members.append([i])
+            n += 1
+            continue
+        members[target].append(i)
+        cluster_cut[target] = cluster_cut[target] or bool(cut[i])
+        if cluster_cut[target]:
+            # Pieces of a block: the merged box spans all of them
+            fused[target, :2] = np.minimum(fused[target, :2], box[:2])
+            fused[target, 2:] = np.maximum(fused[target, 2:], box[2:])
+        else:
+            # Duplicates of a whole block: score-weighted average of the boxes
+            w = scores[i]
+            fused[target] = (fused[target] * weights[target] + box * w) / (weights[target] + w)
+        weights[target] += float(scores[i])
+
+    out_scores = np.array([scores[m].max() for m in members], dtype=np.float64)
+    return fused[:n].copy(), cluster_labels, out_scores
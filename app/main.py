@@ -1,17 +1,95 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
-from .core.model import get_model
+import asyncio
+import time
+from typing import Optional
+from .core import config, memory, metrics
+from .core.executor import get_executor
+from .core.near_duplicates import get_near_duplicate_index
 from .api.endpoints import router as api_router
+from .api.jobs import router as jobs_router, get_job_runner
+from .api.eval_sessions import router as eval_sessions_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the ML model
-    get_model()
+    # Start and warm up the inference workers in the background: the server answers
+    # /health right away and /ready once the model is loaded and warmed up
+    executor = get_executor()
+    startup = asyncio.ensure_future(executor.start())
+    # A failed startup is reported by /ready; retrieve it here so asyncio does not log it as unhandled
+    startup.add_done_callback(lambda task: task.cancelled() or task.exception())
+    # Background workers of the job API
+    runner = get_job_runner()
+    runner.start()
     yield
+    await runner.stop()
+    await executor.shutdown()
+    # Persist the near-duplicate index (NEAR_DUPLICATE_INDEX_PATH) for the next start
+    get_near_duplicate_index().save()
 
 app = FastAPI(title="Document Layout Detector API", lifespan=lifespan)
 
 app.include_router(api_router)
+app.include_router(jobs_router)
+app.include_router(eval_sessions_router)
+
+async def _finish_request(body, record: Optional[memory.RequestMemory], endpoint: str):
+    """
+    Passes the response body through. Once it is sent (or the client went away), the request
+    leaves the in-flight gauge and its peak RSS is recorded: for streamed responses (NDJSON
+    batches, job events) that is long after call_next returned.
+    """
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        metrics.IN_FLIGHT.dec()
+        if record is not None:
+            memory.finish_request(record)
+            memory.REQUEST_PEAK_RSS.observe(record.peak_rss / 2**20, endpoint=endpoint)
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    """
+    Request count/latency/in-flight metrics; traced requests get a Server-Timing header.
+    A request counts as in flight until its body is sent, streamed bodies included.
+    Every response reports the process's peak RSS while it was handled (X-Peak-RSS-MB; for
+    streamed bodies up to the first byte) and the memory budget it reserved (X-Memory-Reserved-MB).
+    """
+    trace = None
+    if config.TRACE_REQUESTS or request.headers.get("x-trace", "").lower() in ("1", "true", "yes"):
+        trace = metrics.RequestTrace()
+    token = metrics.current_trace.set(trace)
+    record = memory.start_request()
+    memory_token = memory.current_request_memory.set(record)
+    metrics.IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    except BaseException:
+        metrics.IN_FLIGHT.dec()
+        if record is not None:
+            memory.finish_request(record)
+        raise
+    finally:
+        metrics.current_trace.reset(token)
+        memory.current_request_memory.reset(memory_token)
+        # Route template, not the raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        metrics.REQUESTS.inc(endpoint=endpoint, status=str(status))
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    if trace is not None and trace.spans:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if record is not None:
+        record.sample(memory.rss_bytes() or 0)
+        response.headers["X-Peak-RSS-MB"] = f"{record.peak_rss / 2**20:.1f}"
+        response.headers["X-Memory-Reserved-MB"] = f"{record.reserved / 2**20:.1f}"
+    response.body_iterator = _finish_request(response.body_iterator, record, endpoint)
+    return response
 
 @app.get("/")
 def read_root():
@@ -20,3 +98,14 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once the model is loaded and warmed up in every worker, 503 before (or if loading failed)."""
+    executor = get_executor()
+    state = executor.readiness()
+    return JSONResponse(state, status_code=200 if executor.ready else 503)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,140 @@
+"""
+Pre-fork server: loads the model once, then forks N uvicorn workers sharing one listening socket.
+
+The model weights are loaded in the master before forking, so the workers share them
+copy-on-write (read-only pages stay shared: ~1 copy of the weights instead of N) and
+start serving without loading anything. Each worker still warms up with one inference
+(WARMUP_INFERENCE) before /ready reports it ready. Dead workers are respawned.
+
+Usage:
+  python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+With more than one worker JOB_QUEUE (and with it EVAL_SESSIONS) defaults to sqlite, so
+jobs and evaluation sessions created on one worker are visible to all of them.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("app.serve")
+
+# A worker exiting sooner than this after its start is restarted with a delay
+RESPAWN_BACKOFF_S = 1.0
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, log_level: str):
+    import uvicorn
+    from .core import runtime
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Split the node's cores between the workers instead of every worker using all of them
+    runtime.configure_threads()
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="server processes (default: SERVE_WORKERS or 1)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(message)s")
+
+    workers = args.workers if args.workers is not None else max(1, int(os.environ.get("SERVE_WORKERS", "1")))
+    # Must be decided before app.core.config is imported
+    os.environ["SERVE_WORKERS"] = str(workers)
+    if workers > 1:
+        os.environ.setdefault("JOB_QUEUE", "sqlite")
+
+    from .core import config, runtime
+    from .core.model import get_model
+
+    if workers > 1 and config.JOB_QUEUE == "memory":
+        logger.warning("JOB_QUEUE=memory with %d workers: a job is only visible to the worker it was submitted to", workers)
+
+    # No intra-op thread pool in the master: OpenMP pools do not survive fork.
+    # The inter-op pool is left unsized so each worker can still size its own
+    runtime.configure_threads(runtime.ThreadPlan(1, None, "explicit"))
+    start = time.perf_counter()
+    try:
+        get_model()
+    except Exception:
+        logger.exception("Loading the model failed")
+        return 1
+    logger.info("Model loaded in %.1f s, forking %d workers", time.perf_counter() - start, workers)
+    from .main import app
+
+    # Objects created so far (the model included) are never collected: keeps the collector
+    # from writing to their pages in the workers, which would unshare them
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind(args.host, args.port)
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, args.log_level)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning("Worker %d exited with code %d, restarting", pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < RESPAWN_BACKOFF_S:
+            time.sleep(RESPAWN_BACKOFF_S)
+        if not stopping:
+            spawn()
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Accuracy/latency parity of the inference backends (eager, int8, torchscript, onnx).
+
+Runs every backend over the same images and reports per-image latency and
+mAP@[.5:.95] / AP50 of each backend measured against the eager model's detections
+(and against COCO ground truth when --annotations is given), using the repo's
+own evaluation utilities.
+
+Usage:
+  python -m app.tools.backend_parity --images DIR [--annotations coco.json] \
+      [--backends eager int8 torchscript onnx] [--limit 50] [--output parity.json]
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from ..core.backends import BACKENDS, SAMPLE_IMAGE
+from ..core.model import get_label_name, load_model
+from ..utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, index_coco_annotations
+from ..utils.pages import list_images
+
+
+def _run_backend(backend: str, images: Dict[str, np.ndarray]):
+    model = load_model(backend)
+    first = next(iter(images.values()))
+    model.detect(first)  # warm-up (lazy init, allocator)
+    preds, latencies = {}, []
+    for name, img in images.items():
+        start = time.perf_counter()
+        layout = model.detect(img)
+        latencies.append(time.perf_counter() - start)
+        preds[name] = [
+            {
+                "bbox": [block.block.x_1, block.block.y_1, block.block.x_2, block.block.y_2],
+                "label": get_label_name(block.type),
+                "score": float(block.score),
+            }
+            for block in layout
+        ]
+    return preds, latencies
+
+
+def _score(preds: Dict[str, List[Dict]], reference: Dict[str, List[Dict]]) -> Dict:
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS)
+    for name, p in preds.items():
+        accumulator.add(p, [{"bbox": r["bbox"], "label": r["label"]} for r in reference.get(name, [])])
+    summary = accumulator.summary()
+    return {"map": summary["map"], "ap50": summary["map_per_iou"]["0.50"], "f1": summary["f1"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="image directory (defaults to the bundled example)")
+    parser.add_argument("--annotations", default=None, help="optional COCO ground truth for the images")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    images = {}
+    for path in [SAMPLE_IMAGE] if args.images is None else list_images(args.images, args.limit):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            images[os.path.basename(path)] = img
+    if not images:
+        parser.error("no readable images")
+    ground_truth = None
+    if args.annotations:
+        with open(args.annotations, "rb") as f:
+            ground_truth = index_coco_annotations(f.read())
+
+    # eager is always run first: it is the reference for the others
+    backends = ["eager"] + [b for b in args.backends if b != "eager"]
+    report, reference = {}, None
+    for backend in backends:
+        preds, latencies = _run_backend(backend, images)
+        if reference is None:
+            reference = preds
+        entry = {
+            "latency_ms_mean": 1000.0 * float(np.mean(latencies)),
+            "latency_ms_p50": 1000.0 * float(np.percentile(latencies, 50)),
+            "latency_ms_p95": 1000.0 * float(np.percentile(latencies, 95)),
+            "vs_eager": _score(preds, reference),
+        }
+        if ground_truth is not None:
+            entry["vs_ground_truth"] = _score(preds, ground_truth)
+        report[backend] = entry
+
+    eager_ms = report["eager"]["latency_ms_mean"]
+    print(f"{len(images)} images")
+    print(f"{'backend':<12} {'mean ms':>9} {'p95 ms':>9} {'speedup':>8} {'mAP/eager':>10} {'AP50/eager':>11}"
+          + (f" {'mAP/GT':>8}" if ground_truth is not None else ""))
+    for backend, entry in report.items():
+        line = (f"{backend:<12} {entry['latency_ms_mean']:>9.1f} {entry['latency_ms_p95']:>9.1f}"
+                f" {eager_ms / entry['latency_ms_mean']:>7.2f}x {entry['vs_eager']['map']:>10.4f}"
+                f" {entry['vs_eager']['ap50']:>11.4f}")
+        if ground_truth is not None:
+            line += f" {entry['vs_ground_truth']['map']:>8.4f}"
+        print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Offline evaluation of the layout model on a COCO-annotated image directory.
+
+Loads the COCO file once, runs detection over the images with a process pool
+(one model per worker), caches predictions on disk, and reports COCO-style
+mAP@[.5:.95] overall and per class (101-point interpolated AP as in COCOeval,
+with this service's greedy matching and no crowd/area/maxDets handling), plus
+P/R/F1/mean IoU at --iou.
+A worker loads its model on the first image missing from the cache, so a fully
+cached run never loads (or imports) torch. With --predictions (COCO detection
+results JSON) no model is involved at all: only NumPy matching and AP.
+
+Usage:
+  python -m app.tools.evaluate_dataset --images DIR --annotations coco.json \
+      [--workers 2] [--cache-dir .eval_cache] [--output results.json]
+  python -m app.tools.evaluate_dataset --annotations coco.json --predictions results.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+from tqdm import tqdm
+
+from ..core import runtime
+from ..core.cache import ResultCache, image_key
+from ..core.model import MODEL_ID, get_label_name, predict
+from ..utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, index_coco_annotations, index_coco_results
+
+_prediction_cache: Optional[ResultCache] = None
+
+
+def _init_worker(cache_dir: Optional[str], workers: int):
+    global _prediction_cache
+    # The pool's processes share the cores instead of each sizing its threads for all of them
+    runtime.configure_threads(runtime.plan_threads(processes=workers, inference_workers=1))
+    if cache_dir:
+        _prediction_cache = ResultCache(max_entries=0, disk_dir=cache_dir)
+
+
+def _detect_file(path: str) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Worker: returns (preds, error) for one image file, using the disk cache when set."""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None, "Could not decode image."
+    key = image_key(img, MODEL_ID) if _prediction_cache is not None else None
+    if key is not None:
+        cached = _prediction_cache.get(key)
+        if cached is not None:
+            return cached, None
+    try:
+        layout = predict(img)
+    except Exception as exc:
+        # One image failing (model error, out of memory) must not abort the whole run through pool.map
+        return None, f"Detection failed: {str(exc) or type(exc).__name__}"
+    preds = [
+        {
+            "bbox": [block.block.x_1, block.block.y_1, block.block.x_2, block.block.y_2],
+            "label": get_label_name(block.type),
+            "score": float(block.score),
+        }
+        for block in layout
+    ]
+    if key is not None:
+        _prediction_cache.put(key, preds)
+    return preds, None
+
+
+def evaluate_dataset(
+    images_dir: Optional[str],
+    annotations_path: str,
+    workers: int = 2,
+    cache_dir: Optional[str] = None,
+    iou_threshold: float = 0.5,
+    limit: Optional[int] = None,
+    predictions_path: Optional[str] = None,
+) -> Dict:
+    with open(annotations_path, "rb") as f:
+        coco_bytes = f.read()
+    index = index_coco_annotations(coco_bytes)
+
+    if predictions_path is not None:
+        with open(predictions_path, "rb") as f:
+            predictions = index_coco_results(f.read(), coco_bytes)
+        names = sorted(index)
+    else:
+        names = [name for name in sorted(index) if os.path.isfile(os.path.join(images_dir, name))]
+    missing = len(index) - len(names)
+    if limit is not None:
+        names = names[:limit]
+
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=iou_threshold)
+    failed: List[str] = []
+    start = time.perf_counter()
+    if predictions_path is not None:
+        for name in names:
+            accumulator.add(predictions[name], index[name])
+    else:
+        paths = [os.path.join(images_dir, name) for name in names]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_dir, workers)) as pool:
+            # map() keeps input order so each result pairs with its file name
+            results = pool.map(_detect_file, paths, chunksize=4)
+            progress = tqdm(zip(names, results), total=len(names), unit="img", file=sys.stderr)
+            for name, (preds, error) in progress:
+                if error is not None:
+                    failed.append(name)
+                    continue
+                accumulator.add(preds, index[name])
+                progress.set_postfix(img_per_s=f"{accumulator.images / (time.perf_counter() - start):.2f}")
+    elapsed = time.perf_counter() - start
+
+    summary = accumulator.summary()
+    summary["failed"] = failed
+    summary["missing_images"] = missing
+    summary["seconds"] = elapsed
+    summary["images_per_second"] = accumulator.images / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+def _print_report(summary: Dict):
+    print(f"images: {summary['images']}  (failed {len(summary['failed'])}, missing {summary['missing_images']})"
+          f"  {summary['images_per_second']:.2f} img/s")
+    print(f"mAP@[.5:.95] (101-pt) {summary['map']:.4f}  AP50 {summary['map_per_iou']['0.50']:.4f}"
+          f"  AP75 {summary['map_per_iou']['0.75']:.4f}")
+    print(f"@IoU {summary['iou_threshold']}: P {summary['precision']:.4f} | R {summary['recall']:.4f}"
+          f" | F1 {summary['f1']:.4f} | mIoU {summary['mean_iou']:.4f}"
+          f" | TP {summary['tp']} FP {summary['fp']} FN {summary['fn']}")
+    print(f"{'class':<12} {'gt':>7} {'det':>7} {'AP':>7} {'AP50':>7} {'AP75':>7}")
+    for label, c in summary["per_class"].items():
+        if c["ap"] is None:
+            print(f"{label:<12} {c['ground_truth']:>7} {c['detections']:>7} {'-':>7} {'-':>7} {'-':>7}")
+        else:
+            print(f"{label:<12} {c['ground_truth']:>7} {c['detections']:>7} {c['ap']:>7.4f}"
+                  f" {c['ap_per_iou']['0.50']:>7.4f} {c['ap_per_iou']['0.75']:>7.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="directory with the images listed in the COCO file")
+    parser.add_argument("--annotations", required=True, help="COCO annotations JSON")
+    parser.add_argument("--predictions", default=None, help="COCO detection results JSON to evaluate instead of running the model")
+    parser.add_argument("--workers", type=int, default=2, help="detection processes (each loads a model)")
+    parser.add_argument("--cache-dir", default=None, help="directory for cached predictions")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU threshold for P/R/F1 and mean IoU")
+    parser.add_argument("--limit", type=int, default=None, help="evaluate only the first N images")
+    parser.add_argument("--output", default=None, help="write the full summary as JSON")
+    args = parser.parse_args(argv)
+    if args.images is None and args.predictions is None:
+        parser.error("--images or --predictions is required")
+
+    summary = evaluate_dataset(
+        args.images, args.annotations, workers=args.workers, cache_dir=args.cache_dir,
+        iou_threshold=args.iou, limit=args.limit, predictions_path=args.predictions,
+    )
+    _print_report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Hit rate and accuracy of the near-duplicate page index against full inference.
+
+Every image (plus --rescans synthetic rescans of it: small shift, rotation, scale,
+noise and JPEG artefacts) is fed in random order through the index the way the
+service does: lookup first, full inference and insertion on a miss. Full inference
+also runs on every hit, and the reused layout is scored against it with
+evaluate_detections (P/R/F1, mean IoU at --iou) and mAP@[.5:.95].
+A hit on a stored page made from a different source image counts as a cross-template hit.
+
+Usage:
+  python -m app.tools.near_duplicate_report --images DIR [--rescans 3] [--limit 50] \
+      [--max-distance 14] [--min-similarity 0.9] [--output near_duplicates.json]
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from ..core import config
+from ..core.model import SAMPLE_IMAGE, get_label_name, get_model, predict
+from ..core.near_duplicates import NearDuplicateIndex, page_signature
+from ..utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, evaluate_detections
+from ..utils.pages import list_images
+
+
+def _rescan(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-0.7, 0.7), rng.uniform(0.99, 1.01))
+    matrix[:, 2] += (rng.uniform(-0.015, 0.015) * width, rng.uniform(-0.015, 0.015) * height)
+    out = cv2.warpAffine(image, matrix, (width, height), borderValue=(255, 255, 255))
+    out = np.clip(out + rng.normal(0, 4, out.shape), 0, 255).astype(np.uint8)
+    _, buf = cv2.imencode(".jpg", out, [cv2.IMWRITE_JPEG_QUALITY, int(rng.integers(60, 91))])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def _preds(layout) -> List[Dict]:
+    return [
+        {
+            "bbox": [block.block.x_1, block.block.y_1, block.block.x_2, block.block.y_2],
+            "label": get_label_name(block.type),
+            "score": float(block.score),
+        }
+        for block in layout
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="image directory (defaults to the bundled example)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--rescans", type=int, default=3, help="synthetic rescans per image")
+    parser.add_argument("--max-distance", type=int, default=config.NEAR_DUPLICATE_MAX_DISTANCE)
+    parser.add_argument("--min-similarity", type=float, default=config.NEAR_DUPLICATE_MIN_SIMILARITY)
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    pages = []  # (source, image)
+    for path in [SAMPLE_IMAGE] if args.images is None else list_images(args.images, args.limit):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        name = os.path.basename(path)
+        pages.append((name, img))
+        pages.extend((name, _rescan(img, rng)) for _ in range(args.rescans))
+    if not pages:
+        parser.error("no readable images")
+    order = rng.permutation(len(pages))
+
+    model = get_model()
+    predict(pages[0][1], model=model)  # warm-up (lazy init, allocator)
+    index = NearDuplicateIndex(
+        max_entries=len(pages), max_distance=args.max_distance, min_similarity=args.min_similarity
+    )
+    sources = {}  # slot -> source image
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=args.iou)
+    hit_metrics, lookup_s, inference_s = [], [], []
+    cross_template = 0
+    for i in order.tolist():
+        source, img = pages[i]
+        start = time.perf_counter()
+        signature = page_signature(img)
+        match = index.search(signature)
+        reused = index.layout(match, *img.shape[:2]) if match is not None else None
+        lookup_s.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        layout = predict(img, model=model)
+        inference_s.append(time.perf_counter() - start)
+        if match is None:
+            sources[index.add(signature, img.shape, layout)] = source
+            continue
+        cross_template += sources[match.slot] != source
+        reference = [{"bbox": p["bbox"], "label": p["label"]} for p in _preds(layout)]
+        result = evaluate_detections(_preds(reused), reference, iou_threshold=args.iou)
+        hit_metrics.append((result["f1"], result["mean_iou"], match.similarity))
+        accumulator.add(_preds(reused), reference)
+
+    hits = len(hit_metrics)
+    inference_ms = 1000.0 * float(np.mean(inference_s))
+    # Service latency with the index: a lookup for every page, inference only on misses
+    served_s = sum(lookup_s) + float(np.mean(inference_s)) * (len(pages) - hits)
+    summary = accumulator.summary() if hits else None
+    report = {
+        "pages": len(pages),
+        "sources": len(pages) // (args.rescans + 1),
+        "max_distance": args.max_distance,
+        "min_similarity": args.min_similarity,
+        "hits": hits,
+        "hit_rate": hits / len(pages),
+        "cross_template_hits": cross_template,
+        "lookup_ms_mean": 1000.0 * float(np.mean(lookup_s)),
+        "inference_ms_mean": inference_ms,
+        "speedup": sum(inference_s) / served_s if served_s else None,
+        "vs_full_inference": {
+            "f1_mean": float(np.mean([m[0] for m in hit_metrics])),
+            "mean_iou": float(np.mean([m[1] for m in hit_metrics])),
+            "similarity_mean": float(np.mean([m[2] for m in hit_metrics])),
+            "map": summary["map"],
+            "ap50": summary["map_per_iou"]["0.50"],
+        } if hits else None,
+    }
+
+    print(f"{report['pages']} pages from {report['sources']} images, "
+          f"max_distance={args.max_distance} min_similarity={args.min_similarity}")
+    print(f"hits {hits} ({100 * report['hit_rate']:.1f}%), cross-template hits {cross_template}")
+    print(f"lookup {report['lookup_ms_mean']:.1f} ms/page, inference {inference_ms:.1f} ms/page, "
+          f"speedup {report['speedup']:.2f}x")
+    if hits:
+        acc = report["vs_full_inference"]
+        print(f"reused vs full inference: F1@{args.iou} {acc['f1_mean']:.4f}, mean IoU {acc['mean_iou']:.4f}, "
+              f"mAP {acc['map']:.4f}, AP50 {acc['ap50']:.4f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Array-backed detections: boxes as an (N, 4) float32 xyxy array, int label ids into a
+tuple of label names, and float32 scores. evaluate_detections, DetectionAccumulator,
+draw_detections and draw_comparison take it directly, so a page's detections go from
+the model's Layout to metrics, drawing and the response without per-box dicts.
+
+Response encodings (encode_detections):
+- json:     [{"x_1", "y_1", "x_2", "y_2", "type", "score"}, ...] (the classic format)
+- columnar: {"names", "labels", "scores", "boxes"} with boxes flattened row-major
+            (x_1, y_1, x_2, y_2 per detection), rounded to 0.01 px / 1e-4 score
+- msgpack:  the columnar layout with labels/scores/boxes as raw little-endian
+            uint16/float32/float32 bytes (np.frombuffer on the client)
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ENCODINGS = ("json", "columnar", "msgpack")
+
+
+class Detections:
+    __slots__ = ("boxes", "labels", "scores", "names")
+
+    def __init__(
+        self,
+        boxes: np.ndarray,
+        labels: np.ndarray,
+        scores: Optional[np.ndarray] = None,
+        names: Sequence[str] = (),
+    ):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        # Ground truth has no scores
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1) if scores is not None else None
+        self.names = tuple(names)
+
+    @classmethod
+    def from_labels(cls, boxes, labels: Iterable[str], scores=None, names: Sequence[str] = ()) -> "Detections":
+        """From label names; labels missing from `names` are appended to them."""
+        vocabulary = {name: i for i, name in enumerate(names)}
+        ids = [vocabulary.setdefault(str(label), len(vocabulary)) for label in labels]
+        return cls(boxes, ids, scores, list(vocabulary))
+
+    @classmethod
+    def from_layout(cls, layout, names: Sequence[str] = (), label_name=str) -> "Detections":
+        """From a layoutparser Layout; label_name maps block types to label names."""
+        n = len(layout)
+        boxes = np.fromiter(
+            (v for b in layout for v in (b.block.x_1, b.block.y_1, b.block.x_2, b.block.y_2)),
+            dtype=np.float32, count=4 * n,
+        )
+        scores = np.fromiter((b.score for b in layout), dtype=np.float32, count=n)
+        return cls.from_labels(boxes, (label_name(b.type) for b in layout), scores, names)
+
+    @classmethod
+    def from_dicts(cls, items: List[Dict], names: Sequence[str] = ()) -> "Detections":
+        """From the evaluation format [{bbox: [x1, y1, x2, y2], label, score?}]."""
+        boxes = [item["bbox"] for item in items]
+        scores = [float(item.get("score", 0.0)) for item in items] if items and "score" in items[0] else None
+        return cls.from_labels(boxes, (item.get("label") for item in items), scores, names)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, index) -> "Detections":
+        """Subset (index array, mask or slice) sharing the label names."""
+        return Detections(
+            self.boxes[index], self.labels[index], self.scores[index] if self.scores is not None else None, self.names
+        )
+
+    def mapped(self, scale: Tuple[float, float] = (1.0, 1.0), origin: Tuple[float, float] = (0.0, 0.0)) -> "Detections":
+        """
+        Boxes shifted by `origin` and then scaled by `scale` (crop offset and reduced
+        decode back to original image pixels); self when both are the identity.
+        """
+        if scale == (1.0, 1.0) and origin == (0.0, 0.0):
+            return self
+        ox, oy = origin
+        sx, sy = scale
+        boxes = (self.boxes.astype(np.float64) + (ox, oy, ox, oy)) * (sx, sy, sx, sy)
+        return Detections(boxes, self.labels, self.scores, self.names)
+
+    def label_names(self) -> List[str]:
+        names = self.names
+        return [names[i] for i in self.labels.tolist()]
+
+    def score_order(self) -> np.ndarray:
+        """Indices by descending score (stable, like sorted(..., reverse=True) on scores)."""
+        if self.scores is None:
+            return np.arange(len(self))
+        return np.argsort(-self.scores, kind="stable")
+
+    def to_dicts(self) -> List[Dict]:
+        """The evaluation format [{bbox, label, score}]."""
+        scores = self.scores.tolist() if self.scores is not None else [None] * len(self)
+        return [
+            {"bbox": box, "label": label, "score": score} if score is not None else {"bbox": box, "label": label}
+            for box, label, score in zip(self.boxes.tolist(), self.label_names(), scores)
+        ]
+
+    def to_records(self) -> List[Dict]:
+        """The classic response format [{x_1, y_1, x_2, y_2, type, score}]."""
+        return [
+            {"x_1": x_1, "y_1": y_1, "x_2": x_2, "y_2": y_2, "type": label, "score": score}
+            for (x_1, y_1, x_2, y_2), label, score in zip(self.boxes.tolist(), self.label_names(), self.scores.tolist())
+        ]
+
+    def to_columns(self) -> Dict:
+        return {
+            "names": list(self.names),
+            "labels": self.labels.tolist(),
+            "scores": np.round(self.scores.astype(np.float64), 4).tolist(),
+            "boxes": np.round(self.boxes.astype(np.float64), 2).ravel().tolist(),
+        }
+
+    def to_binary_columns(self) -> Dict:
+        return {
+            "names": list(self.names),
+            "count": len(self),
+            "labels": self.labels.astype("<u2").tobytes(),
+            "scores": self.scores.astype("<f4").tobytes(),
+            "boxes": self.boxes.astype("<f4").tobytes(),
+        }
+
+
+def encode_detections(detections: Detections, encoding: str):
+    """The `detections` value of a response in the given encoding (bytes-holding dict for msgpack)."""
+    if encoding == "columnar":
+        return detections.to_columns()
+    if encoding == "msgpack":
+        return detections.to_binary_columns()
+    return detections.to_records()
+
+
+def packb(payload) -> bytes:
+    try:
+        import msgpack
+    except ImportError as exc:
+        raise RuntimeError("encoding=msgpack requires msgpack (pip install msgpack).") from exc
+    return msgpack.packb(payload, use_bin_type=True)
@@ -1,23 +1,43 @@
+import colorsys
+import zlib
+from functools import lru_cache
 import cv2
-from typing import Iterable
+from typing import Iterable, List, Tuple
 from ..core.model import get_label_name
+from .detections import Detections
 
 
-def draw_detections(image_bgr, layout: Iterable):
+def _columns(items, default_label: str) -> Tuple[List[List[int]], List[str], List]:
+    """(int boxes, labels, scores or None) of Detections or [{bbox, label, score?}] items."""
+    if isinstance(items, Detections):
+        scores = items.scores.tolist() if items.scores is not None else [None] * len(items)
+        return items.boxes.astype(int).tolist(), items.label_names(), scores
+    return (
+        [[int(v) for v in item["bbox"]] for item in items],
+        [str(item.get("label", default_label)) for item in items],
+        [item.get("score") for item in items],
+    )
+
+
+def _layout_rows(layout: Iterable):
+    if isinstance(layout, Detections):
+        yield from zip(*_columns(layout, ""))
+        return
+    for block in layout:
+        box = [int(block.block.x_1), int(block.block.y_1), int(block.block.x_2), int(block.block.y_2)]
+        yield box, get_label_name(block.type), block.score if hasattr(block, 'score') else None
+
+
+def draw_detections(image_bgr, layout: Iterable, inplace: bool = False):
     """
-    Draws bounding boxes and labels on a copy of the input BGR image.
-    layout: iterable of layoutparser TextBlock-like objects with .block and .type/.score
-    Returns a new BGR image with annotations.
+    Draws bounding boxes and labels on a copy of the input BGR image
+    (or on the image itself with inplace=True, when the caller no longer needs it).
+    layout: Detections, or an iterable of layoutparser TextBlock-like objects with .block and .type/.score
+    Returns a BGR image with annotations.
     """
-    annotated = image_bgr.copy()
+    annotated = image_bgr if inplace else image_bgr.copy()
 
-    for block in layout:
-        x1 = int(block.block.x_1)
-        y1 = int(block.block.y_1)
-        x2 = int(block.block.x_2)
-        y2 = int(block.block.y_2)
-        label = get_label_name(block.type)
-        score = block.score if hasattr(block, 'score') else None
+    for (x1, y1, x2, y2), label, score in _layout_rows(layout):
         color = _color_from_label(label)
 
         cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
@@ -32,31 +52,32 @@ def draw_comparison(
     preds: Iterable,
     gts: Iterable,
     eval_result: dict,
+    inplace: bool = False,
 ):
     """
-    Draws ground truth and predictions on the same image.
+    Draws ground truth and predictions on the same image (a copy unless inplace=True).
+    preds/gts: Detections or [{bbox, label, score?}], indexed as in eval_result.
     - Matched predictions: green boxes
     - Unmatched predictions (FP): red boxes
     - Unmatched ground truths (FN): yellow boxes
     - All ground truths also outlined in blue for reference
     """
-    annotated = image_bgr.copy()
+    annotated = image_bgr if inplace else image_bgr.copy()
+
+    pred_boxes, pred_labels, pred_scores = _columns(preds, "Pred")
+    gt_boxes, gt_labels, _ = _columns(gts, "GT")
 
     # Always draw GT in blue
     blue = (255, 0, 0)
-    for gt in gts:
-        x1, y1, x2, y2 = [int(v) for v in gt["bbox"]]
-        label = str(gt.get("label", "GT"))
+    for (x1, y1, x2, y2), label in zip(gt_boxes, gt_labels):
         cv2.rectangle(annotated, (x1, y1), (x2, y2), blue, 2)
         _draw_label(annotated, (x1, y1), f"GT {label}", blue)
 
     # Draw matched predictions in green
     green = (0, 255, 0)
     for p_idx, g_idx, iou in eval_result.get("matches", []):
-        p = preds[p_idx]
-        x1, y1, x2, y2 = [int(v) for v in p["bbox"]]
-        label = str(p.get("label", "Pred"))
-        score = p.get("score")
+        x1, y1, x2, y2 = pred_boxes[p_idx]
+        label, score = pred_labels[p_idx], pred_scores[p_idx]
         caption = f"{label}" + (f" {score:.2f}" if isinstance(score, (float, int)) else "") + f" IoU {iou:.2f}"
         cv2.rectangle(annotated, (x1, y1), (x2, y2), green, 2)
         _draw_label(annotated, (x1, y1), caption, green)
@@ -64,10 +85,8 @@ def draw_comparison(
     # Draw unmatched predictions (FP) in red
     red = (0, 0, 255)
     for p_idx in eval_result.get("unmatched_predictions", []):
-        p = preds[p_idx]
-        x1, y1, x2, y2 = [int(v) for v in p["bbox"]]
-        label = str(p.get("label", "Pred"))
-        score = p.get("score")
+        x1, y1, x2, y2 = pred_boxes[p_idx]
+        label, score = pred_labels[p_idx], pred_scores[p_idx]
         caption = f"FP {label}" + (f" {score:.2f}" if isinstance(score, (float, int)) else "")
         cv2.rectangle(annotated, (x1, y1), (x2, y2), red, 2)
         _draw_label(annotated, (x1, y1), caption, red)
@@ -75,9 +94,8 @@ def draw_comparison(
     # Draw unmatched ground truths (FN) highlighted in yellow overlay
     yellow = (0, 255, 255)
     for g_idx in eval_result.get("unmatched_ground_truth", []):
-        g = gts[g_idx]
-        x1, y1, x2, y2 = [int(v) for v in g["bbox"]]
-        label = str(g.get("label", "GT"))
+        x1, y1, x2, y2 = gt_boxes[g_idx]
+        label = gt_labels[g_idx]
         cv2.rectangle(annotated, (x1, y1), (x2, y2), yellow, 2)
         _draw_label(annotated, (x1, y1), f"FN {label}", yellow)
 
@@ -100,14 +118,14 @@ def _draw_label(img, topleft, text, color):
     cv2.putText(img, text, (x + pad, max(0, y - pad)), font, scale, (255, 255, 255), thickness, cv2.LINE_AA)
 
 
+@lru_cache(maxsize=256)
 def _color_from_label(label: str):
-    # Generate a deterministic color from label text
-    h = abs(hash(label)) % 360
+    # Generate a deterministic color from label text (crc32: stable across processes, unlike hash())
+    h = zlib.crc32(label.encode("utf-8")) % 360
     return _hsv_to_bgr(h, 200, 255)
 
 
 def _hsv_to_bgr(h, s, v):
-    import colorsys
     r, g, b = colorsys.hsv_to_rgb(h/360.0, s/255.0, v/255.0)
     return (int(b*255), int(g*255), int(r*255))
 
@@ -132,10 +150,7 @@ def _draw_footer(img, text: str):
         return img
     h, w = img.shape[:2]
     footer_h = 26
-    bg = img.copy()
-    import numpy as _np
-    footer = _np.zeros((footer_h, w, 3), dtype=img.dtype)
-    footer[:] = (32, 32, 32)
-    combined = _np.vstack([img, footer])
+    # One allocation for image + footer strip
+    combined = cv2.copyMakeBorder(img, 0, footer_h, 0, 0, cv2.BORDER_CONSTANT, value=(32, 32, 32))
     cv2.putText(combined, text, (6, h + 18), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (240, 240, 240), 1, cv2.LINE_AA)
     return combined
@@ -1,5 +1,13 @@
 import json
-from typing import List, Dict, Tuple, Optional
+from collections import Counter
+from typing import List, Dict, NamedTuple, Tuple, Optional, Union
+
+import numpy as np
+
+from .detections import Detections
+
+# Predictions/ground truth: a list in the evaluation format or array-backed Detections
+Boxes = Union[List[Dict], Detections]
 
 
 def xywh_to_xyxy(bbox: List[float]) -> List[float]:
@@ -28,9 +36,110 @@ def bbox_iou(a: List[float], b: List[float]) -> float:
     return inter_area / union
 
 
+def boxes_to_array(items: Boxes) -> np.ndarray:
+    """Stacks the `bbox` fields of preds/gts into an (N, 4) float64 array."""
+    if isinstance(items, Detections):
+        return items.boxes.astype(np.float64)
+    if not items:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.asarray([item["bbox"] for item in items], dtype=np.float64).reshape(-1, 4)
+
+
+def _label_strings(items: Boxes) -> List[str]:
+    if isinstance(items, Detections):
+        return items.label_names()
+    return [str(item.get("label")) for item in items]
+
+
+def _by_score(preds: Boxes) -> Tuple[Boxes, List[float]]:
+    """Predictions sorted by descending score (stable) and their scores."""
+    if isinstance(preds, Detections):
+        preds_sorted = preds[preds.score_order()]
+        if preds_sorted.scores is None:
+            return preds_sorted, [0.0] * len(preds_sorted)
+        return preds_sorted, preds_sorted.scores.astype(np.float64).tolist()
+    preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    return preds_sorted, [float(p.get("score", 0.0)) for p in preds_sorted]
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU between (N, 4) and (M, 4) xyxy boxes, returned as (N, M).
+    Uses the same arithmetic as bbox_iou, so entries are bit-identical to it.
+    """
+    ax1, ay1, ax2, ay2 = (a[:, i:i + 1] for i in range(4))
+    bx1, by1, bx2, by2 = (b[:, i] for i in range(4))
+    # Work in place on two (N, M) buffers; dense pages make the temporaries dominate
+    tmp = np.empty((a.shape[0], b.shape[0]), dtype=np.float64)
+
+    inter = np.minimum(ax2, bx2)
+    inter -= np.maximum(ax1, bx1, out=tmp)
+    np.maximum(inter, 0.0, out=inter)
+    inter_h = np.minimum(ay2, by2, out=tmp)
+    inter_h -= np.maximum(ay1, by1)
+    np.maximum(inter_h, 0.0, out=inter_h)
+    inter *= inter_h
+
+    area_a = np.maximum(0.0, ax2 - ax1) * np.maximum(0.0, ay2 - ay1)
+    area_b = np.maximum(0.0, bx2 - bx1) * np.maximum(0.0, by2 - by1)
+    union = np.add(area_a, area_b, out=tmp)
+    union -= inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def label_iou_matrix(
+    pred_boxes: np.ndarray,
+    gt_boxes: np.ndarray,
+    preds: Boxes,
+    gts: Boxes,
+) -> np.ndarray:
+    """
+    (P, G) IoU matrix where pairs with different labels (compared as strings) are -1.
+    IoUs are only computed within each label's block.
+    """
+    ious = np.full((len(preds), len(gts)), -1.0, dtype=np.float64)
+    if ious.size == 0:
+        return ious
+    ids: Dict[str, int] = {}
+    p_ids = np.asarray([ids.setdefault(label, len(ids)) for label in _label_strings(preds)], dtype=np.int64)
+    g_ids = np.asarray([ids.setdefault(label, len(ids)) for label in _label_strings(gts)], dtype=np.int64)
+    for label_id in np.intersect1d(p_ids, g_ids):
+        p_idx = np.flatnonzero(p_ids == label_id)
+        g_idx = np.flatnonzero(g_ids == label_id)
+        ious[np.ix_(p_idx, g_idx)] = iou_matrix(pred_boxes[p_idx], gt_boxes[g_idx])
+    return ious
+
+
+def match_iou_matrix(
+    ious: np.ndarray,
+    iou_threshold: float = 0.5,
+) -> List[Tuple[int, int, float]]:
+    """
+    Greedy matching on a precomputed (P, G) IoU matrix, rows in priority order.
+    Each pred takes the unused gt with the highest IoU (first one on ties) provided
+    it is >= iou_threshold and > 0. Pairs that may not match should be set to -1.
+    """
+    ious = np.asarray(ious, dtype=np.float64)
+    matches: List[Tuple[int, int, float]] = []
+    if ious.size == 0:
+        return matches
+    used = np.zeros(ious.shape[1], dtype=bool)
+    for p_idx in range(ious.shape[0]):
+        row = ious[p_idx]
+        if matches:
+            # Used gts can no longer be picked by later preds
+            row = np.where(used, -1.0, row)
+        g_idx = int(np.argmax(row))
+        best = row[g_idx]
+        if best >= iou_threshold and best > 0.0:
+            matches.append((p_idx, g_idx, float(best)))
+            used[g_idx] = True
+    return matches
+
+
 def greedy_match(
-    preds: List[Dict],
-    gts: List[Dict],
+    preds: Boxes,
+    gts: Boxes,
     iou_threshold: float = 0.5,
     require_label_match: bool = True,
 ) -> Tuple[List[Tuple[int, int, float]], List[int], List[int]]:
@@ -38,25 +147,15 @@ def greedy_match(
     Returns (matches, unmatched_pred_idxs, unmatched_gt_idxs)
     matches: list of (pred_idx, gt_idx, iou)
     """
-    used_gts = set()
-    matches: List[Tuple[int, int, float]] = []
-
-    # Precompute IoUs
-    for p_idx, p in enumerate(preds):
-        best_iou = 0.0
-        best_gt_idx: Optional[int] = None
-        for g_idx, g in enumerate(gts):
-            if g_idx in used_gts:
-                continue
-            if require_label_match and (str(p.get("label")) != str(g.get("label"))):
-                continue
-            iou = bbox_iou(p["bbox"], g["bbox"])
-            if iou >= iou_threshold and iou > best_iou:
-                best_iou = iou
-                best_gt_idx = g_idx
-        if best_gt_idx is not None:
-            used_gts.add(best_gt_idx)
-            matches.append((p_idx, best_gt_idx, best_iou))
+    # Precompute IoUs for all pairs at once; with label matching only same-label
+    # blocks are computed and every other pair is marked unmatchable (-1)
+    pred_boxes = boxes_to_array(preds)
+    gt_boxes = boxes_to_array(gts)
+    if require_label_match:
+        ious = label_iou_matrix(pred_boxes, gt_boxes, preds, gts)
+    else:
+        ious = iou_matrix(pred_boxes, gt_boxes)
+    matches = match_iou_matrix(ious, iou_threshold=iou_threshold)
 
     matched_pred_idxs = {m[0] for m in matches}
     matched_gt_idxs = {m[1] for m in matches}
@@ -74,19 +173,62 @@ def precision_recall_f1(tp: int, fp: int, fn: int) -> Dict[str, float]:
     return {"precision": precision, "recall": recall, "f1": f1}
 
 
+def precision_recall_curve(
+    scores_sorted: List[float],
+    tp_idxs: List[int],
+    num_gts: int,
+    from_zero_recall: bool = False,
+) -> Tuple[List[Tuple[float, float]], float]:
+    """
+    Builds the PR curve and interpolated AP from ranked detections in one pass.
+    scores_sorted: detection scores in descending order
+    tp_idxs: ranks (indices into scores_sorted) of detections that are true positives
+    num_gts: number of ground truth boxes
+    from_zero_recall: also count the area from recall 0 to the first curve point
+        (VOC/COCO convention); the per-image /evaluate/ AP starts at the first point
+    Returns (pr_points sorted by recall, ap). One point per distinct score threshold.
+    """
+    n = len(scores_sorted)
+    if n == 0:
+        return [], 0.0
+    is_tp = np.zeros(n, dtype=np.int64)
+    is_tp[np.asarray(tp_idxs, dtype=np.int64)] = 1
+    tp_cum = np.cumsum(is_tp)
+
+    # Last rank of each distinct score = the prefix kept by threshold "score >= thr"
+    scores = np.asarray(scores_sorted, dtype=np.float64)
+    ends = np.flatnonzero(np.append(scores[1:] != scores[:-1], True))
+    tp_thr = tp_cum[ends]
+    kept = ends + 1
+    curve_precisions = (tp_thr / kept).tolist()
+    curve_recalls = (tp_thr / num_gts).tolist() if num_gts > 0 else [0.0] * len(ends)
+
+    # Interpolated AP (area under precision envelope)
+    # Sort by recall ascending
+    paired = sorted(zip(curve_recalls, curve_precisions))
+    recalls_sorted = [r for r, _ in paired]
+    # Make precision envelope monotonic
+    precisions_sorted = np.maximum.accumulate(np.asarray([p for _, p in paired])[::-1])[::-1].tolist()
+    ap = recalls_sorted[0] * precisions_sorted[0] if from_zero_recall else 0.0
+    for i in range(1, len(recalls_sorted)):
+        dr = max(0.0, recalls_sorted[i] - recalls_sorted[i - 1])
+        ap += precisions_sorted[i] * dr
+    return list(zip(recalls_sorted, precisions_sorted)), ap
+
+
 def evaluate_detections(
-    preds: List[Dict],
-    gts: List[Dict],
+    preds: Boxes,
+    gts: Boxes,
     iou_threshold: float = 0.5,
     require_label_match: bool = True,
 ) -> Dict:
     """
-    preds: [{bbox:[x1,y1,x2,y2], label:str, score:float}]
-    gts:   [{bbox:[x1,y1,x2,y2], label:str}]
+    preds: [{bbox:[x1,y1,x2,y2], label:str, score:float}] or Detections
+    gts:   [{bbox:[x1,y1,x2,y2], label:str}] or Detections
     returns metrics and matching info
     """
     # Sort predictions by score descending for AP computation
-    preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    preds_sorted, scores_sorted = _by_score(preds)
 
     # One-threshold matching for P/R/F1 and mean IoU
     matches, unmatched_p, unmatched_g = greedy_match(
@@ -98,39 +240,16 @@ def evaluate_detections(
     prf = precision_recall_f1(tp, fp, fn)
     mean_iou = sum(m[2] for m in matches) / tp if tp > 0 else 0.0
 
-    # Simple AP@IoU via PR curve over score thresholds
-    pr_points: List[Tuple[float, float]] = []
-    if len(preds_sorted) > 0:
-        thresholds = sorted({float(p.get("score", 0.0)) for p in preds_sorted}, reverse=True)
-        last_p = last_r = 0.0
-        curve_precisions: List[float] = []
-        curve_recalls: List[float] = []
-        for thr in thresholds:
-            preds_thr = [p for p in preds_sorted if float(p.get("score", 0.0)) >= thr]
-            m_thr, up_thr, ug_thr = greedy_match(
-                preds_thr, gts, iou_threshold=iou_threshold, require_label_match=require_label_match
-            )
-            tp_thr = len(m_thr)
-            fp_thr = len(up_thr)
-            fn_thr = len(ug_thr)
-            pr = precision_recall_f1(tp_thr, fp_thr, fn_thr)
-            curve_precisions.append(pr["precision"]) 
-            curve_recalls.append(pr["recall"]) 
-        # Interpolated AP (area under precision envelope)
-        # Sort by recall ascending
-        paired = sorted(zip(curve_recalls, curve_precisions))
-        recalls_sorted = [r for r, _ in paired]
-        precisions_sorted = [p for _, p in paired]
-        # Make precision envelope monotonic
-        for i in range(len(precisions_sorted) - 2, -1, -1):
-            precisions_sorted[i] = max(precisions_sorted[i], precisions_sorted[i + 1])
-        ap = 0.0
-        for i in range(1, len(recalls_sorted)):
-            dr = max(0.0, recalls_sorted[i] - recalls_sorted[i - 1])
-            ap += precisions_sorted[i] * dr
-        pr_points = list(zip(recalls_sorted, precisions_sorted))
-    else:
-        ap = 0.0
+    # AP@IoU via PR curve over score thresholds, from a single ranked pass.
+    # preds_sorted is in descending score order and greedy matching never revisits
+    # earlier preds, so the matches among preds with score >= thr are exactly the
+    # matches of that prefix in the full matching above: TP/FP at every threshold
+    # are cumulative sums over the ranked TP flags.
+    pr_points, ap = precision_recall_curve(
+        scores_sorted,
+        [m[0] for m in matches],
+        len(gts),
+    )
 
     return {
         "tp": tp,
@@ -148,6 +267,231 @@ def evaluate_detections(
     }
 
 
+# IoU thresholds of COCO mAP@[.5:.95]
+COCO_IOU_THRESHOLDS = [round(0.5 + 0.05 * i, 2) for i in range(10)]
+# Recall points COCO samples the precision envelope at (pycocotools' recThrs)
+COCO_RECALL_POINTS = np.linspace(0.0, 1.0, 101)
+
+
+def interpolated_ap(tp_flags, num_gts: int, recall_points: np.ndarray = COCO_RECALL_POINTS) -> float:
+    """
+    COCO's 101-point interpolated AP: the precision envelope (best precision at this or a
+    higher recall) sampled at `recall_points` and averaged, as in pycocotools' COCOeval.
+    tp_flags: TP flag of each detection in ranked (descending score) order; every detection
+    is a point of the curve. Recall points above the highest recall reached count as 0.
+    """
+    flags = np.asarray(tp_flags, dtype=bool)
+    if num_gts <= 0 or flags.size == 0:
+        return 0.0
+    tp = np.cumsum(flags)
+    recall = tp / num_gts
+    precision = np.maximum.accumulate((tp / np.arange(1, flags.size + 1))[::-1])[::-1]
+    idx = np.searchsorted(recall, recall_points, side="left")
+    sampled = np.zeros(len(recall_points))
+    reached = idx < flags.size
+    sampled[reached] = precision[idx[reached]]
+    return float(sampled.mean())
+
+
+class ImageOutcome(NamedTuple):
+    """
+    What DetectionAccumulator keeps of one evaluated image: per detection (in descending
+    score order) its score, label and TP flag per IoU threshold, plus the image's counts.
+    """
+    scores: np.ndarray  # (P,) float64
+    labels: List[str]
+    flags: np.ndarray  # (P, T) bool, T = DetectionAccumulator.flag_thresholds
+    gt_counts: Dict[str, int]
+    tp: int
+    fp: int
+    fn: int
+    iou_sum: float
+
+
+class DetectionAccumulator:
+    """
+    Dataset-level evaluation built up one image at a time.
+    For every detection it keeps only (score, label, TP flag per IoU threshold); images
+    and boxes are not retained. summary() pools detections of each class across images
+    and computes AP per class and IoU threshold from one ranked pass, plus
+    TP/FP/FN, precision/recall/F1 and mean IoU at `iou_threshold`.
+    Labels must match for a detection to count as a TP.
+    AP is COCO's 101-point interpolated AP (interpolated_ap). Unlike pycocotools, matching is
+    this module's greedy matching, without crowd regions, area ranges or the 100 detections
+    per image cap, so numbers can still differ slightly from COCOeval's.
+    match() and add_outcome() split add() so the per-image outcome can be stored
+    elsewhere (e.g. an evaluation session shared by several processes) and replayed.
+    """
+
+    def __init__(
+        self,
+        iou_thresholds: List[float] = COCO_IOU_THRESHOLDS,
+        iou_threshold: float = 0.5,
+    ):
+        self.iou_thresholds = list(iou_thresholds)
+        self.iou_threshold = iou_threshold
+        # TP flags are kept for the AP thresholds and, for the PR curves, `iou_threshold`
+        self.flag_thresholds = self.iou_thresholds + (
+            [] if iou_threshold in self.iou_thresholds else [iou_threshold]
+        )
+        self._scores: List[np.ndarray] = []
+        self._labels: List[str] = []
+        self._flags: List[np.ndarray] = []
+        self.gt_counts: Counter = Counter()
+        self.images = 0
+        self.tp = 0
+        self.fp = 0
+        self.fn = 0
+        self.iou_sum = 0.0
+
+    def match(self, preds: Boxes, gts: Boxes) -> ImageOutcome:
+        """Matches one image's predictions against its ground truth (the accumulator is not changed)."""
+        preds_sorted, scores_sorted = _by_score(preds)
+        ious = label_iou_matrix(boxes_to_array(preds_sorted), boxes_to_array(gts), preds_sorted, gts)
+
+        matches = match_iou_matrix(ious, iou_threshold=self.iou_threshold)
+        flags = np.zeros((len(preds_sorted), len(self.flag_thresholds)), dtype=bool)
+        for t, thr in enumerate(self.flag_thresholds):
+            for p_idx, _, _ in (matches if thr == self.iou_threshold else match_iou_matrix(ious, iou_threshold=thr)):
+                flags[p_idx, t] = True
+
+        return ImageOutcome(
+            scores=np.asarray(scores_sorted, dtype=np.float64),
+            labels=_label_strings(preds_sorted),
+            flags=flags,
+            gt_counts=dict(Counter(_label_strings(gts))),
+            tp=len(matches),
+            fp=len(preds_sorted) - len(matches),
+            fn=len(gts) - len(matches),
+            iou_sum=float(sum(m[2] for m in matches)),
+        )
+
+    def add_outcome(self, outcome: ImageOutcome):
+        """Records the outcome of one image (from match() of an accumulator with the same thresholds)."""
+        self.tp += outcome.tp
+        self.fp += outcome.fp
+        self.fn += outcome.fn
+        self.iou_sum += outcome.iou_sum
+        self._scores.append(outcome.scores)
+        self._labels.extend(outcome.labels)
+        self._flags.append(outcome.flags)
+        self.gt_counts.update(outcome.gt_counts)
+        self.images += 1
+
+    def add(self, preds: Boxes, gts: Boxes) -> ImageOutcome:
+        """Matches one image's predictions against its ground truth and records the outcome."""
+        outcome = self.match(preds, gts)
+        self.add_outcome(outcome)
+        return outcome
+
+    def summary(self, pr_curves: bool = False) -> Dict:
+        """
+        Dataset metrics so far; with pr_curves, every class with ground truth also gets
+        its PR curve at `iou_threshold` as [[recall, precision], ...] (one point per distinct score).
+        """
+        scores = np.concatenate(self._scores) if self._scores else np.zeros(0)
+        flags = np.concatenate(self._flags) if self._flags else np.zeros((0, len(self.flag_thresholds)), dtype=bool)
+        labels = np.asarray(self._labels, dtype=object)
+        pr_column = self.flag_thresholds.index(self.iou_threshold)
+
+        per_class: Dict[str, Dict] = {}
+        for label in sorted(set(self.gt_counts) | set(self._labels)):
+            sel = np.flatnonzero(labels == label)
+            num_gts = self.gt_counts.get(label, 0)
+            entry = {"ground_truth": num_gts, "detections": int(sel.size)}
+            if num_gts > 0:
+                # Stable sort keeps image order among equal scores
+                order = sel[np.argsort(-scores[sel], kind="stable")]
+                aps = [interpolated_ap(flags[order, t], num_gts) for t in range(len(self.iou_thresholds))]
+                entry["ap"] = float(np.mean(aps))
+                entry["ap_per_iou"] = {f"{thr:.2f}": ap for thr, ap in zip(self.iou_thresholds, aps)}
+                if pr_curves:
+                    points, _ = precision_recall_curve(
+                        scores[order].tolist(), np.flatnonzero(flags[order, pr_column]).tolist(), num_gts, from_zero_recall=True
+                    )
+                    entry["pr_curve"] = [[r, p] for r, p in points]
+            else:
+                # No ground truth: AP is undefined and the class is left out of mAP
+                entry["ap"] = None
+            per_class[label] = entry
+
+        evaluated = [c for c in per_class.values() if c["ap"] is not None]
+        prf = precision_recall_f1(self.tp, self.fp, self.fn)
+        return {
+            "images": self.images,
+            "detections": int(scores.size),
+            "ground_truth": sum(self.gt_counts.values()),
+            "map": float(np.mean([c["ap"] for c in evaluated])) if evaluated else 0.0,
+            "map_per_iou": {
+                f"{thr:.2f}": float(np.mean([c["ap_per_iou"][f"{thr:.2f}"] for c in evaluated])) if evaluated else 0.0
+                for thr in self.iou_thresholds
+            },
+            "per_class": per_class,
+            "iou_threshold": self.iou_threshold,
+            "tp": self.tp,
+            "fp": self.fp,
+            "fn": self.fn,
+            "precision": prf["precision"],
+            "recall": prf["recall"],
+            "f1": prf["f1"],
+            "mean_iou": self.iou_sum / self.tp if self.tp > 0 else 0.0,
+        }
+
+
+def index_coco_annotations(coco_bytes: bytes) -> Dict[str, List[Dict]]:
+    """
+    Parses a COCO JSON once and groups ground truth boxes by image file_name.
+    Every listed image gets an entry (possibly empty); boxes use the same
+    [{bbox:[x1,y1,x2,y2], label:str}] format as parse_coco_annotations.
+    """
+    data = json.loads(coco_bytes.decode("utf-8"))
+    cat_map = {int(c["id"]): c.get("name", str(c["id"])) for c in data.get("categories", []) if "id" in c}
+
+    by_id: Dict[int, List[Dict]] = {}
+    for ann in data.get("annotations") or []:
+        if not isinstance(ann, dict):
+            continue
+        bbox = ann.get("bbox")
+        if not bbox or len(bbox) != 4:
+            continue
+        cat_id = ann.get("category_id")
+        label = cat_map.get(int(cat_id), str(cat_id)) if cat_id is not None else str(ann.get("category", "unknown"))
+        by_id.setdefault(int(ann.get("image_id", -1)), []).append(
+            {"bbox": xywh_to_xyxy([float(b) for b in bbox]), "label": str(label)}
+        )
+
+    index: Dict[str, List[Dict]] = {}
+    for img in data.get("images") or []:
+        if "id" in img and "file_name" in img:
+            index[str(img["file_name"])] = by_id.get(int(img["id"]), [])
+    return index
+
+
+def index_coco_results(results_bytes: bytes, coco_bytes: bytes) -> Dict[str, List[Dict]]:
+    """
+    Groups COCO detection results ([{image_id, category_id, bbox: [x, y, w, h], score}])
+    by image file_name, with image ids and category names taken from the COCO annotations
+    file. Boxes use the [{bbox:[x1,y1,x2,y2], label:str, score:float}] evaluation format.
+    """
+    data = json.loads(coco_bytes.decode("utf-8"))
+    cat_map = {int(c["id"]): c.get("name", str(c["id"])) for c in data.get("categories", []) if "id" in c}
+    names = {int(img["id"]): str(img["file_name"]) for img in data.get("images") or [] if "id" in img and "file_name" in img}
+
+    index: Dict[str, List[Dict]] = {name: [] for name in names.values()}
+    for det in json.loads(results_bytes.decode("utf-8")):
+        name = names.get(int(det.get("image_id", -1)))
+        bbox = det.get("bbox")
+        if name is None or not bbox or len(bbox) != 4:
+            continue
+        cat_id = det.get("category_id")
+        index[name].append({
+            "bbox": xywh_to_xyxy([float(b) for b in bbox]),
+            "label": str(cat_map.get(int(cat_id), cat_id)),
+            "score": float(det.get("score", 0.0)),
+        })
+    return index
+
+
 def parse_coco_annotations(
     coco_bytes: bytes,
     image_filename: Optional[str] = None,
@@ -0,0 +1,222 @@
+"""
+Upload ingestion: pooled read buffers and size-aware image decoding.
+
+- BufferPool/read_upload: an upload is read chunk-wise into a reused bytearray
+  instead of a fresh bytes object per request; uploads over max_bytes are refused unread
+- image_size: page size from the PNG/JPEG/WebP/BMP header, so oversized pages
+  (max_pixels) are refused before anything is decoded
+- decode_image: JPEGs much larger than the model input are decoded directly at
+  1/2, 1/4 or 1/8 scale by libjpeg (IMREAD_REDUCED_*), which is faster and
+  needs a fraction of the memory; the returned scale maps boxes back
+- encode_image: annotated output as PNG/JPEG/WebP, optionally downscaled to a thumbnail,
+  returned as a view of OpenCV's output buffer (no copy into a bytes object)
+"""
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+READ_CHUNK = 1 << 20
+
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# format -> (file extension for cv2.imencode, media type)
+OUTPUT_FORMATS = {"png": (".png", "image/png"), "jpeg": (".jpg", "image/jpeg"), "webp": (".webp", "image/webp")}
+
+# Start-of-frame markers carrying the image size (all SOFn except DHT/JPG/DAC)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class UploadTooLargeError(ValueError):
+    """An uploaded file is larger than the allowed number of bytes."""
+
+    def __init__(self, size: int, max_bytes: int):
+        super().__init__(f"Upload of {size} bytes exceeds the limit of {max_bytes} bytes.")
+
+
+class ImageTooLargeError(ValueError):
+    """A page has more pixels than allowed."""
+
+    def __init__(self, height: int, width: int, max_pixels: int):
+        super().__init__(f"Image of {width}x{height} pixels exceeds the limit of {max_pixels} pixels.")
+
+
+class BufferPool:
+    """Keeps up to `max_buffers` bytearrays of at most `max_keep_bytes` for reuse."""
+
+    def __init__(self, max_buffers: int = 8, max_keep_bytes: int = 64 << 20):
+        self.max_buffers = max_buffers
+        self.max_keep_bytes = max_keep_bytes
+        self._free: List[bytearray] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size: int) -> bytearray:
+        with self._lock:
+            for i, buf in enumerate(self._free):
+                if len(buf) >= size:
+                    return self._free.pop(i)
+        # Round up so slightly larger uploads can reuse the buffer later
+        return bytearray(max(READ_CHUNK, -(-size // READ_CHUNK) * READ_CHUNK))
+
+    def release(self, buf: bytearray):
+        if len(buf) > self.max_keep_bytes:
+            return
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
+
+
+def read_upload(fileobj, pool: BufferPool, max_bytes: int = 0) -> Tuple[bytearray, memoryview]:
+    """
+    Reads a seekable file (UploadFile.file) into a pooled buffer.
+    Returns (buffer, view of the bytes read); give the buffer back with pool.release
+    once the view (and anything made from it) is no longer used.
+    Raises UploadTooLargeError without reading when the file has more than max_bytes (if set).
+    """
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    if max_bytes and size > max_bytes:
+        raise UploadTooLargeError(size, max_bytes)
+    buf = pool.acquire(size)
+    view = memoryview(buf)
+    read = 0
+    while read < size:
+        chunk = fileobj.read(min(READ_CHUNK, size - read))
+        if not chunk:
+            break
+        view[read:read + len(chunk)] = chunk
+        read += len(chunk)
+    return buf, view[:read]
+
+
+def jpeg_size(data) -> Optional[Tuple[int, int]]:
+    """(height, width) from the JPEG frame header, without decoding; None if not a JPEG."""
+    mv = memoryview(data)
+    n = len(mv)
+    if n < 4 or mv[0] != 0xFF or mv[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < n:
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            return (mv[i + 5] << 8) | mv[i + 6], (mv[i + 7] << 8) | mv[i + 8]
+        i += 2 + ((mv[i + 2] << 8) | mv[i + 3])
+    return None
+
+
+def image_size(data) -> Optional[Tuple[int, int]]:
+    """(height, width) from a PNG, JPEG, WebP or BMP header, without decoding; None for other data."""
+    mv = memoryview(data)
+    head = bytes(mv[:30])
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and len(head) >= 24:
+        width, height = struct.unpack(">II", head[16:24])
+        return height, width
+    if head.startswith(b"\xff\xd8"):
+        return jpeg_size(mv)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8X":
+            return 1 + int.from_bytes(head[27:30], "little"), 1 + int.from_bytes(head[24:27], "little")
+        if chunk == b"VP8L":
+            bits = int.from_bytes(head[21:25], "little")
+            return 1 + ((bits >> 14) & 0x3FFF), 1 + (bits & 0x3FFF)
+        if chunk == b"VP8 ":
+            return struct.unpack("<H", head[28:30])[0] & 0x3FFF, struct.unpack("<H", head[26:28])[0] & 0x3FFF
+    if head.startswith(b"BM") and len(head) >= 26:
+        width, height = struct.unpack("<ii", head[18:26])
+        return abs(height), abs(width)
+    return None
+
+
+def reduction_factor(height: int, width: int, min_size: int, max_size: int) -> int:
+    """
+    Largest JPEG scale denominator (1, 2, 4, 8) at which the page is still at least as
+    large as the model input (ResizeShortestEdge to min_size, long side capped at max_size).
+    """
+    if min(height, width) <= 0:
+        return 1
+    model_scale = min(min_size / min(height, width), max_size / max(height, width))
+    for factor in (8, 4, 2):
+        if factor * model_scale <= 1.0:
+            return factor
+    return 1
+
+
+def decoded_size(data, min_size: int = 0, max_size: int = 0) -> Optional[Tuple[int, int]]:
+    """(height, width) decode_image will return for the same arguments, from the header; None if unknown."""
+    size = image_size(data)
+    if size is None:
+        return None
+    factor = reduction_factor(size[0], size[1], min_size, max_size) if min_size > 0 and jpeg_size(data) else 1
+    return -(-size[0] // factor), -(-size[1] // factor)
+
+
+def decode_image(data, min_size: int = 0, max_size: int = 0, max_pixels: int = 0):
+    """
+    Decodes encoded image bytes to BGR. With min_size/max_size (the model input size) set,
+    large JPEGs are decoded at reduced scale.
+    Returns (image, (scale_x, scale_y)) where scale maps image coordinates back to the
+    original resolution; image is None when the data cannot be decoded.
+    Raises ImageTooLargeError for pages over max_pixels (if set) at full resolution, from
+    the header when it can be read, otherwise after decoding.
+    """
+    arr = np.frombuffer(data, np.uint8)
+    header = image_size(data) if max_pixels else None
+    if header is not None and header[0] * header[1] > max_pixels:
+        raise ImageTooLargeError(header[0], header[1], max_pixels)
+    size = jpeg_size(data) if min_size > 0 else None
+    factor = reduction_factor(size[0], size[1], min_size, max_size) if size else 1
+    if factor == 1:
+        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        if img is not None and max_pixels and img.shape[0] * img.shape[1] > max_pixels:
+            raise ImageTooLargeError(img.shape[0], img.shape[1], max_pixels)
+        return img, (1.0, 1.0)
+    img = cv2.imdecode(arr, _REDUCED_FLAGS[factor])
+    if img is None:
+        return None, (1.0, 1.0)
+    height, width = size
+    if (img.shape[0] > img.shape[1]) != (height > width):
+        # EXIF orientation rotated the page by 90 degrees
+        height, width = width, height
+    return img, (width / img.shape[1], height / img.shape[0])
+
+
+def encode_image(
+    img,
+    fmt: str = "png",
+    quality: Optional[int] = None,
+    compression: Optional[int] = None,
+    max_size: Optional[int] = None,
+) -> memoryview:
+    """
+    Encodes a BGR image. quality (1-100) applies to jpeg/webp, compression (0-9) to png;
+    None keeps the OpenCV default. With max_size the longer side is first shrunk to it.
+    Returns a bytes-like view of the encoded data (Response bodies, base64 and b"".join take it).
+    """
+    height, width = img.shape[:2]
+    if max_size and max(height, width) > max_size:
+        ratio = max_size / max(height, width)
+        img = cv2.resize(img, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+    ext, _ = OUTPUT_FORMATS[fmt]
+    params = []
+    if fmt == "jpeg" and quality is not None:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp" and quality is not None:
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif fmt == "png" and compression is not None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}.")
+    return buf.reshape(-1).data
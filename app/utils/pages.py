@@ -0,0 +1,141 @@
+import math
+import os
+import tarfile
+import threading
+import zipfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from .images import ImageTooLargeError, UploadTooLargeError
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+TAR_CONTENT_TYPES = {"application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar"}
+PDF_CONTENT_TYPES = {"application/pdf", "application/x-pdf"}
+
+# pdfium is not thread-safe; all document access goes through this lock
+_pdfium_lock = threading.Lock()
+
+
+def is_pdf(filename: Optional[str], content_type: Optional[str]) -> bool:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return ctype in PDF_CONTENT_TYPES or (filename or "").lower().endswith(".pdf")
+
+
+def archive_kind(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """
+    Returns "zip" or "tar" when the upload looks like an archive, otherwise None.
+    """
+    name = (filename or "").lower()
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    if ctype in ZIP_CONTENT_TYPES or name.endswith(".zip"):
+        return "zip"
+    if ctype in TAR_CONTENT_TYPES or name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return "tar"
+    return None
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    if not base or base.startswith("."):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def list_images(images_dir: str, limit: Optional[int] = None) -> List[str]:
+    """Paths of the image files (IMAGE_EXTENSIONS, no hidden files) in images_dir sorted by name, at most `limit`."""
+    paths = sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir) if _is_image_name(name))
+    return paths[:limit] if limit is not None else paths
+
+
+def iter_archive_images(fileobj: BinaryIO, kind: str, max_bytes: int = 0) -> Iterator[Tuple[str, Union[bytes, UploadTooLargeError]]]:
+    """
+    Lazily yields (member_name, bytes) for every image in a zip or tar archive.
+    Only one member is held in memory at a time; non-image members are skipped.
+    Members over max_bytes (if set) are not extracted: an UploadTooLargeError is yielded instead.
+    """
+    if kind == "zip":
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                if max_bytes and info.file_size > max_bytes:
+                    yield info.filename, UploadTooLargeError(info.file_size, max_bytes)
+                    continue
+                yield info.filename, zf.read(info)
+    elif kind == "tar":
+        # Streaming mode ("r|*") reads members sequentially without seeking
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+            for member in tf:
+                if not member.isfile() or not _is_image_name(member.name):
+                    continue
+                if max_bytes and member.size > max_bytes:
+                    yield member.name, UploadTooLargeError(member.size, max_bytes)
+                    continue
+                extracted = tf.extractfile(member)
+                if extracted is None:
+                    continue
+                yield member.name, extracted.read()
+    else:
+        raise ValueError(f"Unsupported archive kind: {kind}")
+
+
+def open_pdf(fileobj: BinaryIO):
+    """
+    Opens a PDF without loading any page. Raises ValueError if it cannot be parsed.
+    """
+    import pypdfium2 as pdfium
+
+    with _pdfium_lock:
+        try:
+            return pdfium.PdfDocument(fileobj)
+        except pdfium.PdfiumError as exc:
+            raise ValueError(f"Could not open PDF: {exc}") from exc
+
+
+def iter_pdf_pages(pdf, dpi: int = 150, max_pixels: int = 0) -> Iterator[Tuple[int, Union[np.ndarray, ValueError]]]:
+    """
+    Lazily rasterizes an opened PDF, yielding (page_number, BGR image) one page at a time,
+    so only the page currently being handed out is held as a bitmap. Closes the document when done.
+    page_number is 1-based. Pages over max_pixels (if set) at this dpi are not rendered:
+    an ImageTooLargeError is yielded instead; a page pdfium fails to render yields a ValueError.
+    """
+    scale = dpi / 72.0
+    try:
+        for index in range(len(pdf)):
+            failed = None
+            with _pdfium_lock:
+                try:
+                    page = pdf[index]
+                    try:
+                        width, height = (math.ceil(v * scale) for v in page.get_size())
+                        too_large = max_pixels and width * height > max_pixels
+                        if not too_large:
+                            bitmap = page.render(scale=scale)
+                            try:
+                                # to_numpy() is a view into the pdfium buffer; copy before closing it
+                                image = np.array(bitmap.to_numpy(), copy=True)
+                            finally:
+                                bitmap.close()
+                    finally:
+                        page.close()
+                except Exception as exc:
+                    # A broken page fails alone; the rest of the document is still rendered
+                    failed = ValueError(f"Could not render PDF page {index + 1}: {str(exc) or type(exc).__name__}")
+            if failed is not None:
+                yield index + 1, failed
+                continue
+            if too_large:
+                yield index + 1, ImageTooLargeError(height, width, max_pixels)
+                continue
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            elif image.shape[2] == 4:
+                image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+            yield index + 1, image
+    finally:
+        with _pdfium_lock:
+            pdf.close()
@@ -0,0 +1,93 @@
+"""
+Benchmark of evaluate_detections on synthetic dense pages.
+
+Compares the time of the single-pass AP computation against the previous approach that
+re-filtered predictions and re-ran greedy_match at every distinct score threshold.
+That both give the same PR curve and AP is checked by tests/test_eval.py.
+
+Usage: python -m benchmarks.eval_bench [--sizes 50 500 5000] [--baseline-budget 20]
+"""
+import argparse
+import random
+import time
+from typing import Dict, List, Tuple
+
+from app.utils.eval import evaluate_detections, greedy_match, precision_recall_f1
+
+LABELS = ["Text", "Title", "List", "Table", "Figure"]
+
+
+def synthetic_page(num_preds: int, seed: int = 0) -> Tuple[List[Dict], List[Dict]]:
+    """Grid of cells (like a dense table) with jittered predictions, some spurious."""
+    rnd = random.Random(seed)
+    num_gts = max(1, int(num_preds * 0.8))
+    cols = max(1, int(num_gts ** 0.5))
+    gts = []
+    for i in range(num_gts):
+        x, y = (i % cols) * 60.0, (i // cols) * 30.0
+        gts.append({"bbox": [x, y, x + 55.0, y + 25.0], "label": rnd.choice(LABELS)})
+    preds = []
+    for i in range(num_preds):
+        if i < num_gts and rnd.random() < 0.85:
+            g = gts[i]
+            j = [v + rnd.uniform(-6, 6) for v in g["bbox"]]
+            label = g["label"] if rnd.random() < 0.9 else rnd.choice(LABELS)
+        else:
+            x, y = rnd.uniform(0, cols * 60.0), rnd.uniform(0, (num_gts // cols + 1) * 30.0)
+            j = [x, y, x + rnd.uniform(10, 60), y + rnd.uniform(5, 30)]
+            label = rnd.choice(LABELS)
+        preds.append({"bbox": j, "label": label, "score": rnd.random()})
+    return preds, gts
+
+
+def rematching_curve(preds, gts, iou_threshold, max_seconds=None):
+    """
+    Previous algorithm: greedy_match over the preds above each distinct score threshold.
+    Returns (recalls, precisions, thresholds_done, thresholds_total, seconds).
+    """
+    preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    thresholds = sorted({float(p.get("score", 0.0)) for p in preds_sorted}, reverse=True)
+    recalls, precisions = [], []
+    start = time.perf_counter()
+    for thr in thresholds:
+        preds_thr = [p for p in preds_sorted if float(p.get("score", 0.0)) >= thr]
+        m, up, ug = greedy_match(preds_thr, gts, iou_threshold=iou_threshold)
+        pr = precision_recall_f1(len(m), len(up), len(ug))
+        precisions.append(pr["precision"])
+        recalls.append(pr["recall"])
+        if max_seconds is not None and time.perf_counter() - start > max_seconds:
+            break
+    return recalls, precisions, len(recalls), len(thresholds), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--baseline-budget", type=float, default=20.0,
+        help="seconds per size for the re-matching baseline; beyond that its time is extrapolated",
+    )
+    args = parser.parse_args()
+
+    print(f"{'preds':>6} {'gts':>6} {'single-pass':>12} {'re-matching':>14} {'speedup':>9}")
+    for n in args.sizes:
+        preds, gts = synthetic_page(n, seed=n)
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            evaluate_detections(preds, gts, iou_threshold=args.iou)
+            best = min(best, time.perf_counter() - start)
+
+        _, _, done, total, seconds = rematching_curve(
+            preds, gts, args.iou, max_seconds=args.baseline_budget
+        )
+        baseline = seconds if done == total else seconds * total / done
+        note = "" if done == total else f" (extrapolated from {done}/{total} thresholds)"
+        print(f"{n:>6} {len(gts):>6} {best * 1000:>10.2f}ms {baseline * 1000:>12.1f}ms {baseline / best:>8.0f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Latency/throughput benchmark of the detection service.
+
+Two parts:
+- stages: per-stage timing of one /detect/ request done in-process by calling the
+  same functions the endpoints use (upload read, cv2.imdecode incl. the reduced JPEG
+  decode, predict, result serialization as JSON records, columnar JSON and msgpack,
+  draw_detections/draw_comparison, cv2.imencode)
+- load:   concurrent POST /detect/ requests, either in-process through the ASGI app
+  (no network) or over HTTP against a running server (--url) or one started here
+  (--start-server); p50/p95/p99 latency and pages/sec per concurrency level and size.
+  --model sends the requests to a registry model or to cascade/ensemble; the server's
+  per-model latency and cascade escalation rate (/stats/models) are added to the report
+
+Results are written as JSON (--output) so runs on different commits can be compared.
+
+Usage:
+  python -m benchmarks.service_bench [--sizes 850 1700 3400] [--concurrency 1 2 4 8]
+      [--requests 16] [--format json] [--model cascade] [--url http://localhost:8000 | --start-server]
+      [--skip-stages] [--output bench.json]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), "..", "app", "data", "example_data.png")
+SAMPLE_ANNOTATIONS = os.path.join(os.path.dirname(__file__), "..", "app", "data", "example_coco.json")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    arr = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def sample_png(width: int, variant: int = 0) -> bytes:
+    """
+    The bundled example page resized to `width` pixels, PNG-encoded.
+    Distinct variants differ in one pixel so they never hit the detection cache.
+    """
+    img = cv2.imread(SAMPLE_IMAGE, cv2.IMREAD_COLOR)
+    if img is None:
+        img = np.full((1100, 850, 3), 255, dtype=np.uint8)
+    height = int(round(img.shape[0] * width / img.shape[1]))
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC if width > img.shape[1] else cv2.INTER_AREA)
+    img[0, 0] = (variant % 256, (variant // 256) % 256, 0)
+    ok, buf = cv2.imencode(".png", img)
+    return buf.tobytes()
+
+
+async def _stage_once(png: bytes, timings: Dict[str, List[float]]):
+    from starlette.datastructures import UploadFile
+
+    from app.api.endpoints import _decode_image, _detections, _layout_to_detections
+    from app.core.model import predict
+    from app.utils.detections import packb
+    from app.utils.drawing import draw_comparison, draw_detections
+    from app.utils.eval import evaluate_detections, parse_coco_annotations
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    upload = UploadFile(io.BytesIO(png), filename="page.png")
+    start = time.perf_counter()
+    contents = await upload.read()
+    timings.setdefault("upload_read", []).append(time.perf_counter() - start)
+
+    img, _ = timed("imdecode", _decode_image, contents)
+    # Same page as JPEG: full decode vs reduced decode of the JSON-only path
+    ok, jpeg = cv2.imencode(".jpg", img)
+    timed("imdecode_jpeg", _decode_image, jpeg.tobytes())
+    timed("imdecode_jpeg_reduced", _decode_image, jpeg.tobytes(), True)
+    layout = timed("predict", predict, img)
+    timed("serialize", lambda: json.dumps({"detections": _layout_to_detections(layout)}))
+    preds = timed("to_detections", _detections, layout)
+    timed("serialize_columnar", lambda: json.dumps({"detections": preds.to_columns()}))
+    try:
+        timed("serialize_msgpack", lambda: packb({"detections": preds.to_binary_columns()}))
+    except RuntimeError:
+        pass
+    annotated = timed("draw_detections", draw_detections, img, preds)
+    timed("imencode_png", cv2.imencode, ".png", annotated)
+
+    with open(SAMPLE_ANNOTATIONS, "rb") as f:
+        gts = parse_coco_annotations(f.read())
+    result = timed("evaluate", evaluate_detections, preds, gts)
+    timed("draw_comparison", draw_comparison, img, preds, gts, result)
+
+
+def run_stages(sizes: List[int], repeat: int) -> Dict:
+    from app.core.model import get_model
+
+    start = time.perf_counter()
+    get_model()
+    report = {"model_load_s": time.perf_counter() - start, "sizes": {}}
+    for width in sizes:
+        png = sample_png(width)
+        timings: Dict[str, List[float]] = {}
+        asyncio.run(_stage_once(png, {}))  # warm-up
+        for _ in range(repeat):
+            asyncio.run(_stage_once(png, timings))
+        report["sizes"][str(width)] = {
+            "upload_bytes": len(png),
+            "stages": {stage: percentiles(samples) for stage, samples in timings.items()},
+        }
+    return report
+
+
+async def _load_level(client, pngs: List[bytes], fmt: str, concurrency: int, requests: int, model: Optional[str] = None) -> Dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    url = f"/detect/?format={fmt}" + (f"&model={model}" if model else "")
+    for i in range(requests):
+        queue.put_nowait(pngs[i % len(pngs)])
+
+    async def worker():
+        while True:
+            try:
+                png = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            r = await client.post(url, files={"file": ("page.png", png, "image/png")})
+            latencies.append(time.perf_counter() - start)
+            statuses[str(r.status_code)] = statuses.get(str(r.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ok = statuses.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "statuses": statuses,
+        "seconds": elapsed,
+        "pages_per_second": ok / elapsed if elapsed > 0 else 0.0,
+        **percentiles(latencies),
+    }
+
+
+async def _run_load(base_url: Optional[str], sizes, levels, requests, fmt, model: Optional[str] = None) -> Dict:
+    import httpx
+
+    if base_url is None:
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+    else:
+        client = httpx.AsyncClient(base_url=base_url, timeout=None)
+    report = {"target": base_url or "in-process", "format": fmt, "model": model, "sizes": {}}
+    async with client:
+        for width in sizes:
+            count = max([requests] + list(levels))
+            # Fresh variants per level so no request is served from the detection cache
+            pngs = [sample_png(width, variant=i) for i in range(count * (len(levels) + 1))]
+            await _load_level(client, pngs[:1], fmt, 1, 1, model)  # warm-up
+            report["sizes"][str(width)] = [
+                await _load_level(client, pngs[(i + 1) * count:(i + 2) * count], fmt, level, max(requests, level), model)
+                for i, level in enumerate(levels)
+            ]
+        r = await client.get("/stats/models")
+        if r.status_code == 200:
+            stats = r.json()
+            report["model_stats"] = {"models": stats["models"], "cascade": stats["cascade"]}
+    return report
+
+
+def _start_server(port: int) -> subprocess.Popen:
+    import httpx
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+    )
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not become healthy")
+
+
+def _meta() -> Dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    env = {k: v for k, v in os.environ.items() if k.startswith(("INFERENCE_", "BATCH_", "DETECTION_CACHE", "RENDER_CACHE", "SERVE_WORKERS", "TORCH_", "OMP_", "ADAPTIVE_", "MODEL", "DEFAULT_MODEL", "CASCADE_", "ENSEMBLE_"))}
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "env": env,
+    }
+
+
+def _print_report(report: Dict):
+    stages = report.get("stages")
+    if stages:
+        print(f"model load: {stages['model_load_s']:.2f}s")
+        for width, entry in stages["sizes"].items():
+            print(f"[stages] width {width} ({entry['upload_bytes'] / 1e6:.2f} MB upload)")
+            for stage, p in entry["stages"].items():
+                print(f"  {stage:<16} p50 {p['p50_ms']:>9.2f}ms  p95 {p['p95_ms']:>9.2f}ms  p99 {p['p99_ms']:>9.2f}ms")
+    load = report.get("load")
+    if load:
+        print(f"[load] target {load['target']} format={load['format']} model={load.get('model') or 'default'}")
+        for width, levels in load["sizes"].items():
+            for lvl in levels:
+                print(f"  width {width:>5} c={lvl['concurrency']:<3} {lvl['pages_per_second']:>7.2f} pages/s"
+                      f"  p50 {lvl['p50_ms']:>9.1f}ms  p95 {lvl['p95_ms']:>9.1f}ms  p99 {lvl['p99_ms']:>9.1f}ms"
+                      f"  {lvl['statuses']}")
+        model_stats = load.get("model_stats")
+        if model_stats:
+            for name, entry in model_stats["models"].items():
+                if entry["calls"]:
+                    print(f"  model {name:<12} {entry['calls']:>5} calls  mean {entry['mean_ms']:>9.1f}ms  p95 {entry['p95_ms']:>9.1f}ms")
+            if model_stats["cascade"] and model_stats["cascade"]["pages"]:
+                cascade = model_stats["cascade"]
+                print(f"  cascade: {cascade['escalated']}/{cascade['pages']} pages escalated ({100 * cascade['escalation_rate']:.0f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[850, 1700, 3400], help="page widths in pixels")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=16, help="requests per concurrency level")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions for the stage breakdown")
+    parser.add_argument("--format", default="json", choices=["json", "image", "both"])
+    parser.add_argument("--model", default=None, help="registry model, cascade or ensemble (default: the server's)")
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--start-server", action="store_true", help="start a local uvicorn and benchmark it")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"meta": _meta()}
+    if not args.skip_stages:
+        report["stages"] = run_stages(args.sizes, args.repeat)
+    if not args.skip_load:
+        server = _start_server(args.port) if args.start_server else None
+        url = f"http://127.0.0.1:{args.port}" if server is not None else args.url
+        try:
+            report["load"] = asyncio.run(_run_load(url, args.sizes, args.concurrency, args.requests, args.format, args.model))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Startup benchmark: import time and memory of the service's entry points, and server cold start.
+
+Two parts:
+- imports: each module is imported in --repeat fresh interpreters; reports the median import
+  time, the peak RSS of the process after the import, whether torch/layoutparser got
+  loaded, and the slowest imports below it (python -X importtime, cumulative)
+- server:  starts uvicorn app.main:app and measures the time until /health answers and
+  until /ready reports the model loaded and warmed up, with the server's RSS at both points
+  (Linux: /proc/<pid>/status)
+
+Results are written as JSON (--output) so runs on different commits can be compared.
+
+Usage:
+  python -m benchmarks.startup_bench [--modules app.utils.eval app.main ...] [--repeat 5]
+      [--skip-server] [--ready-timeout 600] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+DEFAULT_MODULES = [
+    "app.utils.eval",
+    "app.core.model",
+    "app.tools.evaluate_dataset",
+    "app.main",
+    # The deferred dependencies themselves, for scale (skipped when not installed)
+    "torch",
+    "layoutparser",
+]
+HEAVY = ("torch", "layoutparser", "detectron2", "pandas", "effdet", "pytesseract")
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is in KiB on Linux, bytes on macOS
+rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+loaded = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_mb, "heavy_loaded": loaded}}))
+"""
+
+
+def _probe(module: Optional[str], importtime: bool = False) -> Optional[Dict]:
+    """Imports `module` (None: nothing) in a fresh interpreter; None if the import fails."""
+    code = _PROBE.format(statement=f"import {module}" if module else "pass", heavy=HEAVY)
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if importtime:
+        result["slowest"] = _slowest_imports(proc.stderr, module)
+    return result
+
+
+def _slowest_imports(stderr: str, module: str, top: int = 10) -> List[Dict]:
+    """Top modules by cumulative import time from -X importtime output (nested ones included)."""
+    entries = []
+    for line in stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented name>"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        name = name.strip()
+        # The module itself and its parent packages cover everything
+        if module == name or module.startswith(name + "."):
+            continue
+        entries.append({"module": name, "cumulative_ms": int(cumulative_us) / 1000.0})
+    entries.sort(key=lambda e: e["cumulative_ms"], reverse=True)
+    return entries[:top]
+
+
+def run_imports(modules: List[str], repeat: int) -> Dict:
+    baseline = [_probe(None) for _ in range(repeat)]
+    report = {
+        "interpreter": {"rss_mb": statistics.median(b["rss_mb"] for b in baseline)},
+        "modules": {},
+    }
+    for module in modules:
+        runs = [_probe(module) for _ in range(repeat)]
+        if any(r is None for r in runs):
+            report["modules"][module] = None
+            continue
+        detail = _probe(module, importtime=True)
+        report["modules"][module] = {
+            "seconds": statistics.median(r["seconds"] for r in runs),
+            "rss_mb": statistics.median(r["rss_mb"] for r in runs),
+            "heavy_loaded": runs[0]["heavy_loaded"],
+            "slowest": detail["slowest"] if detail else [],
+        }
+    return report
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_server(port: int, ready_timeout: float) -> Dict:
+    import httpx
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    report = {"health_s": None, "health_rss_mb": None, "ready_s": None, "ready_rss_mb": None, "ready_state": None}
+    try:
+        deadline = start + ready_timeout
+        while time.perf_counter() < deadline and proc.poll() is None:
+            try:
+                if report["health_s"] is None:
+                    if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                        report["health_s"] = time.perf_counter() - start
+                        report["health_rss_mb"] = _rss_mb(proc.pid)
+                    continue
+                response = httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1)
+                report["ready_state"] = response.json().get("state")
+                if response.status_code == 200 or report["ready_state"] == "failed":
+                    if response.status_code == 200:
+                        report["ready_s"] = time.perf_counter() - start
+                        report["ready_rss_mb"] = _rss_mb(proc.pid)
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return report
+
+
+def _print_report(report: Dict):
+    imports = report.get("imports")
+    if imports:
+        base = imports["interpreter"]["rss_mb"]
+        print(f"interpreter: {base:.0f} MB RSS")
+        print(f"{'module':<28} {'import':>9} {'RSS':>8} {'+RSS':>8}  heavy deps loaded")
+        for module, entry in imports["modules"].items():
+            if entry is None:
+                print(f"{module:<28} {'n/a':>9}")
+                continue
+            print(f"{module:<28} {1000 * entry['seconds']:>7.0f}ms {entry['rss_mb']:>6.0f}MB {entry['rss_mb'] - base:>6.0f}MB"
+                  f"  {', '.join(entry['heavy_loaded']) or '-'}")
+    server = report.get("server")
+    if server:
+        fmt = lambda v, unit: f"{v:.1f} {unit}" if v is not None else "n/a"
+        print(f"server: /health after {fmt(server['health_s'], 's')} ({fmt(server['health_rss_mb'], 'MB')}), "
+              f"/ready after {fmt(server['ready_s'], 's')} ({fmt(server['ready_rss_mb'], 'MB')}), "
+              f"state {server['ready_state']}")
+
+
+def main(argv=None):
+    from .service_bench import _meta
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--skip-server", action="store_true")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="seconds to wait for /ready")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"meta": _meta(), "imports": run_imports(args.modules, args.repeat)}
+    if not args.skip_server:
+        report["server"] = run_server(args.port, args.ready_timeout)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
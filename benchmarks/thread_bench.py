@@ -0,0 +1,178 @@
+"""
+Thread-pool benchmark: inference throughput and latency per node across torch thread settings.
+
+Every combination of --processes (server processes on the node), --threads (torch intra-op
+threads per process) and --concurrency (inference workers per process, each with its own
+model) runs in fresh interpreters: torch's thread pools are sized once per process. All
+processes of a combination load the model and warm up first, then start together and run
+--requests inferences each on the bundled example page resized to --width.
+
+--threads takes numbers and two keywords:
+- auto: what the service picks (runtime.plan_threads: available cores split between
+  processes x concurrency, cgroup quota respected)
+- all:  every available core in every process (torch's default, oversubscribed when
+  processes x concurrency > 1)
+
+Reported per combination: pages/sec of the node, p50/p95/p99 latency over all requests.
+Results are written as JSON (--output) with the CPU budget and commit, so curves from
+different nodes and commits can be compared.
+
+Usage:
+  python -m benchmarks.thread_bench [--processes 1 2 4] [--threads auto all 1 2]
+      [--concurrency 1 2] [--requests 20] [--width 1700] [--output bench_threads.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from .service_bench import percentiles, sample_png
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def _child(threads: int, concurrency: int, requests: int, width: int):
+    """One benchmark process: prints "ready" once warmed up, runs after a line on stdin, prints JSON."""
+    from app.core import runtime
+    from app.core.model import load_model, predict
+
+    applied = runtime.configure_threads(runtime.ThreadPlan(threads, 1, "explicit"))
+    models = [load_model() for _ in range(concurrency)]
+    img = cv2.imdecode(np.frombuffer(sample_png(width), dtype=np.uint8), cv2.IMREAD_COLOR)
+    for model in models:
+        predict(img, model=model)
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    latencies: List[float] = []
+
+    def work(model):
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            predict(img, model=model)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(work, models))
+    print(json.dumps({"start": start, "end": time.time(), "latencies": latencies, "threads": applied}), flush=True)
+
+
+def _resolve_threads(value: str, processes: int, concurrency: int, cpus: int) -> int:
+    # auto: runtime.plan_threads without the TORCH_THREADS/OMP_NUM_THREADS overrides
+    if value == "auto":
+        return max(1, cpus // (processes * concurrency))
+    if value == "all":
+        return cpus
+    return max(1, int(value))
+
+
+def _expect(proc: subprocess.Popen, prefix: str) -> str:
+    """Next stdout line of a benchmark process starting with `prefix` (model loading may print too)."""
+    for line in proc.stdout:
+        if line.startswith(prefix):
+            return line
+    raise RuntimeError(f"benchmark process exited with code {proc.wait()}")
+
+
+def run_combination(processes: int, threads: int, concurrency: int, requests: int, width: int) -> Dict:
+    cmd = [
+        sys.executable, "-m", "benchmarks.thread_bench", "--child",
+        "--threads", str(threads), "--concurrency", str(concurrency),
+        "--requests", str(requests), "--width", str(width),
+    ]
+    procs = [
+        subprocess.Popen(cmd, cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(processes)
+    ]
+    try:
+        # Start together once every process has loaded and warmed up its models
+        for proc in procs:
+            _expect(proc, "ready")
+        for proc in procs:
+            proc.stdin.write("go\n")
+            proc.stdin.flush()
+        results = [json.loads(_expect(proc, "{")) for proc in procs]
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+    latencies = [s for r in results for s in r["latencies"]]
+    wall = max(r["end"] for r in results) - min(r["start"] for r in results)
+    return {
+        "processes": processes,
+        "threads": threads,
+        "concurrency": concurrency,
+        "applied_threads": results[0]["threads"],
+        "requests": len(latencies),
+        "pages_per_s": len(latencies) / wall if wall > 0 else 0.0,
+        "latency": percentiles(latencies),
+    }
+
+
+def _print_report(report: Dict):
+    cpus = report["cpus"]
+    print(f"cpus: {cpus['available']} available (os {cpus['os']}, affinity {cpus['affinity']}, "
+          f"cgroup quota {cpus['cgroup_quota']})")
+    print(f"{'processes':>9} {'conc':>5} {'threads':>12} {'pages/s':>9} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for entry in report["results"]:
+        label = f"{entry['threads']} ({entry['setting']})"
+        lat = entry["latency"]
+        print(f"{entry['processes']:>9} {entry['concurrency']:>5} {label:>12} {entry['pages_per_s']:>9.2f} "
+              f"{lat['p50_ms']:>8.0f}ms {lat['p95_ms']:>8.0f}ms {lat['p99_ms']:>8.0f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", nargs="+", default=["auto", "all"], help="numbers, auto or all")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1])
+    parser.add_argument("--requests", type=int, default=20, help="inferences per process")
+    parser.add_argument("--width", type=int, default=1700)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(int(args.threads[0]), args.concurrency[0], args.requests, args.width)
+        return
+
+    from app.core import runtime
+    from .service_bench import _meta
+
+    cpus = runtime.diagnostics()["cpus"]
+    report = {"meta": _meta(), "cpus": cpus, "results": []}
+    for processes in args.processes:
+        for concurrency in args.concurrency:
+            seen = set()
+            for setting in args.threads:
+                threads = _resolve_threads(setting, processes, concurrency, cpus["available"])
+                if threads in seen:
+                    continue
+                seen.add(threads)
+                entry = run_combination(processes, threads, concurrency, args.requests, args.width)
+                entry["setting"] = setting
+                report["results"].append(entry)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,10 @@ os.makedirs("/app/model_weights", exist_ok=True)
 # Use the official Dropbox link (matches iopath cache key seen in logs)
 PUBL_WEIGHT_URL = "https://www.dropbox.com/s/dgy9c10wykk4lq4/model_final.pth?dl=1"
 DEST = "/app/model_weights/publaynet_frcnn_r50_fpn_3x.pth"
+# Matching Detectron2 config (what lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config resolves to),
+# so the model can load with MODEL_OFFLINE=1
+PUBL_CONFIG_URL = "https://www.dropbox.com/s/f3b12qc4hc0yh4m/config.yml?dl=1"
+CONFIG_DEST = "/app/model_weights/publaynet_frcnn_r50_fpn_3x.yaml"
 
 
 def download_file(url, destination):
@@ -37,4 +41,9 @@ if not os.path.exists(DEST):
 else:
     print(f"Weights already present at {DEST}")
 
+if not os.path.exists(CONFIG_DEST):
+    download_file(PUBL_CONFIG_URL, CONFIG_DEST)
+else:
+    print(f"Config already present at {CONFIG_DEST}")
+
 print("Download step finished.")
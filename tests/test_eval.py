@@ -0,0 +1,308 @@
+"""
+Parity of the vectorized matcher and the single-pass AP/PR curve in app.utils.eval with
+the implementations they replaced (kept below as baseline_*), on randomized pages, and of
+the dataset AP with COCOeval's 101-point interpolation (cocoeval_ap).
+
+Pages are tie-heavy on purpose: boxes sit on a coarse grid, so many pairs share the same
+IoU and the tie-break (first unused gt with the highest IoU) decides the matching.
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from app.utils.detections import Detections
+from app.utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator, evaluate_detections, greedy_match, interpolated_ap
+
+# Mixed label types: matching compares labels as strings, so 1 and "1" are the same class
+LABELS = ["Text", "Title", "Table", 1, "1"]
+THRESHOLDS = [0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+SEEDS = range(150)
+
+
+def baseline_bbox_iou(a: List[float], b: List[float]) -> float:
+    ax1, ay1, ax2, ay2 = a
+    bx1, by1, bx2, by2 = b
+
+    inter_x1 = max(ax1, bx1)
+    inter_y1 = max(ay1, by1)
+    inter_x2 = min(ax2, bx2)
+    inter_y2 = min(ay2, by2)
+
+    inter_w = max(0.0, inter_x2 - inter_x1)
+    inter_h = max(0.0, inter_y2 - inter_y1)
+    inter_area = inter_w * inter_h
+
+    area_a = max(0.0, ax2 - ax1) * max(0.0, ay2 - ay1)
+    area_b = max(0.0, bx2 - bx1) * max(0.0, by2 - by1)
+    union = area_a + area_b - inter_area
+    if union <= 0:
+        return 0.0
+    return inter_area / union
+
+
+def baseline_greedy_match(
+    preds: List[Dict],
+    gts: List[Dict],
+    iou_threshold: float = 0.5,
+    require_label_match: bool = True,
+) -> Tuple[List[Tuple[int, int, float]], List[int], List[int]]:
+    used_gts = set()
+    matches: List[Tuple[int, int, float]] = []
+
+    for p_idx, p in enumerate(preds):
+        best_iou = 0.0
+        best_gt_idx: Optional[int] = None
+        for g_idx, g in enumerate(gts):
+            if g_idx in used_gts:
+                continue
+            if require_label_match and (str(p.get("label")) != str(g.get("label"))):
+                continue
+            iou = baseline_bbox_iou(p["bbox"], g["bbox"])
+            if iou >= iou_threshold and iou > best_iou:
+                best_iou = iou
+                best_gt_idx = g_idx
+        if best_gt_idx is not None:
+            used_gts.add(best_gt_idx)
+            matches.append((p_idx, best_gt_idx, best_iou))
+
+    matched_pred_idxs = {m[0] for m in matches}
+    matched_gt_idxs = {m[1] for m in matches}
+    unmatched_pred_idxs = [i for i in range(len(preds)) if i not in matched_pred_idxs]
+    unmatched_gt_idxs = [i for i in range(len(gts)) if i not in matched_gt_idxs]
+    return matches, unmatched_pred_idxs, unmatched_gt_idxs
+
+
+def baseline_counts(preds: List[Dict], gts: List[Dict], iou_threshold: float, require_label_match: bool = True):
+    """tp/fp/fn/matches of the previous evaluate_detections (greedy matching in descending score order)."""
+    preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    matches, unmatched_p, unmatched_g = baseline_greedy_match(
+        preds_sorted, gts, iou_threshold=iou_threshold, require_label_match=require_label_match
+    )
+    return {"tp": len(matches), "fp": len(unmatched_p), "fn": len(unmatched_g), "matches": matches}
+
+
+def baseline_ap(preds: List[Dict], gts: List[Dict], iou_threshold: float):
+    """(pr_curve, ap50) of the previous evaluate_detections: a full re-matching at every distinct score."""
+    preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    if not preds_sorted:
+        return [], 0.0
+    thresholds = sorted({float(p.get("score", 0.0)) for p in preds_sorted}, reverse=True)
+    curve_precisions: List[float] = []
+    curve_recalls: List[float] = []
+    for thr in thresholds:
+        preds_thr = [p for p in preds_sorted if float(p.get("score", 0.0)) >= thr]
+        m_thr, up_thr, ug_thr = baseline_greedy_match(preds_thr, gts, iou_threshold=iou_threshold)
+        tp, fp, fn = len(m_thr), len(up_thr), len(ug_thr)
+        curve_precisions.append(tp / (tp + fp) if (tp + fp) > 0 else 0.0)
+        curve_recalls.append(tp / (tp + fn) if (tp + fn) > 0 else 0.0)
+    paired = sorted(zip(curve_recalls, curve_precisions))
+    recalls_sorted = [r for r, _ in paired]
+    precisions_sorted = [p for _, p in paired]
+    for i in range(len(precisions_sorted) - 2, -1, -1):
+        precisions_sorted[i] = max(precisions_sorted[i], precisions_sorted[i + 1])
+    ap = 0.0
+    for i in range(1, len(recalls_sorted)):
+        ap += precisions_sorted[i] * max(0.0, recalls_sorted[i] - recalls_sorted[i - 1])
+    return list(zip(recalls_sorted, precisions_sorted)), ap
+
+
+def random_page(seed: int, grid: float = 10.0) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Ground truth and predictions on a `grid` px lattice (with some off-lattice boxes),
+    scores from a handful of values, empty and degenerate boxes included.
+    """
+    rnd = random.Random(seed)
+
+    def box():
+        if rnd.random() < 0.15:
+            x, y = rnd.uniform(0, 100), rnd.uniform(0, 100)
+            return [x, y, x + rnd.uniform(0, 40), y + rnd.uniform(0, 40)]
+        x, y = rnd.randint(0, 8) * grid, rnd.randint(0, 8) * grid
+        # A zero width/height now and then (degenerate boxes have IoU 0)
+        return [x, y, x + rnd.randint(0, 4) * grid, y + rnd.randint(0, 4) * grid]
+
+    gts = [{"bbox": box(), "label": rnd.choice(LABELS)} for _ in range(rnd.randint(0, 25))]
+    preds = []
+    for _ in range(rnd.randint(0, 30)):
+        if gts and rnd.random() < 0.6:
+            # A copy or a lattice shift of a gt: duplicates and equal IoUs
+            g = rnd.choice(gts)
+            dx, dy = rnd.choice([0, 0, grid, -grid]), rnd.choice([0, 0, grid])
+            bbox = [g["bbox"][0] + dx, g["bbox"][1] + dy, g["bbox"][2] + dx, g["bbox"][3] + dy]
+            label = g["label"] if rnd.random() < 0.8 else rnd.choice(LABELS)
+        else:
+            bbox, label = box(), rnd.choice(LABELS)
+        preds.append({"bbox": bbox, "label": label, "score": rnd.choice([0.2, 0.5, 0.5, 0.7, 0.9, 0.9, 1.0])})
+    return preds, gts
+
+
+def as_float32(items: List[Dict]) -> List[Dict]:
+    """The dicts with boxes and scores rounded to float32, as Detections stores them."""
+    out = []
+    for item in items:
+        item = dict(item, bbox=np.asarray(item["bbox"], dtype=np.float32).astype(np.float64).tolist())
+        if "score" in item:
+            item["score"] = float(np.float32(item["score"]))
+        out.append(item)
+    return out
+
+
+@pytest.mark.parametrize("iou_threshold", THRESHOLDS)
+@pytest.mark.parametrize("require_label_match", [True, False])
+def test_greedy_match_matches_baseline(iou_threshold, require_label_match):
+    for seed in SEEDS:
+        preds, gts = random_page(seed)
+        expected = baseline_greedy_match(preds, gts, iou_threshold, require_label_match)
+        assert greedy_match(preds, gts, iou_threshold, require_label_match) == expected, f"seed {seed}"
+
+
+@pytest.mark.parametrize("iou_threshold", THRESHOLDS)
+def test_evaluate_detections_matches_baseline(iou_threshold):
+    for seed in SEEDS:
+        preds, gts = random_page(seed)
+        expected = baseline_counts(preds, gts, iou_threshold)
+        result = evaluate_detections(preds, gts, iou_threshold=iou_threshold)
+        assert {key: result[key] for key in expected} == expected, f"seed {seed}"
+
+
+@pytest.mark.parametrize("iou_threshold", THRESHOLDS)
+def test_evaluate_detections_on_detections_matches_baseline(iou_threshold):
+    # Detections keep boxes as float32 and the matcher computes IoUs from float64 copies of them,
+    # so IoUs may differ from the float64 baseline in the last digits: compare those with a tolerance
+    for seed in SEEDS:
+        preds, gts = random_page(seed)
+        preds, gts = as_float32(preds), as_float32(gts)
+        expected = baseline_counts(preds, gts, iou_threshold)
+        result = evaluate_detections(Detections.from_dicts(preds), Detections.from_dicts(gts), iou_threshold=iou_threshold)
+        assert (result["tp"], result["fp"], result["fn"]) == (expected["tp"], expected["fp"], expected["fn"]), f"seed {seed}"
+        assert [m[:2] for m in result["matches"]] == [m[:2] for m in expected["matches"]], f"seed {seed}"
+        assert [m[2] for m in result["matches"]] == pytest.approx(
+            [m[2] for m in expected["matches"]], rel=1e-6, abs=1e-9
+        ), f"seed {seed}"
+
+
+@pytest.mark.parametrize("iou_threshold", THRESHOLDS)
+def test_single_pass_ap_matches_rematching(iou_threshold):
+    for seed in SEEDS:
+        preds, gts = random_page(seed)
+        curve, ap = baseline_ap(preds, gts, iou_threshold)
+        result = evaluate_detections(preds, gts, iou_threshold=iou_threshold)
+        assert result["pr_curve"] == curve, f"seed {seed}"
+        assert result["ap50"] == ap, f"seed {seed}"
+
+
+@pytest.mark.parametrize("iou_threshold", THRESHOLDS)
+def test_single_pass_ap_on_detections_matches_rematching(iou_threshold):
+    for seed in SEEDS:
+        preds, gts = random_page(seed)
+        preds, gts = as_float32(preds), as_float32(gts)
+        curve, ap = baseline_ap(preds, gts, iou_threshold)
+        result = evaluate_detections(Detections.from_dicts(preds), Detections.from_dicts(gts), iou_threshold=iou_threshold)
+        assert np.asarray(result["pr_curve"]).reshape(-1, 2) == pytest.approx(np.asarray(curve).reshape(-1, 2), abs=1e-12)
+        assert result["ap50"] == pytest.approx(ap, abs=1e-12), f"seed {seed}"
+
+
+def test_iou_threshold_zero_needs_overlap():
+    # At threshold 0 a pred still needs a positive IoU to match, as before
+    preds = [{"bbox": [0, 0, 10, 10], "label": "Text", "score": 0.9}]
+    gts = [{"bbox": [20, 20, 30, 30], "label": "Text"}, {"bbox": [10, 0, 20, 10], "label": "Text"}]
+    assert greedy_match(preds, gts, iou_threshold=0.0) == baseline_greedy_match(preds, gts, iou_threshold=0.0)
+    assert greedy_match(preds, gts, iou_threshold=0.0)[0] == []
+
+
+def cocoeval_ap(tp_flags, num_gts):
+    """AP of one class at one IoU threshold as pycocotools' COCOeval.accumulate computes it (101 recall points)."""
+    rec_thrs = np.linspace(0.0, 1.00, int(np.round((1.00 - 0.0) / 0.01)) + 1, endpoint=True)
+    tps = np.asarray(tp_flags, dtype=bool)
+    tp_sum = np.cumsum(tps).astype(float)
+    fp_sum = np.cumsum(~tps).astype(float)
+    rc = tp_sum / num_gts
+    pr = (tp_sum / (fp_sum + tp_sum + np.spacing(1))).tolist()
+    q = [0.0] * len(rec_thrs)
+    for i in range(len(pr) - 1, 0, -1):
+        if pr[i] > pr[i - 1]:
+            pr[i - 1] = pr[i]
+    inds = np.searchsorted(rc, rec_thrs, side="left")
+    try:
+        for ri, pi in enumerate(inds):
+            q[ri] = pr[pi]
+    except IndexError:
+        pass
+    return float(np.mean(q))
+
+
+def test_interpolated_ap_matches_cocoeval():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        n = int(rng.integers(1, 60))
+        flags = rng.random(n) < rng.random()
+        num_gts = int(flags.sum() + rng.integers(0, 10)) or 1
+        assert interpolated_ap(flags, num_gts) == pytest.approx(cocoeval_ap(flags, num_gts), abs=1e-12)
+
+
+def baseline_dataset_ap(pages: List[Tuple[List[Dict], List[Dict]]], iou_thresholds: List[float]) -> Dict[str, float]:
+    """
+    Per-class AP over pages, from the predictions and ground truth alone: every page matched
+    with baseline_greedy_match at each threshold, detections pooled per class in descending
+    score order (ties by page, then by rank in the page) and interpolated as COCOeval does.
+    """
+    gt_counts: Dict[str, int] = {}
+    ranked: Dict[str, List[Tuple[float, int, int, List[bool]]]] = {}
+    for page, (preds, gts) in enumerate(pages):
+        for g in gts:
+            gt_counts[str(g["label"])] = gt_counts.get(str(g["label"]), 0) + 1
+        preds_sorted = sorted(preds, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+        matched = [
+            {m[0] for m in baseline_greedy_match(preds_sorted, gts, iou_threshold=thr)[0]} for thr in iou_thresholds
+        ]
+        for rank, p in enumerate(preds_sorted):
+            ranked.setdefault(str(p["label"]), []).append(
+                (float(p.get("score", 0.0)), page, rank, [rank in m for m in matched])
+            )
+    aps = {}
+    for label, num_gts in gt_counts.items():
+        detections = sorted(ranked.get(label, []), key=lambda d: (-d[0], d[1], d[2]))
+        aps[label] = float(np.mean([
+            cocoeval_ap([d[3][t] for d in detections], num_gts) for t in range(len(iou_thresholds))
+        ]))
+    return aps
+
+
+def test_accumulator_ap_matches_independent_baseline():
+    pages = [random_page(seed) for seed in SEEDS]
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=0.5)
+    for preds, gts in pages:
+        accumulator.add(preds, gts)
+    summary = accumulator.summary()
+    expected = baseline_dataset_ap(pages, COCO_IOU_THRESHOLDS)
+    evaluated = {label: entry["ap"] for label, entry in summary["per_class"].items() if entry["ap"] is not None}
+    assert evaluated.keys() == expected.keys()
+    for label, ap in expected.items():
+        assert evaluated[label] == pytest.approx(ap, abs=1e-12), label
+    assert summary["map"] == pytest.approx(float(np.mean(list(expected.values()))), abs=1e-12)
+
+
+def test_accumulator_ap_hand_computed():
+    gts = [{"bbox": [0, 0, 10, 10], "label": "Text"}, {"bbox": [20, 0, 30, 10], "label": "Text"}]
+    preds = [
+        {"bbox": [0, 0, 10, 10], "label": "Text", "score": 0.9},  # TP
+        {"bbox": [50, 50, 60, 60], "label": "Text", "score": 0.8},  # FP
+        {"bbox": [20, 0, 30, 10], "label": "Text", "score": 0.7},  # TP
+    ]
+    accumulator = DetectionAccumulator(COCO_IOU_THRESHOLDS)
+    accumulator.add(preds, gts)
+    # Recall 0.5 at precision 1, then 1.0 at 2/3: recall points 0.00-0.50 (51) sample 1, 0.51-1.00 (50) sample 2/3
+    # (the area under the curve would be 0.8333)
+    expected = (51 * 1.0 + 50 * 2 / 3) / 101
+    summary = accumulator.summary()
+    assert summary["per_class"]["Text"]["ap"] == pytest.approx(expected, abs=1e-12)
+    assert summary["map"] == pytest.approx(expected, abs=1e-12)
+
+    # A class with no detections at all has AP 0; one without ground truth is left out of mAP
+    accumulator.add([{"bbox": [0, 0, 5, 5], "label": "Figure", "score": 0.5}], [{"bbox": [0, 0, 5, 5], "label": "Table"}])
+    summary = accumulator.summary()
+    assert summary["per_class"]["Table"]["ap"] == 0.0
+    assert summary["per_class"]["Figure"]["ap"] is None
+    assert summary["map"] == pytest.approx(expected / 2, abs=1e-12)
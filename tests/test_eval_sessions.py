@@ -0,0 +1,104 @@
+"""
+Evaluation session stores (app.core.eval_sessions): outcomes survive the round trip
+through the store (packed TP flags in sqlite), and the incremental summary() equals a
+DetectionAccumulator fed the same images from scratch.
+"""
+import json
+import random
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+
+from app.core.eval_sessions import MemoryEvalSessionStore, SqliteEvalSessionStore
+from app.utils.eval import COCO_IOU_THRESHOLDS, DetectionAccumulator
+
+LABELS = ["Text", "Title", "Table"]
+# 0.33 is not a COCO threshold: its TP flags are stored as an extra column
+IOU_THRESHOLDS = [0.5, 0.55, 0.33]
+
+
+def random_page(rnd: random.Random) -> Tuple[List[Dict], List[Dict]]:
+    """Ground truth and jittered predictions of one page; detection counts are rarely a multiple of 8."""
+    gts, preds = [], []
+    for _ in range(rnd.randint(0, 15)):
+        x, y = rnd.uniform(0, 800), rnd.uniform(0, 800)
+        gt = {"bbox": [x, y, x + rnd.uniform(10, 200), y + rnd.uniform(10, 100)], "label": rnd.choice(LABELS)}
+        gts.append(gt)
+        if rnd.random() < 0.8:
+            label = gt["label"] if rnd.random() < 0.9 else rnd.choice(LABELS)
+            preds.append({"bbox": [v + rnd.uniform(-15, 15) for v in gt["bbox"]], "label": label, "score": rnd.random()})
+    for _ in range(rnd.randint(0, 3)):
+        x, y = rnd.uniform(0, 800), rnd.uniform(0, 800)
+        preds.append({"bbox": [x, y, x + 50, y + 20], "label": rnd.choice(LABELS), "score": rnd.random()})
+    return preds, gts
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def stores(request, tmp_path):
+    """Two handles on one store: two server processes sharing a sqlite file, or one in-memory store."""
+    if request.param == "memory":
+        store = MemoryEvalSessionStore()
+        return store, store
+    path = str(tmp_path / "sessions.sqlite3")
+    return SqliteEvalSessionStore(path), SqliteEvalSessionStore(path)
+
+
+@pytest.mark.parametrize("iou_threshold", IOU_THRESHOLDS)
+def test_outcomes_round_trip(stores, iou_threshold):
+    writer, reader = stores
+    matcher = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=iou_threshold)
+    rnd = random.Random(1)
+    outcomes = [matcher.match(*random_page(rnd)) for _ in range(12)]
+    session_id = writer.create(iou_threshold, COCO_IOU_THRESHOLDS)["id"]
+    assert writer.add(session_id, outcomes[:5]) == 5
+    assert writer.add(session_id, outcomes[5:]) == 12
+
+    record, stored = reader.outcomes(session_id)
+    assert record["images"] == 12
+    assert len(stored) == 12
+    for original, restored in zip(outcomes, stored):
+        assert restored.flags.shape == original.flags.shape == (len(original.labels), len(matcher.flag_thresholds))
+        np.testing.assert_array_equal(restored.flags, original.flags)
+        np.testing.assert_array_equal(restored.scores, original.scores)
+        assert restored.labels == original.labels
+        assert restored.gt_counts == original.gt_counts
+        assert (restored.tp, restored.fp, restored.fn, restored.iou_sum) == (
+            original.tp, original.fp, original.fn, original.iou_sum
+        )
+
+    _, tail = reader.outcomes(session_id, start=9)
+    assert [o.labels for o in tail] == [o.labels for o in outcomes[9:]]
+
+
+@pytest.mark.parametrize("iou_threshold", IOU_THRESHOLDS)
+def test_incremental_summary_matches_fresh_accumulator(stores, iou_threshold):
+    first, second = stores
+    matcher = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=iou_threshold)
+    session_id = first.create(iou_threshold, COCO_IOU_THRESHOLDS)["id"]
+    rnd = random.Random(2)
+    pages = [random_page(rnd) for _ in range(24)]
+
+    for step in range(4):
+        chunk = pages[6 * step:6 * (step + 1)]
+        # Images added through either handle, summaries polled through both in between
+        (first if step % 2 else second).add(session_id, [matcher.match(preds, gts) for preds, gts in chunk])
+        expected = DetectionAccumulator(COCO_IOU_THRESHOLDS, iou_threshold=iou_threshold)
+        for preds, gts in pages[:6 * (step + 1)]:
+            expected.add(preds, gts)
+        for store in (first, second):
+            for pr_curves in (False, True):
+                summary = store.summary(session_id, pr_curves)
+                assert json.dumps(summary) == json.dumps(expected.summary(pr_curves))
+                # Unchanged session: the cached summary is returned as is
+                assert store.summary(session_id, pr_curves) is summary
+
+
+def test_deleted_session_has_no_summary(stores):
+    first, second = stores
+    session_id = first.create(0.5, COCO_IOU_THRESHOLDS)["id"]
+    assert second.summary(session_id)["images"] == 0
+    assert first.delete(session_id)
+    assert second.summary(session_id) is None
+    assert second.outcomes(session_id) is None
+    assert first.add(session_id, []) is None
@@ -0,0 +1,81 @@
+"""
+Page size from image headers (app.utils.images), which the memory admission estimate
+and the pixel limit rely on: PNG, JPEG, WebP and BMP headers, and the reduced JPEG
+decode size.
+"""
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.images import decode_image, decoded_size, image_size, jpeg_size, reduction_factor
+
+HEIGHT, WIDTH = 37, 53
+
+
+def encoded(ext: str, height: int = HEIGHT, width: int = WIDTH, params=(), channels: int = 3) -> bytes:
+    img = np.random.default_rng(0).integers(0, 255, (height, width, channels), dtype=np.uint8)
+    ok, data = cv2.imencode(ext, img, list(params))
+    assert ok
+    return data.tobytes()
+
+
+@pytest.mark.parametrize("ext, params", [
+    (".png", ()),
+    (".jpg", ()),
+    (".jpg", (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)),
+    (".bmp", ()),
+    (".webp", (cv2.IMWRITE_WEBP_QUALITY, 101)),  # lossless: VP8L
+    (".webp", (cv2.IMWRITE_WEBP_QUALITY, 80)),  # lossy: VP8
+])
+def test_image_size_from_header(ext, params):
+    data = encoded(ext, params=params)
+    assert image_size(data) == (HEIGHT, WIDTH)
+    assert image_size(memoryview(data)) == (HEIGHT, WIDTH)
+
+
+def test_webp_extended_header():
+    # VP8X: flags, reserved, then canvas width - 1 and height - 1 as 24-bit little endian
+    payload = bytes(4) + (WIDTH - 1).to_bytes(3, "little") + (HEIGHT - 1).to_bytes(3, "little")
+    data = b"RIFF" + struct.pack("<I", 4 + 8 + len(payload)) + b"WEBP" + b"VP8X" + struct.pack("<I", len(payload)) + payload
+    assert image_size(data) == (HEIGHT, WIDTH)
+
+
+def test_top_down_bmp():
+    data = bytearray(encoded(".bmp"))
+    # Negative height: rows stored top-down
+    data[22:26] = struct.pack("<i", -HEIGHT)
+    assert image_size(bytes(data)) == (HEIGHT, WIDTH)
+
+
+def test_jpeg_size_only_reads_jpeg():
+    assert jpeg_size(encoded(".jpg")) == (HEIGHT, WIDTH)
+    assert jpeg_size(encoded(".png")) is None
+
+
+@pytest.mark.parametrize("data", [b"", b"\xff\xd8", b"not an image at all, really not", b"\x89PNG\r\n\x1a\n"])
+def test_unknown_or_truncated_data(data):
+    assert image_size(data) is None
+
+
+@pytest.mark.parametrize("height, width, expected", [
+    (1100, 850, 1),  # about the model input already
+    (2200, 1700, 2),
+    (4400, 3400, 4),
+    (9000, 7000, 8),
+    (20000, 100, 8),  # long side capped at max_size: the model shrinks the page anyway
+    (0, 100, 1),
+])
+def test_reduction_factor(height, width, expected):
+    assert reduction_factor(height, width, 800, 1333) == expected
+
+
+@pytest.mark.parametrize("ext", [".jpg", ".png"])
+def test_decoded_size_matches_decode(ext):
+    data = encoded(ext, height=3301, width=2551)
+    img, _ = decode_image(data, 800, 1333)
+    assert decoded_size(data, 800, 1333) == img.shape[:2]
+    # Only JPEGs are decoded reduced
+    assert decoded_size(data, 800, 1333) == ((1651, 1276) if ext == ".jpg" else (3301, 2551))
+    assert decoded_size(data) == (3301, 2551)
@@ -0,0 +1,125 @@
+"""
+Job queues (app.core.jobs): claiming in submit order, exactly once across processes
+sharing a sqlite file, requeueing of stale running jobs and the TTL purge.
+"""
+import threading
+import types
+
+import pytest
+
+from app.core import jobs
+from app.core.jobs import DONE, FAILED, QUEUED, RUNNING, MemoryJobQueue, SqliteJobQueue
+
+FILES = [("a.png", "image/png", b"\x89PNG a"), ("b.pdf", "application/pdf", b"%PDF b")]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() of the job queues."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(jobs, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobQueue(ttl=100.0)
+    return SqliteJobQueue(str(tmp_path / "jobs.sqlite3"), ttl=100.0, stale_after=60.0)
+
+
+def test_claims_in_submit_order(queue, clock):
+    ids = []
+    for i in range(3):
+        ids.append(queue.submit("detect", {"dpi": 100 + i}, FILES[i:]))
+        clock[0] += 1.0
+    claimed = [queue.claim() for _ in range(3)]
+    assert [job["id"] for job, _ in claimed] == ids
+    assert [job["params"] for job, _ in claimed] == [{"dpi": 100}, {"dpi": 101}, {"dpi": 102}]
+    assert [files for _, files in claimed] == [FILES, FILES[1:], []]
+    assert all(job["status"] == RUNNING for job, _ in claimed)
+    assert queue.claim() is None
+    assert queue.counts() == {QUEUED: 0, RUNNING: 3, DONE: 0, FAILED: 0}
+
+
+def test_finish_and_ttl_purge(queue, clock):
+    done_id = queue.submit("detect", {}, FILES)
+    failed_id = queue.submit("evaluate", {}, FILES)
+    queued_id = queue.submit("detect", {}, FILES)
+    queue.claim()
+    queue.claim()
+    queue.progress(done_id, 2, 2)
+    queue.finish(done_id, {"pages": [1, 2]})
+    queue.finish(failed_id, None, "boom")
+
+    assert queue.get(done_id)["status"] == DONE
+    assert (queue.get(done_id)["done"], queue.get(done_id)["total"]) == (2, 2)
+    assert queue.result(done_id) == {"pages": [1, 2]}
+    assert queue.get(failed_id)["status"] == FAILED
+    assert queue.get(failed_id)["error"] == "boom"
+    assert queue.result(failed_id) is None
+
+    clock[0] += 99.0
+    assert queue.purge() == 0
+    clock[0] += 2.0
+    assert queue.purge() == 2
+    assert queue.get(done_id) is None
+    assert queue.get(failed_id) is None
+    assert queue.result(done_id) is None
+    # Unfinished jobs are never purged, however old
+    assert queue.get(queued_id)["status"] == QUEUED
+    assert queue.claim()[1] == FILES
+
+
+def test_stale_running_job_is_requeued(tmp_path, clock):
+    path = str(tmp_path / "jobs.sqlite3")
+    first = SqliteJobQueue(path, stale_after=60.0)
+    second = SqliteJobQueue(path, stale_after=60.0)
+    job_id = first.submit("detect", {}, FILES)
+    assert first.claim()[0]["id"] == job_id
+
+    # Running and recently updated: not claimable by the other process
+    clock[0] += 59.0
+    assert second.claim() is None
+    first.progress(job_id, 1)
+    clock[0] += 59.0
+    assert second.claim() is None
+
+    # No update for longer than stale_after: the claiming process is presumed dead
+    clock[0] += 2.0
+    job, files = second.claim()
+    assert job["id"] == job_id
+    assert files == FILES
+    assert second.get(job_id)["status"] == RUNNING
+    # Requeued once: the new owner's claim refreshed it
+    assert first.claim() is None
+
+    second.finish(job_id, {"pages": []})
+    clock[0] += 1000.0
+    assert first.claim() is None
+    assert first.get(job_id)["status"] == DONE
+
+
+def test_two_claimers_take_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    submitter = SqliteJobQueue(path)
+    ids = {submitter.submit("detect", {"n": i}, FILES[:1]) for i in range(40)}
+    claimers = [SqliteJobQueue(path), SqliteJobQueue(path)]
+    claimed = [[], []]
+
+    def work(k):
+        while True:
+            got = claimers[k].claim()
+            if got is None:
+                return
+            claimed[k].append(got[0]["id"])
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = claimed[0] + claimed[1]
+    assert sorted(all_claimed) == sorted(ids)
+    assert submitter.counts()[RUNNING] == 40
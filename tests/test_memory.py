@@ -0,0 +1,133 @@
+"""
+MemoryBudget (app.core.memory): FIFO grants, the wait timeout, oversize rejection and
+waiters that are cancelled leaving no reservation behind.
+"""
+import asyncio
+
+import pytest
+
+from app.core.memory import MemoryBudget, MemoryBudgetError
+
+
+async def settle():
+    """Lets every ready task run."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_grants_in_fifo_order():
+    async def main():
+        budget = MemoryBudget(100, wait_s=5.0)
+        await budget.acquire(60)
+        granted = []
+
+        async def request(name, nbytes):
+            await budget.acquire(nbytes)
+            granted.append(name)
+
+        tasks = [asyncio.ensure_future(request(name, nbytes)) for name, nbytes in (("a", 80), ("b", 30), ("c", 10))]
+        await settle()
+        # c would fit next to the 60 bytes held, but waits behind a and b
+        assert granted == []
+        assert budget.stats()["waiting"] == 3
+
+        budget.release(60)
+        await settle()
+        # b does not fit next to a; c is not let past it
+        assert granted == ["a"]
+        assert budget.reserved == 80
+
+        budget.release(80)
+        await asyncio.gather(*tasks)
+        assert granted == ["a", "b", "c"]
+        assert budget.reserved == 40
+        assert budget.stats()["waiting"] == 0
+
+    asyncio.run(main())
+
+
+def test_wait_timeout():
+    async def main():
+        budget = MemoryBudget(100, wait_s=0.05)
+        await budget.acquire(100)
+        with pytest.raises(MemoryBudgetError) as info:
+            await budget.acquire(10)
+        assert info.value.too_large is False
+        assert budget.reserved == 100
+        assert budget.stats()["waiting"] == 0
+        # wait_forever ignores wait_s
+        task = asyncio.ensure_future(budget.acquire(10, wait_forever=True))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        budget.release(100)
+        await task
+        assert budget.reserved == 10
+
+    asyncio.run(main())
+
+
+def test_oversize_is_rejected_at_once():
+    async def main():
+        budget = MemoryBudget(100, wait_s=5.0)
+        await budget.acquire(50)
+        with pytest.raises(MemoryBudgetError) as info:
+            await budget.acquire(101)
+        assert info.value.too_large is True
+        assert info.value.nbytes == 101
+        assert budget.reserved == 50
+        assert budget.stats()["rejected"] == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        budget = MemoryBudget(100, wait_s=5.0)
+        await budget.acquire(100)
+        first = asyncio.ensure_future(budget.acquire(50))
+        second = asyncio.ensure_future(budget.acquire(30))
+        await settle()
+        first.cancel()
+        await settle()
+        assert first.cancelled()
+        assert budget.stats()["waiting"] == 1
+
+        budget.release(100)
+        await second
+        assert budget.reserved == 30
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_as_it_is_granted_does_not_leak():
+    async def main():
+        budget = MemoryBudget(100, wait_s=5.0)
+        await budget.acquire(100)
+        waiter = asyncio.ensure_future(budget.acquire(50))
+        await settle()
+        # Granted by the release, cancelled before the waiting task got to run
+        budget.release(100)
+        assert budget.reserved == 50
+        waiter.cancel()
+        await settle()
+        assert waiter.done()
+        assert budget.stats()["waiting"] == 0
+        if waiter.cancelled():
+            # The bytes were handed back
+            assert budget.reserved == 0
+        else:
+            # The cancellation lost the race (asyncio.wait_for before 3.12): the caller owns the bytes
+            assert budget.reserved == 50
+            budget.release(50)
+            assert budget.reserved == 0
+
+    asyncio.run(main())
+
+
+def test_disabled_budget_grants_everything():
+    async def main():
+        budget = MemoryBudget(0)
+        async with budget.reserve(10 ** 12):
+            assert budget.reserved == 0
+
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Tiled inference merging (app.core.tiling): the grid covers the page with the requested
+overlap, and merge_tile_detections joins blocks cut by a seam, fuses duplicates from
+the overlap band and keeps classes apart.
+"""
+import numpy as np
+import pytest
+
+from app.core.tiling import cut_edges, merge_tile_detections, tile_grid
+
+
+def spans(tiles, axis: int):
+    """Distinct (start, end) of the tiles along x (axis 0) or y (axis 1), in order."""
+    return sorted({(tile[axis], tile[axis + 2]) for tile in tiles})
+
+
+@pytest.mark.parametrize("height, width, tile_size, overlap", [
+    (1000, 1000, 600, 200),
+    (3508, 2480, 1333, 128),
+    (5000, 700, 1024, 64),
+    (1333, 1333, 1333, 100),
+    (2000, 2000, 512, 400),  # overlap capped at half a tile
+    (599, 1801, 600, 0),
+])
+def test_tile_grid_covers_page_with_overlap(height, width, tile_size, overlap):
+    tiles = tile_grid(height, width, tile_size, overlap)
+    min_overlap = min(overlap, tile_size // 2)
+    for axis, length in ((0, width), (1, height)):
+        row = spans(tiles, axis)
+        assert row[0][0] == 0
+        assert row[-1][1] == length
+        for start, end in row:
+            assert end - start == min(tile_size, length)
+        for (_, prev_end), (start, _) in zip(row, row[1:]):
+            assert prev_end - start >= min_overlap
+    # Every row/column combination, once
+    assert len(tiles) == len(spans(tiles, 0)) * len(spans(tiles, 1)) == len(set(tiles))
+
+
+def tile_detections(page_boxes, tiles, height, width):
+    """What each tile would see of the page boxes (clipped to the tile), with cut flags."""
+    boxes, labels, scores, cut = [], [], [], []
+    for tile in tiles:
+        x0, y0, x1, y1 = tile
+        for box, label, score in page_boxes:
+            clipped = [max(box[0], x0), max(box[1], y0), min(box[2], x1), min(box[3], y1)]
+            if clipped[0] < clipped[2] and clipped[1] < clipped[3]:
+                boxes.append(clipped)
+                labels.append(label)
+                scores.append(score)
+                cut.append(cut_edges(np.array([clipped], dtype=np.float64), tile, height, width)[0])
+    return np.array(boxes, dtype=np.float64), labels, np.array(scores), np.array(cut)
+
+
+def test_box_cut_by_seam_is_rejoined():
+    height, width = 800, 1000
+    tiles = tile_grid(height, width, 600, 200)
+    assert spans(tiles, 0) == [(0, 600), (400, 1000)]
+    boxes, labels, scores, cut = tile_detections([([300, 100, 700, 180], "Text", 0.9)], tiles, height, width)
+    # Seen as [300, 600] and [400, 700] by the two tiles, both cut by an interior edge
+    assert len(boxes) == 2 and cut.all()
+
+    merged, merged_labels, merged_scores = merge_tile_detections(boxes, labels, scores, cut)
+    np.testing.assert_allclose(merged, [[300, 100, 700, 180]])
+    assert merged_labels == ["Text"]
+    np.testing.assert_allclose(merged_scores, [0.9])
+
+
+def test_page_edges_do_not_count_as_cuts():
+    tile = (0, 0, 600, 600)
+    boxes = np.array([[0, 0, 100, 100], [500, 500, 600, 600], [100, 100, 200, 200]], dtype=np.float64)
+    np.testing.assert_array_equal(cut_edges(boxes, tile, 600, 600), [False, False, False])
+    np.testing.assert_array_equal(cut_edges(boxes, tile, 1000, 1000), [False, True, False])
+
+
+def test_duplicate_in_overlap_is_fused():
+    boxes = np.array([[450, 100, 550, 200], [454, 104, 554, 204]], dtype=np.float64)
+    merged, labels, scores = merge_tile_detections(boxes, ["Table", "Table"], np.array([0.9, 0.6]), np.zeros(2, dtype=bool))
+    assert labels == ["Table"]
+    # Score-weighted average of the two boxes, the best score kept
+    np.testing.assert_allclose(merged, [(boxes[0] * 0.9 + boxes[1] * 0.6) / 1.5])
+    np.testing.assert_allclose(scores, [0.9])
+
+
+def test_cut_piece_is_absorbed_by_containing_box():
+    # Whole block from one tile, a piece of it cut by the other tile's edge
+    boxes = np.array([[300, 100, 700, 300], [300, 100, 600, 300]], dtype=np.float64)
+    merged, labels, scores = merge_tile_detections(boxes, ["Figure", "Figure"], np.array([0.7, 0.8]), np.array([False, True]))
+    np.testing.assert_allclose(merged, [[300, 100, 700, 300]])
+    assert labels == ["Figure"]
+    np.testing.assert_allclose(scores, [0.8])
+
+
+def test_different_classes_are_not_merged():
+    boxes = np.array([[450, 100, 550, 200], [450, 100, 550, 200], [300, 300, 600, 350], [400, 300, 700, 350]], dtype=np.float64)
+    labels = ["Text", "Title", "Text", "List"]
+    merged, merged_labels, scores = merge_tile_detections(
+        boxes, labels, np.array([0.9, 0.8, 0.7, 0.6]), np.array([False, False, True, True])
+    )
+    assert merged_labels == labels
+    np.testing.assert_allclose(merged, boxes)
+    np.testing.assert_allclose(scores, [0.9, 0.8, 0.7, 0.6])
+
+
+def test_empty_input():
+    merged, labels, scores = merge_tile_detections(np.zeros((0, 4)), [], np.zeros(0), np.zeros(0, dtype=bool))
+    assert merged.shape == (0, 4)
+    assert labels == []
+    assert scores.shape == (0,)